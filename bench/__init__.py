@@ -0,0 +1,74 @@
+"""
+Description: Registers and runs the benchmarks in this directory
+
+A benchmark is a function decorated with @benchmark that does its setup and
+returns the callable to time.  The callable is run `number` times per
+repeat and the fastest repeat is kept, which is the least disturbed by
+whatever else the machine is doing.  A benchmark that cannot run here, for
+example because Kivy is not installed, raises SkipBenchmark.
+"""
+
+import os
+import time
+import logging
+
+BENCHMARKS = []
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark that cannot run in this environment"""
+
+def benchmark(name, number=1000, repeat=5, unit='op'):
+    """Registers a benchmark.
+
+    Args:
+        name: the name of the result
+        number: how many times to call the timed callable per repeat
+        repeat: how many repeats to take the fastest of
+        unit: what one call of the timed callable does, for the report
+    """
+    def register(function):
+        BENCHMARKS.append((name, function, number, repeat, unit))
+        return function
+    return register
+
+def load_benchmarks(root='bench'):
+    """Imports every bench_*.py module so its benchmarks register"""
+    for f in sorted(os.listdir(root)):
+        if f[:6] == 'bench_' and f[-3:] == '.py':
+            logging.info('Loading %s', f)
+            __import__('bench.' + f[:-3])
+
+def run_benchmark(function, number, repeat, unit):
+    """Runs one benchmark and returns its result as a dict"""
+    try:
+        timed = function()
+    except SkipBenchmark as e:
+        return {'skipped': str(e)}
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(number):
+            timed()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    per_op = best / number
+    return {'seconds_per_op': per_op,
+            'ops_per_second': 1 / per_op if per_op else None,
+            'unit': unit,
+            'number': number,
+            'repeat': repeat}
+
+def run_benchmarks(names=None):
+    """Runs every registered benchmark, or only those named
+
+    Returns:
+        a dict of benchmark name to result
+    """
+    results = {}
+    for name, function, number, repeat, unit in BENCHMARKS:
+        if names and name not in names:
+            continue
+        logging.info('Running %s', name)
+        results[name] = run_benchmark(function, number, repeat, unit)
+    return results
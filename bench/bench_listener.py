@@ -0,0 +1,96 @@
+"""Benchmarks of the OLAListener side, which need neither Kivy nor olad"""
+
+import array
+from Queue import Queue, Empty
+from bench import benchmark, SkipBenchmark
+from olalistener import OLAListener, FrameMailbox, UIEvent
+from test.test_olalistener import MockSelectServer, MockOlaClient
+
+_EVENTS_PER_CALL = 100
+_UNIVERSES = 8
+
+def create_listener(ui_queue=None, frame_mailbox=None):
+  """Builds an OLAListener connected to a mock olad, without its thread"""
+  if ui_queue is None:
+    ui_queue = Queue()
+  ola_listener = OLAListener(ui_queue, MockSelectServer,
+    lambda close_callback=None: MockOlaClient(), None, None, frame_mailbox)
+  ola_listener.connect()
+  return ola_listener
+
+def drain(ui_queue, frame_mailbox):
+  """Runs queued events the way RPiUI.display_tasks does, without Kivy"""
+  while True:
+    try:
+      event = ui_queue.get(False)
+    except Empty:
+      break
+    event.run()
+  for event in frame_mailbox.collect():
+    event.run()
+
+@benchmark('listener_events_to_ui', number=100, unit='100 events')
+def listener_events_to_ui():
+  """Requests through the OLAListener, onto the ui_queue and run"""
+  ui_queue = Queue()
+  frame_mailbox = FrameMailbox()
+  ola_listener = create_listener(ui_queue, frame_mailbox)
+  data = array.array('B', [0] * 512)
+  def run():
+    for i in xrange(_EVENTS_PER_CALL):
+      ola_listener.send_dmx(1, data, None)
+    drain(ui_queue, frame_mailbox)
+  return run
+
+@benchmark('frame_fanout', number=2000, unit='frame')
+def frame_fanout():
+  """A DMX frame copied and posted to two subscribers"""
+  ola_listener = create_listener()
+  ola_listener.dmx_subscribers[1] = [(lambda data: None, True),
+                                     (lambda data: None, True)]
+  data_received = ola_listener.frame_fanout(1)
+  frame = array.array('B', range(256) * 2)
+  def run():
+    data_received(frame)
+    ola_listener.frame_mailbox.collect()
+  return run
+
+@benchmark('output_scheduler_tick', number=1000,
+           unit='tick of %d changed universes' % _UNIVERSES)
+def output_scheduler_tick():
+  """One tick of the DMXOutputScheduler with every universe changed"""
+  ola_listener = create_listener()
+  ola_listener.selectserver.AddEvent = lambda time_in_ms, callback: None
+  output = ola_listener.output
+  for universe in xrange(_UNIVERSES):
+    output.set_frame(universe, array.array('B', [0] * 512))
+  universes = output.universes.values()
+  def run():
+    for universe in universes:
+      universe.dirty = True
+    output.tick(output._generation, output.origin)
+  return run
+
+@benchmark('recorder_encode_delta', number=2000, unit='frame')
+def recorder_encode_delta():
+  """Delta encoding of a frame where a sixteenth of the channels moved"""
+  from dmxrecorder import encode_delta
+  old = '\x00' * 512
+  new = ''.join(chr(i % 256) if i % 16 == 0 else '\x00' for i in xrange(512))
+  return lambda: encode_delta(old, new)
+
+@benchmark('cue_render', number=500,
+           unit='frame of 10 cues over %d universes' % _UNIVERSES)
+def cue_render():
+  """A 10-cue stack of mixed LTP and HTP cues, all mid-fade"""
+  from cueengine import CueEngine, HTP, LTP
+  try:
+    engine = CueEngine(range(_UNIVERSES))
+  except ImportError:
+    raise SkipBenchmark('NumPy is not installed')
+  for cue in xrange(10):
+    engine.store_cue(cue, dict((universe, [cue * 20] * 512)
+                               for universe in xrange(_UNIVERSES)),
+                     fade_time=3600, merge=HTP if cue % 2 else LTP)
+    engine.go(cue)
+  return engine.render
@@ -0,0 +1,88 @@
+"""Benchmarks of the Kivy screens; skipped when Kivy is not installed"""
+
+import array
+from Queue import Queue
+from bench import benchmark, SkipBenchmark
+from bench.bench_listener import create_listener
+from olalistener import FrameMailbox
+
+_SIZES = [(800, 480), (480, 800), (1024, 600), (320, 240)]
+
+def import_ui():
+  """Imports the application, or skips the benchmark without Kivy"""
+  try:
+    import main
+  except ImportError as e:
+    raise SkipBenchmark('Kivy is not available: %s' % e)
+  return main
+
+def create_screens(main, ola_listener):
+  """Builds the three screens the way RPiUI.build does"""
+  service = main.UniverseSelectedService()
+  service.selected_universe = main.Universe(1, 'Bench', main.Universe.LTP)
+  monitor = main.MonitorScreen(ola_listener, service, main.CELLS_MODE,
+                               name='DMX Monitor')
+  console = main.ConsoleScreen(ola_listener, service, name='DMX Console')
+  settings = main.MainScreen(ola_listener, service, name='Device Settings')
+  return monitor, console, settings
+
+@benchmark('display_tasks', number=100, unit='tick with 100 events')
+def display_tasks():
+  """RPiUI.display_tasks draining events put by the OLAListener"""
+  main = import_ui()
+  app = main.RPiUI()
+  app.ui_queue = Queue()
+  app.frame_mailbox = FrameMailbox()
+  app.EVENT_DRAIN_BUDGET = 60
+  ola_listener = create_listener(app.ui_queue, app.frame_mailbox)
+  data = array.array('B', [0] * 512)
+  def run():
+    for i in xrange(100):
+      ola_listener.send_dmx(1, data, None)
+    app.display_tasks()
+  return run
+
+@benchmark('screen_startup', number=1, repeat=3, unit='build of 3 screens')
+def screen_startup():
+  """Building the monitor, console and settings screens"""
+  main = import_ui()
+  ola_listener = create_listener()
+  return lambda: create_screens(main, ola_listener)
+
+@benchmark('monitor_update_data', number=500, unit='frame')
+def monitor_update_data():
+  """MonitorScreen.update_data with a sixteenth of the channels moving"""
+  main = import_ui()
+  monitor = create_screens(main, create_listener())[0]
+  monitor.carousel_size = _SIZES[0]
+  monitor.relayout()
+  frames = [array.array('B', [(i % 16 == 0) * value for i in xrange(512)])
+            for value in (0, 255)]
+  state = [0]
+  def run():
+    state[0] ^= 1
+    monitor.update_data(frames[state[0]])
+  return run
+
+@benchmark('console_send_console_data', number=2000, unit='send')
+def console_send_console_data():
+  """ConsoleScreen.send_console_data handing its buffer to the scheduler"""
+  main = import_ui()
+  ola_listener = create_listener()
+  ola_listener.selectserver.AddEvent = lambda time_in_ms, callback: None
+  console = create_screens(main, ola_listener)[1]
+  console.switch_in()
+  return console.send_console_data
+
+@benchmark('resize_carousel', number=20, unit='relayout')
+def resize_carousel():
+  """Relayout of both carousels for a new screen size"""
+  main = import_ui()
+  monitor, console = create_screens(main, create_listener())[:2]
+  state = [0]
+  def run():
+    state[0] = (state[0] + 1) % len(_SIZES)
+    for screen in (monitor, console):
+      screen.carousel_size = _SIZES[state[0]]
+      screen.relayout()
+  return run
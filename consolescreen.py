@@ -4,12 +4,18 @@ import kivy
 from array import array
 from kivy.lang import Builder
 from kivy.clock import Clock
+from kivy.properties import BooleanProperty
+from kivy.metrics import dp
 from kivy.uix.gridlayout import GridLayout
-from kivy.uix.stacklayout import StackLayout
 from kivy.uix.screenmanager import Screen
+from virtualcarousel import VirtualCarousel
+from cueengine import CueEngine
 
 _DMX_CHANNELS_TO_SHOW = 512
-SEND_DATA_INTERVAL = 1
+_FADER_WIDTH = 32
+# Cues recorded on the console belong to the console rather than to a
+# universe, and play on whichever universe is selected.
+_CONSOLE_CUES = 0
 
 Builder.load_file('consolescreen.kv')
 
@@ -19,8 +25,8 @@ class Fader(GridLayout):
 
      Args:
        ola_listener: A OLAListener object to send ola requests
-       on_change: When a fader is moved, this method will be executed,
-                  this will improve fluidity of changes
+       on_change: When a fader is moved, this method will be executed with
+                  the channel number and the new value
        channel_number: The index of the channel, typically between
                        1 and 512, inclusive.
   """
@@ -29,23 +35,49 @@ class Fader(GridLayout):
     self.ola_listener = ola_listener
     self.channel_number = channel_number
     self.selected_universe = None
+    self.assigning = False
     self.ids.channel_label.text = str(self.channel_number)
     self.ids.channel_value.text = str(int(self.ids.channel_slider.value))
     self.ids.channel_slider.bind(value=self.update_fader_value)
-    self.ids.channel_slider.bind(value=lambda i,v: on_change())
+    self.ids.channel_slider.bind(
+      value=lambda i,v: self.assigning or on_change(self.channel_number, v))
 
   def update_fader_value(self, instance, value):
     """Updates the fader value below the slider with an accurate value"""
     self.ids.channel_value.text = str(int(value))
 
+  def assign(self, channel_number, value):
+    """Points the fader at a channel and shows its value, without reporting
+       the move to on_change.
+
+       Args:
+         channel_number: the channel the fader now controls
+         value: the current value of that channel
+    """
+    self.assigning = True
+    self.channel_number = channel_number
+    self.ids.channel_label.text = str(channel_number)
+    self.ids.channel_slider.value = value
+    self.assigning = False
+
 class ConsoleScreen(Screen):
-  """This screen has a bank of faders for sending DMX on any channel
+  """This screen has a bank of faders for sending DMX on any channel.
+     Faders write into a persistent buffer, and while the screen is shown
+     each move is also handed to the OLAListener's DMXOutputScheduler,
+     which sends the selected universe at a fixed rate from the OLA thread.
+
+     The faders can also be recorded as cues and played back with
+     crossfades by a CueEngine.  While any cue is active the scheduler
+     sends the rendered cues, with the faders merged on top HTP.  Cues need
+     NumPy; without it the cue controls are disabled.
 
      Args:
        ola_listener: An OLAListener object to send ola requests
        selected_universe_service: A UniverseSelectedService object to handle
          the user-selected universe
   """
+  cues_available = BooleanProperty(False)
+
   def __init__(self, ola_listener, selected_universe_service, **kwargs):
     super(ConsoleScreen, self).__init__(**kwargs)
     self.ola_listener = ola_listener
@@ -54,69 +86,155 @@ class ConsoleScreen(Screen):
       selected_universe=self.change_selected_universe)
     self.on_enter = self.switch_in
     self.on_leave = self.switch_out
-    self.channels = []
-    for channel_index in range(_DMX_CHANNELS_TO_SHOW):
-      channel = Fader(self.ola_listener,
-                      self.send_console_data,
-                      channel_index+1)
-      self.channels.append(channel)
+    self.data = array('B', [0] * _DMX_CHANNELS_TO_SHOW)
+    self.output_universe = None
+    self.pages = VirtualCarousel(self.ids.console_car, _DMX_CHANNELS_TO_SHOW,
+                                 self.create_fader, self.bind_fader)
+    self.fader_width = dp(_FADER_WIDTH)
+    self.carousel_size = (0, 0)
+    self._trigger_relayout = Clock.create_trigger(self.relayout)
+    try:
+      self.cue_engine = CueEngine([_CONSOLE_CUES])
+    except ImportError:
+      self.cue_engine = None
+    self.cues_available = self.cue_engine is not None
+
+  def create_fader(self):
+    """Builds a Fader for the carousel's widget pool"""
+    return Fader(self.ola_listener, self.set_channel, -1)
+
+  def bind_fader(self, fader, index):
+    """Points a pooled Fader at a channel of the buffer.
+
+       Args:
+         fader: the Fader to reuse
+         index: the 0-based index of the channel it now controls
+    """
+    fader.assign(index+1, self.data[index])
 
   def switch_in(self):
     """To be executed when the user starts viewing the screen, this will
-        schedule regular sending of DMX and start listening for dmx changes.
+        start regular sending of DMX to the selected universe.
     """
-    Clock.schedule_interval(self.send_console_data, SEND_DATA_INTERVAL)
+    universe = self.selected_universe_service.selected_universe
+    if not universe or universe.id is None:
+      return
+    self.output_universe = universe.id
+    self.send_console_data()
+    if self.cue_engine:
+      self.ola_listener.output.set_source(universe.id, self.render_cues)
 
   def switch_out(self):
-    """To be executed when the user leaves the screen, this will stop the
-       DMX listener and stop regular sending of DMX
+    """To be executed when the user leaves the screen, this will stop
+       regular sending of DMX
     """
-    Clock.unschedule(self.send_console_data)
+    if self.output_universe is not None:
+      self.ola_listener.output.remove(self.output_universe)
+      self.output_universe = None
 
   def resize_carousel(self, size):
     """The console screen is broken up into smaller screens that are placed
        on the carousel; when the screen is resized, the number of faders on
-       each screen needs to change.
+       each screen needs to change.  Resizes often come several to a
+       frame, so the relayout itself is deferred to the next frame.
 
        Args:
          size: [width, height] of the new carousel widget
     """
-    width = size[0]
-    height = size[1]
-    dummy_fader = Fader(self.ola_listener, self.send_console_data, -1)
-    channels_per_page = int(width / dummy_fader.width)
-    pages = [self.channels[x:x+channels_per_page] for x in
-             xrange(0, len(self.channels), channels_per_page)]
-    for slide in self.ids.console_car.slides:
-      slide.clear_widgets()
-    self.ids.console_car.clear_widgets()
-    for page in pages:
-      slide = StackLayout(size_hint_x=1, size_hint_y=1)
-      for cell in page:
-        slide.add_widget(cell)
-      self.ids.console_car.add_widget(slide)
+    self.carousel_size = size
+    self._trigger_relayout()
+
+  def relayout(self, dt=0):
+    """Moves the faders onto pages for the last carousel size given"""
+    width = self.carousel_size[0]
+    channels_per_page = int(width / self.fader_width)
+    self.pages.layout(channels_per_page)
+
+  def show_slide(self, slide_index):
+    """Moves the live faders along with the carousel.
+
+       Args:
+         slide_index: the index of the slide now shown in the carousel
+    """
+    self.pages.show(slide_index)
 
   def change_selected_universe(self, instance, value):
     """Give a channel id, sends that id to all faders on the screen
        and resets all faders to 0.
     """
-    for channel in self.channels:
-      channel.ids.channel_slider.value = 0
+    self.data[:] = array('B', [0] * _DMX_CHANNELS_TO_SHOW)
+    for index, fader in self.pages.live_widgets():
+      fader.assign(index+1, 0)
+    if self.cue_engine:
+      self.cue_engine.set_manual_frame(_CONSOLE_CUES, self.data)
+    if self.output_universe is not None:
+      self.switch_out()
+      self.switch_in()
+
+  def set_channel(self, channel_number, value):
+    """Stores a fader's value in the buffer; it is sent on the next tick
+       of the output scheduler.
+
+       Args:
+         channel_number: the channel of the fader, between 1 and 512
+         value: the new value of the fader
+    """
+    if 0 < channel_number <= _DMX_CHANNELS_TO_SHOW:
+      self.data[channel_number-1] = int(value)
+      if self.cue_engine:
+        self.cue_engine.set_manual(_CONSOLE_CUES, channel_number-1,
+                                   int(value))
+      if self.output_universe is not None:
+        self.ola_listener.output.set_channel(self.output_universe,
+                                             channel_number-1, value)
+
+  def record_cue(self, name):
+    """Stores the current fader levels as a cue.
 
-  def send_console_data(self, dt=0):
-    """The console will send its current state to the OLA client"""
-    data = []
-    for channel in self.channels:
-      data.append(int(channel.ids.channel_slider.value))
-    self.ola_listener.send_dmx( \
-      self.selected_universe_service.selected_universe.id, array('B', data))
+       Args:
+         name: the name of the cue
+    """
+    if self.cue_engine and name:
+      self.cue_engine.store_cue(name, {_CONSOLE_CUES: self.data})
+
+  def go_cue(self, name):
+    """Starts a crossfade to a recorded cue; unknown names are ignored"""
+    if self.cue_engine and name in self.cue_engine.cues:
+      self.cue_engine.go(name)
+
+  def release_cues(self):
+    """Fades out every active cue, leaving only the faders"""
+    if self.cue_engine:
+      self.cue_engine.release()
+
+  def send_console_data(self):
+    """Hands the whole buffer to the output scheduler for the selected
+       universe
+    """
+    if self.output_universe is not None:
+      self.ola_listener.output.set_frame(self.output_universe, self.data)
+
+  def render_cues(self):
+    """The output scheduler's source for the selected universe; runs on the
+       OLA thread.  Returns the rendered cues, faders included, or None to
+       send the buffer when no cue is active.
+    """
+    if self.cue_engine.active():
+      return self.cue_engine.render()[0]
+    return None
 
   def update_data(self, data):
     """The console screen must remain updated with the actual DMX data,
        so this method will send that data to all the channels on the screen.
 
        Args:
-         data: an array of size 512 containing the dmx data
+         data: a buffer of up to 512 channels of dmx data, such as a
+               bytearray from the OLAListener
     """
-    for channel in self.channels:
-      channel.ids.channel_slider.value = data[channel.channel_number-1]
+    length = min(len(data), _DMX_CHANNELS_TO_SHOW)
+    self.data[:length] = array('B', data[:length])
+    if self.cue_engine:
+      self.cue_engine.set_manual_frame(_CONSOLE_CUES, self.data)
+    for index, fader in self.pages.live_widgets():
+      fader.assign(index+1, self.data[index])
+    self.send_console_data()
@@ -0,0 +1,318 @@
+"""Stores cues and renders timed crossfades between them.
+
+   A cue is a named snapshot of the levels of one or more universes.  Going
+   to a cue fades it in over its fade time; releasing it fades it out.
+   Several cues can be active at once and are merged per channel:
+
+     LTP (latest takes precedence): the cue crossfades from whatever is
+         below it, so a later cue replaces the levels of earlier ones.
+     HTP (highest takes precedence): the cue is added on top, each channel
+         at the higher of the cue and everything below.
+
+   Each frame is rendered with NumPy over whole universes at once rather
+   than channel by channel.  NumPy is an optional dependency; creating a
+   CueEngine without it raises ImportError.
+"""
+
+import threading
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+HTP = 'htp'
+LTP = 'ltp'
+
+_DMX_CHANNELS = 512
+
+def linear(fraction):
+  """A fade that changes at the same rate throughout"""
+  return fraction
+
+def s_curve(fraction):
+  """A fade that eases in and out"""
+  return fraction * fraction * (3 - 2 * fraction)
+
+CURVES = {'linear': linear, 's_curve': s_curve}
+
+class Cue(object):
+  """A named snapshot of levels.
+
+     Args:
+       name: the name of the cue
+       levels: a float32 array with a row of 512 levels per universe
+       fade_time: seconds to fade in and out over by default
+       merge: LTP or HTP
+       curve: the name of a fade curve in CURVES
+  """
+
+  def __init__(self, name, levels, fade_time, merge, curve):
+    if merge not in (LTP, HTP):
+      raise ValueError('Unknown merge mode %r' % merge)
+    self.name = name
+    self.levels = levels
+    self.fade_time = fade_time
+    self.merge = merge
+    self.curve = CURVES[curve]
+
+class Playback(object):
+  """A cue that is fading in, fully in, or fading out.
+
+     Args:
+       cue: the Cue being played
+       start: the time the fade in started
+       fade_time: seconds to fade in over
+  """
+
+  def __init__(self, cue, start, fade_time):
+    self.cue = cue
+    self.start = start
+    self.fade_time = fade_time
+    self.release_start = None
+    self.release_time = 0
+    self.release_level = 1.0
+
+  def fade(self, start, fade_time, now):
+    """Returns how far a fade that started at start is at now, from 0 to 1,
+       shaped by the cue's curve
+    """
+    if fade_time <= 0:
+      return 1.0
+    return self.cue.curve(min(max(float(now - start) / fade_time, 0.0), 1.0))
+
+  def level(self, now):
+    """Returns the intensity of the cue at now, from 0 to 1"""
+    if self.release_start is None:
+      return self.fade(self.start, self.fade_time, now)
+    return self.release_level * (1 - self.fade(self.release_start,
+                                               self.release_time, now))
+
+  def release(self, fade_time, now):
+    """Starts fading the cue out from its current level"""
+    self.release_level = self.level(now)
+    self.release_start = now
+    self.release_time = fade_time
+
+  def released(self, now):
+    """Returns whether the cue has finished fading out"""
+    return self.release_start is not None and \
+           now - self.release_start >= self.release_time
+
+  def complete(self, now):
+    """Returns whether the cue has finished fading in and is held"""
+    return self.release_start is None and now - self.start >= self.fade_time
+
+class CueEngine(object):
+  """Renders the active cues of a set of universes, and can send the
+     result through an OLAListener at a fixed frame rate.
+
+     Args:
+       universes: the universe ids the engine renders
+       ola_listener: the OLAListener to send frames with; only needed to
+                     start() the engine
+  """
+
+  FRAME_RATE = 44
+  SEND_DATA_INTERVAL = 1
+  DEFAULT_FADE_TIME = 3.0
+
+  def __init__(self, universes, ola_listener=None):
+    if numpy is None:
+      raise ImportError('The cue engine needs NumPy')
+    self.universes = list(universes)
+    self.rows = dict((universe, row)
+                     for row, universe in enumerate(self.universes))
+    self.ola_listener = ola_listener
+    self.cues = {}
+    self.playbacks = []
+    self.manual = numpy.zeros((len(self.universes), _DMX_CHANNELS),
+                              numpy.uint8)
+    self.lock = threading.Lock()
+    self.thread = None
+    self._stopped = False
+    self.last_frame = None
+    self.last_send = {}
+    self.frames_rendered = 0
+    self.total_render_time = 0.0
+    self.max_render_time = 0.0
+    self.late_frames = 0
+
+  def store_cue(self, name, levels, fade_time=None, merge=LTP,
+                curve='linear'):
+    """Stores a cue, replacing any cue of the same name.
+
+       Args:
+         name: the name of the cue
+         levels: a dict of universe id to a sequence of up to 512 levels;
+                 universes that are left out are stored at 0
+         fade_time: seconds to fade over, DEFAULT_FADE_TIME if None
+         merge: LTP or HTP
+         curve: the name of a fade curve in CURVES
+    """
+    if fade_time is None:
+      fade_time = self.DEFAULT_FADE_TIME
+    snapshot = numpy.zeros((len(self.universes), _DMX_CHANNELS),
+                           numpy.float32)
+    for universe, universe_levels in levels.iteritems():
+      values = numpy.asarray(universe_levels, numpy.float32)[:_DMX_CHANNELS]
+      snapshot[self.rows[universe], :len(values)] = values
+    with self.lock:
+      self.cues[name] = Cue(name, snapshot, fade_time, merge, curve)
+
+  def go(self, name, fade_time=None, now=None):
+    """Starts fading a cue in.  A cue that is already active is restarted.
+
+       Args:
+         name: the name of a stored cue
+         fade_time: seconds to fade in over, the cue's own if None
+         now: the time to start at, the current time if None
+       Raises:
+         KeyError: if there is no cue of that name
+    """
+    if now is None:
+      now = time.time()
+    with self.lock:
+      cue = self.cues[name]
+      if fade_time is None:
+        fade_time = cue.fade_time
+      self.playbacks = [playback for playback in self.playbacks
+                        if playback.cue is not cue]
+      self.playbacks.append(Playback(cue, now, fade_time))
+
+  def release(self, name=None, fade_time=None, now=None):
+    """Starts fading out a cue, or every active cue if name is None"""
+    if now is None:
+      now = time.time()
+    with self.lock:
+      for playback in self.playbacks:
+        if name is None or playback.cue.name == name:
+          if fade_time is None:
+            playback.release(playback.cue.fade_time, now)
+          else:
+            playback.release(fade_time, now)
+
+  def active(self, now=None):
+    """Returns whether any cue is still active at now, dropping those that
+       have finished
+    """
+    if now is None:
+      now = time.time()
+    with self.lock:
+      self.prune(now)
+      return bool(self.playbacks)
+
+  def set_manual(self, universe, channel, value):
+    """Sets a manual level, which is merged HTP over every cue"""
+    with self.lock:
+      self.manual[self.rows[universe], channel] = value
+
+  def set_manual_frame(self, universe, data):
+    """Sets the manual levels of a universe from a sequence of levels"""
+    length = min(len(data), _DMX_CHANNELS)
+    levels = numpy.frombuffer(bytearray(data[:length]), numpy.uint8)
+    with self.lock:
+      self.manual[self.rows[universe], :length] = levels
+
+  def prune(self, now):
+    """Drops cues that can no longer be seen: those that have faded out,
+       and LTP cues hidden below an LTP cue that has fully faded in.
+    """
+    playbacks = [playback for playback in self.playbacks
+                 if not playback.released(now)]
+    for index in xrange(len(playbacks) - 1, -1, -1):
+      playback = playbacks[index]
+      if playback.cue.merge == LTP and playback.complete(now):
+        playbacks = [below for below in playbacks[:index]
+                     if below.cue.merge == HTP] + playbacks[index:]
+        break
+    self.playbacks = playbacks
+
+  def render(self, now=None):
+    """Renders the active cues at now.
+
+       Returns:
+         a uint8 array with a row of 512 levels per universe, in the order
+         of the universes given to the engine
+    """
+    started = time.time()
+    if now is None:
+      now = started
+    with self.lock:
+      self.prune(now)
+      output = numpy.zeros(self.manual.shape, numpy.float32)
+      highest = []
+      for playback in self.playbacks:
+        level = playback.level(now)
+        if playback.cue.merge == LTP:
+          output += (playback.cue.levels - output) * level
+        elif level > 0:
+          highest.append(playback.cue.levels * level)
+      if highest:
+        output = numpy.maximum(output, numpy.max(highest, axis=0))
+      frame = numpy.maximum(numpy.rint(output).astype(numpy.uint8),
+                            self.manual)
+    render_time = time.time() - started
+    self.frames_rendered += 1
+    self.total_render_time += render_time
+    self.max_render_time = max(self.max_render_time, render_time)
+    return frame
+
+  def start(self, frame_rate=None):
+    """Starts rendering and sending frames on a thread of the engine"""
+    self._stopped = False
+    self.thread = threading.Thread(target=self.run,
+                                   args=(frame_rate or self.FRAME_RATE,))
+    self.thread.daemon = True
+    self.thread.start()
+
+  def stop(self):
+    """Stops sending frames and waits for the engine's thread"""
+    self._stopped = True
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+
+  def run(self, frame_rate):
+    """Renders and sends a frame every 1 / frame_rate seconds until
+       stop() is called.  Frames are scheduled from when the engine started,
+       so a slow frame does not delay the ones after it.
+    """
+    period = 1. / frame_rate
+    origin = time.time()
+    frame_number = 0
+    while not self._stopped:
+      frame_number += 1
+      due = origin + frame_number * period
+      remaining = due - time.time()
+      if remaining > 0:
+        time.sleep(remaining)
+      elif -remaining > period:
+        self.late_frames += 1
+        frame_number += int(-remaining / period)
+      self.send_frame(self.render())
+
+  def send_frame(self, frame):
+    """Sends the universes whose levels changed since the last frame, and
+       any universe not sent for SEND_DATA_INTERVAL
+    """
+    now = time.time()
+    last_frame = self.last_frame
+    for row, universe in enumerate(self.universes):
+      if (last_frame is None or
+          not numpy.array_equal(last_frame[row], frame[row]) or
+          now - self.last_send.get(universe, 0) >= self.SEND_DATA_INTERVAL):
+        self.ola_listener.send_dmx(universe, frame[row])
+        self.last_send[universe] = now
+    self.last_frame = frame
+
+  def stats(self):
+    """Returns the frame time statistics as a dict"""
+    frames = self.frames_rendered
+    return {'frames': frames,
+            'mean_render_time':
+              self.total_render_time / frames if frames else 0,
+            'max_render_time': self.max_render_time,
+            'late_frames': self.late_frames,
+            'active_cues': len(self.playbacks)}
@@ -0,0 +1,368 @@
+#!/usr/bin/python
+"""Plays a show recorded by dmxrecorder back through OLA, without the UI.
+
+   The show and its index are memory-mapped rather than read in, so only
+   the pages around the playhead are resident and a show of many hours
+   plays in little memory.  Seeking bisects the index for the keyframes
+   before the wanted time and decodes forward from there; playing decodes
+   each record into one reused buffer per universe.
+
+   Usage: python dmxplayer.py [--speed S] [--loop] [--start SECONDS]
+                              SHOW_FILE [UNIVERSE ...]
+"""
+
+import argparse
+import mmap
+import sys
+import threading
+import time
+from array import array
+from Queue import Queue, Empty
+from dmxrecorder import SHOW_MAGIC, INDEX_MAGIC, RECORD, INDEX_ENTRY
+from dmxrecorder import KEYFRAME, apply_delta
+from olalistener import OLAListener
+
+class ShowFile(object):
+  """A memory-mapped show file and its index.
+
+     Args:
+       path: the show file; its index is read from path + '.idx'
+     Raises:
+       ValueError: if either file is not from dmxrecorder
+  """
+
+  def __init__(self, path):
+    self.show_file = open(path, 'rb')
+    self.index_file = open(path + '.idx', 'rb')
+    self.show = mmap.mmap(self.show_file.fileno(), 0,
+                          access=mmap.ACCESS_READ)
+    self.index = mmap.mmap(self.index_file.fileno(), 0,
+                           access=mmap.ACCESS_READ)
+    if self.show[:len(SHOW_MAGIC)] != SHOW_MAGIC or \
+       self.index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+      self.close()
+      raise ValueError('%s is not a DMX show' % path)
+    self.entries = (len(self.index) - len(INDEX_MAGIC)) / INDEX_ENTRY.size
+    self.universes = set(self.index_entry(position)[1]
+                         for position in xrange(self.entries))
+    self.duration = 0
+    if self.entries:
+      offset = self.index_entry(self.entries - 1)[2]
+      while offset is not None:
+        self.duration = self.record(offset)[0]
+        offset = self.next_offset(offset)
+
+  def close(self):
+    """Unmaps and closes the show and its index"""
+    self.show.close()
+    self.index.close()
+    self.show_file.close()
+    self.index_file.close()
+
+  def index_entry(self, position):
+    """Returns the (time, universe, offset) of a keyframe in the index"""
+    return INDEX_ENTRY.unpack_from(self.index,
+                                   len(INDEX_MAGIC) +
+                                   position * INDEX_ENTRY.size)
+
+  def record(self, offset):
+    """Returns the (time, universe, kind, payload length) of the record at
+       offset; the payload follows at offset + RECORD.size
+    """
+    return RECORD.unpack_from(self.show, offset)
+
+  def next_offset(self, offset):
+    """Returns the offset of the record after the one at offset, or None
+       if it is the last
+    """
+    offset += RECORD.size + self.record(offset)[3]
+    if offset + RECORD.size > len(self.show):
+      return None
+    return offset
+
+  def first_offset(self):
+    """Returns the offset of the first record, or None if there is none"""
+    if len(self.show) < len(SHOW_MAGIC) + RECORD.size:
+      return None
+    return len(SHOW_MAGIC)
+
+  def keyframes_before(self, timestamp):
+    """Returns the number of keyframes at or before timestamp, found by
+       bisecting the index
+    """
+    low, high = 0, self.entries
+    while low < high:
+      middle = (low + high) / 2
+      if self.index_entry(middle)[0] <= timestamp:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  def seek_offset(self, timestamp, universes):
+    """Finds where decoding must start so that every universe has its
+       latest keyframe before timestamp.
+
+       Args:
+         timestamp: milliseconds into the show
+         universes: the universes that will be played
+       Returns:
+         the offset of a record, or None if there is no record
+    """
+    wanted = set(universes) & self.universes
+    offset = None
+    position = self.keyframes_before(timestamp)
+    while wanted and position > 0:
+      position -= 1
+      entry_time, universe, entry_offset = self.index_entry(position)
+      if universe in wanted:
+        wanted.discard(universe)
+        offset = entry_offset
+    if wanted or offset is None:
+      return self.first_offset()
+    return offset
+
+class Playhead(object):
+  """Decodes a ShowFile in time order into one buffer per universe.
+
+     Args:
+       show: the ShowFile to decode
+       universes: the universes to decode, every universe if None
+  """
+
+  def __init__(self, show, universes=None):
+    self.show = show
+    if universes is None:
+      universes = show.universes
+    self.universes = set(universes)
+    self.frames = {}
+    self.offset = None
+    self.position = 0
+    self.seek(0)
+
+  def seek(self, timestamp):
+    """Moves the playhead so that the frames are those at timestamp"""
+    for frame in self.frames.values():
+      frame[:] = ''
+    self.offset = self.show.seek_offset(timestamp, self.universes)
+    self.advance(timestamp)
+    self.position = timestamp
+
+  def next_time(self):
+    """Returns the time of the next record, or None at the end"""
+    if self.offset is None:
+      return None
+    return self.show.record(self.offset)[0]
+
+  def advance(self, timestamp):
+    """Decodes every record up to and including timestamp.
+
+       Returns:
+         the universes whose frame was touched
+    """
+    show = self.show
+    touched = set()
+    offset = self.offset
+    while offset is not None:
+      record_time, universe, kind, length = show.record(offset)
+      if record_time > timestamp:
+        break
+      if universe in self.universes:
+        payload = offset + RECORD.size
+        frame = self.frames.get(universe)
+        if kind == KEYFRAME:
+          if frame is None:
+            frame = self.frames[universe] = bytearray(length)
+          frame[:] = show.show[payload:payload + length]
+          touched.add(universe)
+        elif frame:
+          apply_delta(frame, show.show, payload, length)
+          touched.add(universe)
+      offset = show.next_offset(offset)
+    self.offset = offset
+    self.position = timestamp
+    return touched
+
+class DMXPlayer(object):
+  """Plays a ShowFile through an OLAListener on its own thread.  Every
+     universe is driven from one clock, so a pass sends every universe
+     whose frame changed up to the current show time together.  Each pass
+     is scheduled against the time playback started rather than the
+     previous pass, so late wake-ups are measured as drift and do not pile
+     up.
+
+     Args:
+       ola_listener: the OLAListener to send DMX with
+       show: the ShowFile to play
+       universes: the universes to play, every universe if None
+       speed: how fast to play, 2 is twice as fast as recorded
+       loop: whether to start again from the beginning at the end
+       clock: returns the current time in seconds
+       sleep: sleeps for a number of seconds
+  """
+
+  LATE_THRESHOLD = 0.010
+  MAX_SLEEP = 0.1
+
+  def __init__(self, ola_listener, show, universes=None, speed=1.0,
+               loop=False, clock=time.time, sleep=time.sleep):
+    self.ola_listener = ola_listener
+    self.clock = clock
+    self.sleep = sleep
+    self.show = show
+    self.playhead = Playhead(show, universes)
+    self.speed = float(speed)
+    self.loop = loop
+    self.origin = None
+    self.thread = None
+    self._stopped = False
+    self.frames_sent = 0
+    self.passes = 0
+    self.loops = 0
+    self.drift = 0.0
+    self.max_drift = 0.0
+    self.total_drift = 0.0
+    self.late_frames = 0
+
+  def start(self, position=0):
+    """Starts playing from position milliseconds into the show"""
+    self.cue(position)
+    self._stopped = False
+    self.thread = threading.Thread(target=self.play)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def cue(self, position):
+    """Sends the frames at position milliseconds into the show and makes
+       now the time playback reaches it
+    """
+    self.playhead.seek(position)
+    self.send(self.playhead.frames.keys())
+    self.origin = self.clock() - position / 1000. / self.speed
+
+  def stop(self):
+    """Stops playing and waits for the player thread to finish"""
+    self._stopped = True
+    if self.thread:
+      self.thread.join()
+      self.thread = None
+
+  def is_playing(self):
+    return bool(self.thread and self.thread.is_alive())
+
+  def set_speed(self, speed):
+    """Changes the speed without moving the playhead"""
+    now = self.clock()
+    position = (now - self.origin) * self.speed
+    self.speed = float(speed)
+    self.origin = now - position / self.speed
+
+  def due_time(self, timestamp):
+    """Returns the wall clock time at which a show time is due"""
+    return self.origin + timestamp / 1000. / self.speed
+
+  def play(self):
+    """Runs on the player thread until the end of the show or stop()"""
+    while not self._stopped:
+      next_time = self.playhead.next_time()
+      if next_time is None:
+        if not self.loop:
+          return
+        self.origin = self.due_time(self.show.duration)
+        self.playhead.seek(0)
+        self.loops += 1
+        self.send(self.playhead.frames.keys())
+        continue
+      due = self.due_time(next_time)
+      if not self.sleep_until(due):
+        return
+      now = self.clock()
+      self.record_drift(now - due)
+      position = int((now - self.origin) * self.speed * 1000)
+      self.send(self.playhead.advance(max(position, next_time)))
+
+  def sleep_until(self, due):
+    """Sleeps until due, waking regularly to check for stop().
+
+       Returns:
+         False if the player was stopped while sleeping
+    """
+    while not self._stopped:
+      remaining = due - self.clock()
+      if remaining <= 0:
+        return True
+      self.sleep(min(remaining, self.MAX_SLEEP))
+    return False
+
+  def record_drift(self, drift):
+    """Records how late a pass woke up, in seconds"""
+    self.passes += 1
+    self.drift = drift
+    self.max_drift = max(self.max_drift, drift)
+    self.total_drift += drift
+    if drift > self.LATE_THRESHOLD:
+      self.late_frames += 1
+
+  def send(self, universes):
+    """Sends the current frame of every universe given.  Each send gets its
+       own copy of the frame, since the playhead keeps changing its frames
+       while the send waits for the OLAListener thread.
+    """
+    frames = self.playhead.frames
+    for universe in universes:
+      frame = frames[universe]
+      if not frame:
+        continue
+      self.ola_listener.send_dmx(universe, array('B', str(frame)))
+      self.frames_sent += 1
+
+  def stats(self):
+    """Returns the playback timing statistics as a dict"""
+    return {'frames_sent': self.frames_sent,
+            'passes': self.passes,
+            'loops': self.loops,
+            'drift': self.drift,
+            'max_drift': self.max_drift,
+            'mean_drift': self.total_drift / self.passes if self.passes else 0,
+            'late_frames': self.late_frames}
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Plays a recorded DMX show.')
+  parser.add_argument('show', metavar='SHOW_FILE')
+  parser.add_argument('universes', metavar='UNIVERSE', type=int, nargs='*',
+                      help='the universes to play, all of them if none')
+  parser.add_argument('--speed', type=float, default=1.0)
+  parser.add_argument('--loop', action='store_true')
+  parser.add_argument('--start', type=float, default=0,
+                      help='seconds into the show to start from')
+  args = parser.parse_args(argv[1:])
+  from ola.ClientWrapper import SelectServer
+  from ola.OlaClient import OlaClient
+  show = ShowFile(args.show)
+  ui_queue = Queue()
+  ola_listener = OLAListener(ui_queue, SelectServer,
+    lambda close_callback=None: OlaClient(close_callback=close_callback),
+    lambda: sys.stderr.write('Connected to olad\n'),
+    lambda: sys.stderr.write('Lost the connection to olad\n'))
+  ola_listener.start()
+  player = DMXPlayer(ola_listener, show, args.universes or None, args.speed,
+                     args.loop)
+  player.start(int(args.start * 1000))
+  try:
+    while player.is_playing():
+      try:
+        ui_queue.get(timeout=1).run()
+      except Empty:
+        pass
+  except KeyboardInterrupt:
+    pass
+  player.stop()
+  ola_listener.stop()
+  show.close()
+  sys.stderr.write('%(frames_sent)d frames sent, mean drift %(mean_drift).4fs,'
+                   ' max drift %(max_drift).4fs, %(late_frames)d late\n' %
+                   player.stats())
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
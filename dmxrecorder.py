@@ -0,0 +1,268 @@
+#!/usr/bin/python
+"""Records the DMX of one or more universes to a show file, without the UI.
+
+   A show file starts with SHOW_MAGIC and is followed by records, each a
+   RECORD header (time in milliseconds since the recording started,
+   universe, kind, payload length) and its payload:
+
+     KEYFRAME: the whole frame.
+     DELTA: runs of channels that changed since the previous frame of the
+            universe, each a RUN header (first channel, run length) and the
+            new values of the run.
+
+   Each universe gets a keyframe for its first frame, whenever its frame
+   length changes and at least every KEYFRAME_INTERVAL seconds.  Frames
+   that did not change are left out, apart from those keyframes.  Every
+   keyframe is also listed in an index file beside the show, path + '.idx',
+   which starts with INDEX_MAGIC and holds an INDEX_ENTRY (time, universe,
+   offset of the record in the show) per keyframe.  A reader can bisect the
+   index to find where to start decoding for any point in time.
+
+   Usage: python dmxrecorder.py SHOW_FILE UNIVERSE [UNIVERSE ...]
+"""
+
+import struct
+import sys
+import threading
+import time
+from Queue import Queue, Empty
+from olalistener import OLAListener
+
+SHOW_MAGIC = 'OLADMX\x00\x01'
+INDEX_MAGIC = 'OLAIDX\x00\x01'
+RECORD = struct.Struct('<IIBH')
+RUN = struct.Struct('<HH')
+INDEX_ENTRY = struct.Struct('<IIQ')
+KEYFRAME = 0
+DELTA = 1
+
+_DIFF_BLOCK = 32
+# A run header costs RUN.size bytes, so unchanged gaps shorter than that
+# are cheaper to store than to split a run over.
+_RUN_GAP = RUN.size
+
+def encode_delta(old, new):
+  """Encodes the channels that differ between two frames of equal length.
+
+     Args:
+       old: the previous frame, as a string
+       new: the new frame, as a string
+     Returns:
+       the payload of a DELTA record; empty if nothing changed
+  """
+  if old == new:
+    return ''
+  runs = []
+  for start in xrange(0, len(new), _DIFF_BLOCK):
+    end = start + _DIFF_BLOCK
+    if old[start:end] == new[start:end]:
+      continue
+    for index in xrange(start, min(end, len(new))):
+      if old[index] != new[index]:
+        if runs and index - runs[-1][1] <= _RUN_GAP:
+          runs[-1][1] = index + 1
+        else:
+          runs.append([index, index + 1])
+  return ''.join(RUN.pack(start, end - start) + new[start:end]
+                 for start, end in runs)
+
+def apply_delta(frame, payload, offset=0, length=None):
+  """Applies the runs of a DELTA payload to a frame in place.
+
+     Args:
+       frame: a bytearray holding the previous frame of the universe
+       payload: a string or buffer holding the payload
+       offset: where the payload starts in that buffer
+       length: the length of the payload, the rest of the buffer if None
+  """
+  if length is None:
+    length = len(payload) - offset
+  end = offset + length
+  while offset < end:
+    start, run_length = RUN.unpack_from(payload, offset)
+    offset += RUN.size
+    frame[start:start + run_length] = payload[offset:offset + run_length]
+    offset += run_length
+
+class ShowWriter(object):
+  """Encodes frames into a show file and its index.  Records are gathered
+     in memory and written in chunks of at least WRITE_CHUNK bytes, or at
+     least every FLUSH_INTERVAL seconds, so the card sees few large writes.
+
+     Args:
+       path: the show file to create; the index is written to path + '.idx'
+  """
+
+  KEYFRAME_INTERVAL = 1.0
+  WRITE_CHUNK = 64 * 1024
+  FLUSH_INTERVAL = 2.0
+
+  def __init__(self, path):
+    self.show = open(path, 'wb')
+    self.index = open(path + '.idx', 'wb')
+    self.show.write(SHOW_MAGIC)
+    self.index.write(INDEX_MAGIC)
+    self.show.flush()
+    self.index.flush()
+    self.offset = len(SHOW_MAGIC)
+    self.pending = []
+    self.pending_index = []
+    self.pending_bytes = 0
+    self.last_flush = time.time()
+    self.frames = {}
+    self.keyframe_times = {}
+    self.frames_written = 0
+    self.frames_unchanged = 0
+    self.bytes_written = 0
+
+  def write_frame(self, timestamp, universe, data):
+    """Encodes one frame of a universe; nothing is written for a frame
+       that did not change unless it is due a keyframe.
+
+       Args:
+         timestamp: milliseconds since the recording started
+         universe: the universe id of the frame
+         data: the frame, as a string
+    """
+    previous = self.frames.get(universe)
+    if (previous is None or len(previous) != len(data) or
+        timestamp - self.keyframe_times[universe] >=
+        self.KEYFRAME_INTERVAL * 1000):
+      kind = KEYFRAME
+      payload = data
+      self.keyframe_times[universe] = timestamp
+      self.pending_index.append(INDEX_ENTRY.pack(timestamp, universe,
+                                                 self.offset))
+    else:
+      kind = DELTA
+      payload = encode_delta(previous, data)
+      if not payload:
+        self.frames_unchanged += 1
+        return
+    self.frames[universe] = data
+    record = RECORD.pack(timestamp, universe, kind, len(payload)) + payload
+    self.pending.append(record)
+    self.pending_bytes += len(record)
+    self.offset += len(record)
+    self.frames_written += 1
+    if (self.pending_bytes >= self.WRITE_CHUNK or
+        time.time() - self.last_flush >= self.FLUSH_INTERVAL):
+      self.flush()
+
+  def flush(self):
+    """Writes every pending record and index entry to disk"""
+    if self.pending:
+      self.show.write(''.join(self.pending))
+      self.bytes_written += self.pending_bytes
+      self.pending = []
+      self.pending_bytes = 0
+      self.show.flush()
+    if self.pending_index:
+      self.index.write(''.join(self.pending_index))
+      self.pending_index = []
+      self.index.flush()
+    self.last_flush = time.time()
+
+  def close(self):
+    """Writes whatever is pending and closes the show and index"""
+    self.flush()
+    self.show.close()
+    self.index.close()
+
+class DMXRecorder(object):
+  """Records universes from an OLAListener to a ShowWriter.  Frames are
+     taken on the OLAListener thread, uncoalesced, and only copied and
+     timestamped there; encoding and writing happen on a writer thread, so
+     a slow card never holds up olad.
+
+     Args:
+       ola_listener: the OLAListener to subscribe through
+       universes: the universe ids to record
+       writer: the ShowWriter to record to
+  """
+
+  def __init__(self, ola_listener, universes, writer):
+    self.ola_listener = ola_listener
+    self.universes = list(universes)
+    self.writer = writer
+    self.frames = Queue()
+    self.callbacks = {}
+    self.start_time = None
+    self.max_backlog = 0
+    self.thread = threading.Thread(target=self.write_frames)
+    self.thread.daemon = True
+
+  def start(self):
+    """Starts the writer thread and subscribes to every universe"""
+    self.start_time = time.time()
+    self.thread.start()
+    for universe in self.universes:
+      self.callbacks[universe] = self.frame_callback(universe)
+      self.ola_listener.start_dmx_listener(universe, self.callbacks[universe],
+                                           coalesce=False)
+
+  def stop(self):
+    """Unsubscribes, then waits until every frame taken is on disk"""
+    for universe, data_callback in self.callbacks.items():
+      self.ola_listener.stop_dmx_listener(universe, data_callback)
+    self.callbacks = {}
+    self.frames.put(None)
+    self.thread.join()
+    self.writer.close()
+
+  def frame_callback(self, universe):
+    """Creates the data callback for a universe, which runs on the
+       OLAListener thread and hands a copy of each frame to the writer.
+    """
+    def frame_received(data):
+      timestamp = int((time.time() - self.start_time) * 1000)
+      self.frames.put((timestamp, universe, bytes(data)))
+    return frame_received
+
+  def write_frames(self):
+    """Runs on the writer thread until stop() is called"""
+    while True:
+      try:
+        frame = self.frames.get(timeout=self.writer.FLUSH_INTERVAL)
+      except Empty:
+        self.writer.flush()
+        continue
+      self.max_backlog = max(self.max_backlog, self.frames.qsize())
+      if frame is None:
+        return
+      self.writer.write_frame(*frame)
+
+def main(argv):
+  if len(argv) < 3:
+    sys.stderr.write(__doc__.splitlines()[-1].strip() + '\n')
+    return 2
+  from ola.ClientWrapper import SelectServer
+  from ola.OlaClient import OlaClient
+  path = argv[1]
+  universes = [int(universe) for universe in argv[2:]]
+  ui_queue = Queue()
+  ola_listener = OLAListener(ui_queue, SelectServer,
+    lambda close_callback=None: OlaClient(close_callback=close_callback),
+    lambda: sys.stderr.write('Connected to olad\n'),
+    lambda: sys.stderr.write('Lost the connection to olad\n'))
+  recorder = DMXRecorder(ola_listener, universes, ShowWriter(path))
+  recorder.start()
+  ola_listener.start()
+  try:
+    while True:
+      try:
+        ui_queue.get(timeout=1).run()
+      except Empty:
+        pass
+  except KeyboardInterrupt:
+    pass
+  recorder.stop()
+  ola_listener.stop()
+  sys.stderr.write('Recorded %d frames, %d bytes; %d unchanged frames left'
+                   ' out\n' % (recorder.writer.frames_written,
+                               recorder.writer.bytes_written,
+                               recorder.writer.frames_unchanged))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,473 @@
+#!/usr/bin/python
+"""A stand-in for olad that speaks the OLA RPC protocol on a TCP port, so
+   the OLAListener can be tested against real sockets, framing and timing
+   without olad or any lighting hardware.
+
+   It serves a configurable set of devices, ports and universes, answers
+   the requests the OLAListener makes, and pushes synthetic DMX to every
+   universe a client registered for, RATE times a second.  Faults can be
+   injected: a reply latency with random jitter on top, a fraction of
+   requests that are never answered, and dropping every client connection,
+   either on demand with disconnect() or every few seconds.
+
+   Usage: python fakeolad.py [--port PORT] [--universes N] [--rate HZ]
+          [--latency MS] [--jitter MS] [--drop FRACTION]
+          [--disconnect-every SECONDS]
+"""
+
+import argparse
+import random
+import socket
+import sys
+import threading
+import time
+from ola import Ola_pb2
+from ola.ClientWrapper import SelectServer
+from ola.rpc.SimpleRpcController import SimpleRpcController
+from ola.rpc.StreamRpcChannel import StreamRpcChannel
+
+DEFAULT_PORT = 9010
+DMX_UNIVERSE_SIZE = 512
+# Each synthetic frame is a ramp shifted by one channel from the previous,
+# built once so that pushing many universes costs no per-frame work.
+_PATTERN = [''.join(chr((channel + step) % 256)
+                    for channel in xrange(DMX_UNIVERSE_SIZE))
+            for step in xrange(256)]
+
+class FakePort(object):
+  """A port of a FakeDevice, patched to universe unless that is None"""
+
+  def __init__(self, port_id, is_output, universe=None, supports_rdm=False):
+    self.id = port_id
+    self.is_output = is_output
+    self.universe = universe
+    self.supports_rdm = supports_rdm
+
+  def description(self, device):
+    return '%s %s port %d' % (device.name,
+                              'output' if self.is_output else 'input',
+                              self.id)
+
+class FakeDevice(object):
+  """A device served by FakeOlad"""
+
+  def __init__(self, alias, name, input_ports=4, output_ports=4,
+               plugin_id=Ola_pb2.OLA_PLUGIN_DUMMY):
+    """Args:
+         alias: the device alias clients patch with
+         name: the device name
+         input_ports: how many input ports the device has
+         output_ports: how many output ports the device has
+         plugin_id: the id of the plugin the device belongs to
+    """
+    self.alias = alias
+    self.name = name
+    self.plugin_id = plugin_id
+    self.input_ports = [FakePort(port, False) for port in xrange(input_ports)]
+    self.output_ports = [FakePort(port, True) for port in xrange(output_ports)]
+
+  def port(self, port_id, is_output):
+    """Returns a port of the device, or None if there is no such port"""
+    ports = self.output_ports if is_output else self.input_ports
+    if 0 <= port_id < len(ports):
+      return ports[port_id]
+    return None
+
+class FakeUniverse(object):
+  """A universe served by FakeOlad with its current frame"""
+
+  def __init__(self, universe_id, name=None, merge_mode=Ola_pb2.LTP):
+    self.id = universe_id
+    self.name = name if name is not None else 'Universe %d' % universe_id
+    self.merge_mode = merge_mode
+    self.data = ''
+
+class FakeOladService(Ola_pb2.OlaServerService):
+  """Answers the requests of one client connection.  Requests that are not
+     implemented here fail, the way they would against an older olad.
+  """
+
+  def __init__(self, olad, connection):
+    self.olad = olad
+    self.connection = connection
+
+  def CallMethod(self, method_descriptor, rpc_controller, request, done):
+    """Counts the request and injects the configured faults into its
+       reply before running it
+    """
+    done = self.olad.fault(method_descriptor.name, done)
+    super(FakeOladService, self).CallMethod(method_descriptor, rpc_controller,
+                                            request, done)
+
+  def GetPlugins(self, controller, request, done):
+    response = Ola_pb2.PluginListReply()
+    for plugin_id in sorted(set(device.plugin_id
+                                for device in self.olad.devices)):
+      plugin = response.plugin.add()
+      plugin.plugin_id = plugin_id
+      plugin.name = 'Fake plugin %d' % plugin_id
+      plugin.active = True
+    done(response)
+
+  def GetDeviceInfo(self, controller, request, done):
+    response = Ola_pb2.DeviceInfoReply()
+    for device in self.olad.devices:
+      if request.plugin_id in (Ola_pb2.OLA_PLUGIN_ALL, device.plugin_id):
+        self.olad.fill_device(response.device.add(), device)
+    done(response)
+
+  def GetUniverseInfo(self, controller, request, done):
+    response = Ola_pb2.UniverseInfoReply()
+    for universe in sorted(self.olad.universes.values(),
+                           key=lambda universe: universe.id):
+      if request.HasField('universe') and request.universe != universe.id:
+        continue
+      self.olad.fill_universe(response.universe.add(), universe)
+    done(response)
+
+  def SetUniverseName(self, controller, request, done):
+    universe = self.olad.universes.get(request.universe)
+    if universe is None:
+      controller.SetFailed('Universe %d does not exist' % request.universe)
+    else:
+      universe.name = request.name
+    done(Ola_pb2.Ack())
+
+  def SetMergeMode(self, controller, request, done):
+    universe = self.olad.universes.get(request.universe)
+    if universe is None:
+      controller.SetFailed('Universe %d does not exist' % request.universe)
+    else:
+      universe.merge_mode = request.merge_mode
+    done(Ola_pb2.Ack())
+
+  def PatchPort(self, controller, request, done):
+    port = self.olad.find_port(request.device_alias, request.port_id,
+                               request.is_output)
+    if port is None:
+      controller.SetFailed('Port %d of device %d does not exist' %
+                           (request.port_id, request.device_alias))
+    elif request.action == Ola_pb2.PATCH:
+      port.universe = request.universe
+      self.olad.universe(request.universe)
+    else:
+      port.universe = None
+    done(Ola_pb2.Ack())
+
+  def RegisterForDmx(self, controller, request, done):
+    if request.action == Ola_pb2.REGISTER:
+      self.olad.universe(request.universe)
+      self.connection.registered.add(request.universe)
+    else:
+      self.connection.registered.discard(request.universe)
+    done(Ola_pb2.Ack())
+
+  def UpdateDmxData(self, controller, request, done):
+    self.olad.frames_received += 1
+    self.olad.universe(request.universe).data = request.data
+    self.olad.forward(request.universe, request.data, self.connection)
+    done(Ola_pb2.Ack())
+
+  def StreamDmxData(self, controller, request, done):
+    self.UpdateDmxData(controller, request, done)
+
+  def GetDmx(self, controller, request, done):
+    response = Ola_pb2.DmxData()
+    response.universe = request.universe
+    universe = self.olad.universes.get(request.universe)
+    response.data = universe.data if universe else ''
+    done(response)
+
+class FakeConnection(object):
+  """A client connected to FakeOlad"""
+
+  def __init__(self, olad, client_socket):
+    self.olad = olad
+    self.socket = client_socket
+    self.registered = set()
+    self.closed = False
+    self.channel = StreamRpcChannel(client_socket,
+                                    FakeOladService(olad, self),
+                                    self.close)
+    self.stub = Ola_pb2.OlaClientService_Stub(self.channel)
+
+  def socket_ready(self):
+    """Reads whatever the client sent"""
+    try:
+      self.channel.SocketReady()
+    except socket.error:
+      self.close()
+
+  def push(self, universe, data):
+    """Sends a frame of a universe to the client"""
+    request = Ola_pb2.DmxData()
+    request.universe = universe
+    request.data = data
+    try:
+      self.stub.UpdateDmxData(SimpleRpcController(), request,
+                              lambda controller, response: None)
+    except socket.error:
+      self.close()
+      return False
+    return True
+
+  def close(self):
+    """Closes the connection, whichever end it was closed from"""
+    if self.closed:
+      return
+    self.closed = True
+    self.olad.connection_closed(self)
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+      pass
+    self.socket.close()
+
+class FakeOlad(threading.Thread):
+  """Serves the OLA RPC protocol on its own thread.
+
+     Args:
+       universes: the ids of the universes that exist at first
+       devices: a list of FakeDevices, one device with four input and four
+                output ports if None
+       port: the TCP port to listen on, 0 picks a free one
+       rate: how many synthetic frames a second to push to each registered
+             universe, none if 0
+       latency: seconds to wait before answering each request
+       jitter: up to this many seconds are added to the latency at random
+       drop: the fraction of requests that are never answered
+       disconnect_every: if set, every client is disconnected this often,
+                         in seconds
+       seed: seeds the random faults, for repeatable runs
+  """
+
+  def __init__(self, universes=(1,), devices=None, port=0, rate=0,
+               latency=0, jitter=0, drop=0, disconnect_every=None,
+               seed=None):
+    super(FakeOlad, self).__init__()
+    self.daemon = True
+    if devices is None:
+      devices = [FakeDevice(1, 'Fake Device')]
+    self.devices = devices
+    self.universes = {}
+    for universe in universes:
+      self.universe(universe)
+    self.rate = rate
+    self.latency = latency
+    self.jitter = jitter
+    self.drop = drop
+    self.disconnect_every = disconnect_every
+    self.random = random.Random(seed)
+    self.connections = []
+    self.selectserver = None
+    self._ready = threading.Event()
+    self.listener = socket.socket()
+    self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self.listener.bind(('127.0.0.1', port))
+    self.listener.listen(16)
+    self.address = self.listener.getsockname()
+    self.requests = {}
+    self.dropped = 0
+    self.frames_pushed = 0
+    self.frames_received = 0
+    self.disconnects = 0
+    self.ticks = 0
+    self.origin = None
+
+  def start(self):
+    """Starts serving, and returns once connections are accepted"""
+    super(FakeOlad, self).start()
+    self._ready.wait()
+
+  def run(self):
+    self.selectserver = SelectServer()
+    self.selectserver.AddReadDescriptor(self.listener, self.accept)
+    if self.rate:
+      self.origin = time.time()
+      self.selectserver.AddEvent(0, self.tick)
+    if self.disconnect_every:
+      self.selectserver.AddEvent(self.disconnect_every * 1000,
+                                 self.disconnect_periodically)
+    self._ready.set()
+    self.selectserver.Run()
+    for connection in list(self.connections):
+      connection.close()
+    self.listener.close()
+
+  def stop(self):
+    """Closes every connection and stops serving"""
+    if self.selectserver:
+      self.selectserver.Terminate()
+    self.join()
+
+  def disconnect(self):
+    """Drops every client connection; may be called from any thread"""
+    self.selectserver.Execute(self.disconnect_all)
+
+  def stats(self):
+    """Returns the request and frame counts as a dict"""
+    return {'connections': len(self.connections),
+            'requests': dict(self.requests),
+            'dropped': self.dropped,
+            'frames_pushed': self.frames_pushed,
+            'frames_received': self.frames_received,
+            'disconnects': self.disconnects}
+
+  def accept(self):
+    client_socket, address = self.listener.accept()
+    connection = FakeConnection(self, client_socket)
+    self.connections.append(connection)
+    self.selectserver.AddReadDescriptor(client_socket,
+                                        connection.socket_ready)
+
+  def connection_closed(self, connection):
+    self.selectserver.RemoveReadDescriptor(connection.socket)
+    if connection in self.connections:
+      self.connections.remove(connection)
+
+  def disconnect_all(self):
+    for connection in list(self.connections):
+      connection.close()
+      self.disconnects += 1
+
+  def disconnect_periodically(self):
+    self.disconnect_all()
+    self.selectserver.AddEvent(self.disconnect_every * 1000,
+                               self.disconnect_periodically)
+
+  def fault(self, name, done):
+    """Counts a request, and returns its done callback with the configured
+       drop and latency applied
+    """
+    self.requests[name] = self.requests.get(name, 0) + 1
+    if self.drop and self.random.random() < self.drop:
+      self.dropped += 1
+      return lambda response: None
+    delay = self.latency
+    if self.jitter:
+      delay += self.random.uniform(0, self.jitter)
+    if not delay:
+      return done
+    def delayed(response):
+      self.selectserver.AddEvent(delay * 1000,
+                                 lambda: self.reply_later(done, response))
+    return delayed
+
+  @staticmethod
+  def reply_later(done, response):
+    try:
+      done(response)
+    except socket.error:
+      pass
+
+  def tick(self):
+    """Pushes a synthetic frame to every registered universe, then
+       schedules the next tick against the time pushing started so the
+       rate does not drift
+    """
+    step = self.ticks
+    self.ticks += 1
+    for connection in list(self.connections):
+      for universe in list(connection.registered):
+        data = _PATTERN[(step + universe) % len(_PATTERN)]
+        self.universe(universe).data = data
+        if not connection.push(universe, data):
+          break
+        self.frames_pushed += 1
+    due = self.origin + float(self.ticks) / self.rate
+    self.selectserver.AddEvent(max(0, due - time.time()) * 1000, self.tick)
+
+  def forward(self, universe, data, source):
+    """Sends a frame a client sent to every other client registered for
+       the universe
+    """
+    for connection in list(self.connections):
+      if connection is not source and universe in connection.registered:
+        if connection.push(universe, data):
+          self.frames_pushed += 1
+
+  def universe(self, universe_id):
+    """Returns a universe, creating it if it does not exist yet"""
+    universe = self.universes.get(universe_id)
+    if universe is None:
+      universe = self.universes[universe_id] = FakeUniverse(universe_id)
+    return universe
+
+  def find_port(self, alias, port_id, is_output):
+    for device in self.devices:
+      if device.alias == alias:
+        return device.port(port_id, is_output)
+    return None
+
+  def fill_device(self, device_pb, device):
+    device_pb.device_alias = device.alias
+    device_pb.plugin_id = device.plugin_id
+    device_pb.device_name = device.name
+    device_pb.device_id = '%d-%d' % (device.plugin_id, device.alias)
+    for ports, field in ((device.input_ports, device_pb.input_port),
+                         (device.output_ports, device_pb.output_port)):
+      for port in ports:
+        port_pb = field.add()
+        port_pb.port_id = port.id
+        port_pb.priority_capability = 0
+        port_pb.description = port.description(device)
+        port_pb.active = port.universe is not None
+        if port.universe is not None:
+          port_pb.universe = port.universe
+        port_pb.supports_rdm = port.supports_rdm
+
+  def fill_universe(self, universe_pb, universe):
+    universe_pb.universe = universe.id
+    universe_pb.name = universe.name
+    universe_pb.merge_mode = universe.merge_mode
+    inputs = outputs = 0
+    for device in self.devices:
+      inputs += sum(1 for port in device.input_ports
+                    if port.universe == universe.id)
+      outputs += sum(1 for port in device.output_ports
+                     if port.universe == universe.id)
+    universe_pb.input_port_count = inputs
+    universe_pb.output_port_count = outputs
+    universe_pb.rdm_devices = 0
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Serves the OLA RPC protocol without olad.')
+  parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+  parser.add_argument('--universes', type=int, default=1,
+                      help='universes 1 to N exist at first')
+  parser.add_argument('--devices', type=int, default=1)
+  parser.add_argument('--ports', type=int, default=4,
+                      help='input and output ports per device')
+  parser.add_argument('--rate', type=float, default=0,
+                      help='synthetic frames a second per registered universe')
+  parser.add_argument('--latency', type=float, default=0,
+                      help='milliseconds before each reply')
+  parser.add_argument('--jitter', type=float, default=0,
+                      help='up to this many milliseconds more per reply')
+  parser.add_argument('--drop', type=float, default=0,
+                      help='fraction of requests never answered')
+  parser.add_argument('--disconnect-every', type=float,
+                      help='seconds between dropping every client')
+  args = parser.parse_args(argv[1:])
+  devices = [FakeDevice(alias, 'Fake Device %d' % alias, args.ports,
+                        args.ports)
+             for alias in xrange(1, args.devices + 1)]
+  olad = FakeOlad(range(1, args.universes + 1), devices, args.port,
+                  args.rate, args.latency / 1000., args.jitter / 1000.,
+                  args.drop, args.disconnect_every)
+  olad.start()
+  sys.stderr.write('Serving on %s:%d\n' % olad.address)
+  try:
+    while olad.is_alive():
+      time.sleep(1)
+  except KeyboardInterrupt:
+    pass
+  olad.stop()
+  sys.stderr.write('%(frames_pushed)d frames pushed, %(frames_received)d '
+                   'received, %(dropped)d requests dropped, %(disconnects)d '
+                   'disconnects\n' % olad.stats())
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
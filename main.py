@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import kivy
 kivy.require('1.8.0')
+import os
 from time import time
 from signal import signal, SIGINT
 from Queue import Queue, Empty
@@ -19,9 +20,11 @@ from kivy.uix.label import Label
 from kivy.uix.popup import Popup
 from kivy.adapters.listadapter import ListAdapter
 from kivy.uix.listview import ListView, ListItemButton
-from olalistener import OLAListener, UIEvent
+from olalistener import OLAListener, UIEvent, FrameMailbox
+from olametrics import RPCMetrics, UIMetrics, FrameLatency
+from metricsserver import MetricsServer
 from settingsscreen import MainScreen, PatchingPopup
-from monitorscreen import MonitorScreen
+from monitorscreen import MonitorScreen, CELLS_MODE
 from consolescreen import ConsoleScreen
 from ola.OlaClient import OlaClient, Universe
 from ola.ClientWrapper import SelectServer
@@ -52,8 +55,18 @@ class UniverseSelectedService(EventDispatcher):
 class RPiUI(App):
   """Class for drawing and handling the Kivy application itself."""
   EVENT_POLL_INTERVAL = 1 / 20
-  UNIVERSE_POLL_INTERVAL = 1 / 10
+  EVENT_DRAIN_BUDGET = 0.004
+  UNIVERSE_POLL_INTERVAL = 1 / 2.
+  MONITOR_RENDER_MODE = CELLS_MODE
+  METRICS_PORT_VARIABLE = 'RPIUI_METRICS_PORT'
+  SHOW_LATENCY_OVERLAY = True
+  LATENCY_OVERLAY_INTERVAL = 0.5
+  ui_metrics = None
+  metrics_server = None
+  frame_latency = None
   index = NumericProperty(-1)
+  ui_queue_depth = NumericProperty(0)
+  events_drained = NumericProperty(0)
   time = NumericProperty(0)
   current_title = StringProperty()
   screen_names = ListProperty([])
@@ -63,17 +76,27 @@ class RPiUI(App):
     #TODO: Reorganize and consolidate; make necessary helper functions
     self.title = 'Open Lighting Architecture'
     self.ui_queue = Queue()
+    self.frame_mailbox = FrameMailbox()
+    self.frame_latency = FrameLatency()
     self.layout = BoxLayout(orientation='vertical')
     self.selected_universe_service = UniverseSelectedService()
+    metrics_port = os.environ.get(self.METRICS_PORT_VARIABLE)
+    self.ui_metrics = UIMetrics() if metrics_port else None
     self.ola_listener = OLAListener(self.ui_queue,
                                     self.create_select_server,
                                     self.create_ola_client,
                                     self.start_ola,
-                                    self.stop_ola)
+                                    self.stop_ola,
+                                    self.frame_mailbox,
+                                    RPCMetrics(enabled=bool(metrics_port)))
+    if metrics_port:
+      self.metrics_server = MetricsServer(self.ola_listener, self.ui_metrics,
+                                          int(metrics_port))
     #Screen creation and layout placing
     self.screen_tabs = ScreenTabs()
     self.monitor_screen = MonitorScreen(self.ola_listener,
                                         self.selected_universe_service,
+                                        self.MONITOR_RENDER_MODE,
                                         name='DMX Monitor')
     self.console_screen = ConsoleScreen(self.ola_listener,
                                         self.selected_universe_service,
@@ -88,16 +111,23 @@ class RPiUI(App):
     Clock.schedule_interval(lambda dt: self.display_tasks(),
                             self.EVENT_POLL_INTERVAL)
     Clock.schedule_interval(self._update_clock, 1 / 60.)
+    if self.SHOW_LATENCY_OVERLAY:
+      Clock.schedule_interval(self.update_latency_overlay,
+                              self.LATENCY_OVERLAY_INTERVAL)
     return self.layout
 
   def on_start(self):
     """Executed after build()"""
     signal(SIGINT, self.stop) #Captures ctrl-c to exit correctly
     self.ola_listener.start()
+    if self.metrics_server:
+      self.metrics_server.start()
 
   def on_stop(self):
     """Executed when the application quits"""
     self.ola_listener.stop()
+    if self.metrics_server:
+      self.metrics_server.stop()
 
   def on_pause(self):
     """Pausing is not allowed; the application will close instead"""
@@ -112,8 +142,8 @@ class RPiUI(App):
     return SelectServer()
 
   @staticmethod
-  def create_ola_client():
-    return OlaClient()
+  def create_ola_client(close_callback=None):
+    return OlaClient(close_callback=close_callback)
 
   def start_ola(self):
     """Executed when OLAD starts, enables proper UI actions"""
@@ -124,17 +154,52 @@ class RPiUI(App):
     self.devsets.stop_ola()
 
   def display_tasks(self):
-    """Polls for events that need to update the UI,
-       then updates the UI accordingly.
+    """Polls for events that need to update the UI, then updates the UI
+       accordingly.  Events are run until the queue is empty or
+       EVENT_DRAIN_BUDGET seconds have passed; whatever is left over is
+       carried to the next frame.  The newest DMX frames are then taken from
+       the frame mailbox, so at most one frame per universe is drawn per tick,
+       and their latency is recorded in frame_latency.
+       ui_queue_depth and events_drained are updated after every tick so the
+       backlog can be observed, and recorded in ui_metrics if it is enabled.
     """
-    try:
-      event = self.ui_queue.get(False)
+    deadline = time() + self.EVENT_DRAIN_BUDGET
+    drained = 0
+    while True:
+      try:
+        event = self.ui_queue.get(False)
+      except Empty:
+        break
       event.run()
-    except Empty:
-      pass
+      drained += 1
+      if time() >= deadline:
+        break
+    collected = time()
+    for event in self.frame_mailbox.collect():
+      event.run()
+      drained += 1
+      if self.frame_latency and event.stamp is not None:
+        if self.frame_latency.handled(event.universe, event.stamp, collected,
+                                      time()):
+          Clock.schedule_once(self._frames_drawn, 0)
+    self.events_drained = drained
+    self.ui_queue_depth = self.ui_queue.qsize()
+    if self.ui_metrics:
+      self.ui_metrics.tick(drained)
 
   def _update_clock(self, dt):
     self.time = time()
+    if self.ui_metrics:
+      self.ui_metrics.frame(dt)
+
+  def _frames_drawn(self, dt):
+    """Runs after the Kivy frame that drew the frames handled last tick"""
+    self.frame_latency.drawn(time())
+
+  def update_latency_overlay(self, dt):
+    """Shows the frame latency of the monitored universe on the monitor"""
+    self.monitor_screen.show_latency(self.frame_latency.snapshot(),
+                                     self.frame_mailbox.coalesced_counts())
 
   def olad_listen(self, dt):
     self.ola_listener.listen(self)
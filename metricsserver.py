@@ -0,0 +1,169 @@
+"""Serves the performance counters of an OLAListener and the UI over HTTP
+   in the Prometheus text format, so that rigs running without anyone at
+   the touchscreen can be watched.
+
+   The server runs on a daemon thread of its own.  It only reads
+   snapshots, which hold the metrics locks for as long as a copy takes, so
+   it never blocks the OLA SelectServer or the Kivy main thread.
+"""
+
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from olalistener import CONNECTED
+from olametrics import STAGES
+
+DEFAULT_PORT = 9110
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PREFIX = 'ola_rpiui_'
+QUANTILES = (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'))
+
+def format_value(value):
+  """Formats a sample value the way Prometheus expects"""
+  if isinstance(value, float):
+    if value == float('inf'):
+      return '+Inf'
+    return repr(value)
+  return str(value)
+
+def format_labels(labels):
+  """Formats a list of (name, value) label pairs"""
+  if not labels:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                         .replace('"', '\\"'))
+                           for name, value in labels)
+
+def add_metric(lines, name, kind, description, samples):
+  """Adds a metric and its samples to the exposition.
+
+     Args:
+       lines: the list of lines being built
+       name: the metric name, without PREFIX
+       kind: counter, gauge or summary
+       description: the HELP text
+       samples: a list of (suffix, labels, value) tuples
+  """
+  lines.append('# HELP %s%s %s' % (PREFIX, name, description))
+  lines.append('# TYPE %s%s %s' % (PREFIX, name, kind))
+  for suffix, labels, value in samples:
+    lines.append('%s%s%s%s %s' % (PREFIX, name, suffix,
+                                  format_labels(labels), format_value(value)))
+
+def summary_samples(labels, histogram):
+  """Returns the samples of a summary from a histogram snapshot"""
+  samples = [('', labels + [('quantile', quantile)], histogram[key])
+             for quantile, key in QUANTILES]
+  samples.append(('_sum', labels, histogram['sum']))
+  samples.append(('_count', labels, histogram['count']))
+  return samples
+
+def render_metrics(ola_listener, ui_metrics=None):
+  """Returns the exposition of an OLAListener's metrics, and the UI's if
+     ui_metrics is given, as a string.
+  """
+  lines = []
+  add_metric(lines, 'olad_connected', 'gauge',
+             'Whether the OLAListener is connected to olad',
+             [('', [], int(ola_listener.state == CONNECTED))])
+  add_metric(lines, 'olad_reconnects_total', 'counter',
+             'Connections to olad made after the first',
+             [('', [], ola_listener.reconnect_count)])
+  add_metric(lines, 'ui_queue_depth', 'gauge',
+             'UIEvents waiting on the ui_queue',
+             [('', [], ola_listener.ui_queue.qsize())])
+  if ui_metrics:
+    ui = ui_metrics.snapshot()
+    add_metric(lines, 'ui_ticks_total', 'counter',
+               'display_tasks ticks run', [('', [], ui['ticks'])])
+    add_metric(lines, 'ui_events_drained', 'gauge',
+               'Events run by the last display_tasks tick',
+               [('', [], ui['last_drained'])])
+    add_metric(lines, 'ui_events_drained_total', 'counter',
+               'Events run by display_tasks',
+               [('', [], ui['events_drained'])])
+    add_metric(lines, 'ui_frame_time_seconds', 'summary',
+               'Time between UI frames',
+               summary_samples([], ui['frame_time']))
+  metrics = ola_listener.metrics
+  if not metrics.enabled:
+    return '\n'.join(lines) + '\n'
+  snapshot = metrics.snapshot()
+  universes = sorted(snapshot['universes'].iteritems())
+  add_metric(lines, 'dmx_frames_received_total', 'counter',
+             'DMX frames received from olad',
+             [('', [('universe', universe)], counts['frames'])
+              for universe, counts in universes])
+  add_metric(lines, 'dmx_frames_received_per_second', 'gauge',
+             'Rate of DMX frames received from olad',
+             [('', [('universe', universe)], counts['fps'])
+              for universe, counts in universes])
+  add_metric(lines, 'dmx_frames_sent_total', 'counter',
+             'DMX frames sent to olad',
+             [('', [('universe', universe)], counts['sent'])
+              for universe, counts in universes])
+  requests = sorted(snapshot['requests'].iteritems())
+  add_metric(lines, 'rpc_in_flight', 'gauge',
+             'Requests waiting for a reply from olad',
+             [('', [('request', request)], counts['in_flight'])
+              for request, counts in requests])
+  add_metric(lines, 'rpc_completed_total', 'counter',
+             'Requests olad has replied to',
+             [('', [('request', request)], counts['completed'])
+              for request, counts in requests])
+  latencies = []
+  for request, counts in requests:
+    for stage in STAGES:
+      if stage in counts:
+        latencies.extend(summary_samples([('request', request),
+                                          ('stage', stage)], counts[stage]))
+  add_metric(lines, 'rpc_latency_seconds', 'summary',
+             'Request latency by stage: queue_wait, round_trip or '
+             'ui_dispatch', latencies)
+  return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+  """Answers GET /metrics with the exposition of the server's metrics"""
+
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.server.render()
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    """Scrapes are frequent; they are not logged"""
+    pass
+
+class MetricsServer(threading.Thread):
+  """A daemon thread serving the metrics of an OLAListener over HTTP.
+
+     Args:
+       ola_listener: the OLAListener whose metrics are served; they are
+                     only complete if it was created with an enabled
+                     RPCMetrics
+       ui_metrics: the UIMetrics of the UI, if any
+       port: the TCP port to listen on, 0 picks a free one
+       address: the address to listen on, localhost by default
+  """
+
+  def __init__(self, ola_listener, ui_metrics=None, port=DEFAULT_PORT,
+               address='127.0.0.1'):
+    super(MetricsServer, self).__init__()
+    self.daemon = True
+    self.httpd = HTTPServer((address, port), MetricsHandler)
+    self.httpd.render = lambda: render_metrics(ola_listener, ui_metrics)
+    self.port = self.httpd.server_address[1]
+
+  def run(self):
+    self.httpd.serve_forever()
+
+  def stop(self):
+    """Stops serving and closes the socket"""
+    if self.is_alive():
+      self.httpd.shutdown()
+    self.httpd.server_close()
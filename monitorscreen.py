@@ -3,77 +3,372 @@
 import math
 import kivy
 from kivy.lang import Builder
-from kivy.properties import NumericProperty
+from kivy.properties import NumericProperty, StringProperty
 from kivy.metrics import dp
+from kivy.clock import Clock
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, Rectangle, Fbo, ClearColor, ClearBuffers
+from kivy.graphics.texture import Texture
 from kivy.uix.screenmanager import Screen
 from kivy.uix.gridlayout import GridLayout
-from kivy.uix.stacklayout import StackLayout
 from kivy.uix.label import Label
+from kivy.uix.widget import Widget
+from virtualcarousel import VirtualCarousel
 
 _CELL_WIDTH = 32
 _CELL_HEIGHT = 32
 _DMX_CHANNELS = 512
+_DIFF_BLOCK = 32
+_GRID_COLUMN_CHOICES = (4, 8, 16, 32, 64, 128)
+_ATLAS_COLUMNS = 32
+_CHANNEL_GLYPH_HEIGHT = 14
+_VALUE_GLYPH_HEIGHT = 20
+
+CELLS_MODE = 'cells'
+GRID_MODE = 'grid'
+
+# Built once, so drawing a value is a lookup rather than a str() and a
+# division per channel per frame.
+_VALUE_LABELS = [str(value) for value in xrange(256)]
+_VALUE_ALPHAS = [float(value) / _DMX_CHANNELS for value in xrange(256)]
+_CHANNEL_LABELS = [str(channel + 1) for channel in xrange(_DMX_CHANNELS)]
 
 Builder.load_file('monitorscreen.kv')
 
 class MonitorCell(GridLayout):
   alpha = NumericProperty(0)
 
+def changed_channels(old, new):
+  """Finds the channels that differ between two frames.  The frames are
+     compared as strings, a block of _DIFF_BLOCK channels at a time, so
+     unchanged regions are skipped without a Python-level loop per channel.
+
+     Args:
+       old: a bytearray holding the previous frame
+       new: a bytearray of the same length holding the new frame
+     Returns:
+       a list of the indices of every channel that changed
+  """
+  if old == new:
+    return []
+  changed = []
+  for start in xrange(0, len(new), _DIFF_BLOCK):
+    end = start + _DIFF_BLOCK
+    if old[start:end] != new[start:end]:
+      changed.extend(index for index in xrange(start, min(end, len(new)))
+                     if old[index] != new[index])
+  return changed
+
+class FrameBuffer(object):
+  """Holds the current frame of a universe in a preallocated bytearray.
+     New data is copied into a second buffer, compared with the current
+     one and the two are swapped, so taking a frame allocates nothing.
+  """
+
+  def __init__(self):
+    self.frame = bytearray(_DMX_CHANNELS)
+    self.incoming = bytearray(_DMX_CHANNELS)
+    self.received = False
+
+  def take(self, data):
+    """Makes data the current frame.  Channels beyond the end of a short
+       frame keep their values.
+
+       Args:
+         data: the DMX data, a bytearray from the OLAListener or an
+               array('B')
+       Returns:
+         the indices of the channels that changed; every channel in data
+         for the first frame
+    """
+    length = min(len(data), _DMX_CHANNELS)
+    if length < len(data):
+      data = data[:length]
+    self.incoming[:length] = data
+    if length < _DMX_CHANNELS:
+      self.incoming[length:] = self.frame[length:]
+    if self.received:
+      changed = changed_channels(self.frame, self.incoming)
+    else:
+      changed = range(length)
+      self.received = True
+    self.frame, self.incoming = self.incoming, self.frame
+    return changed
+
+class GlyphAtlas(object):
+  """Renders every channel number and every DMX value once into a single
+     texture, so that the monitor grid can show text by pointing
+     rectangles at regions of it instead of re-rendering labels.
+  """
+
+  def __init__(self):
+    slot_width = int(dp(_CELL_WIDTH))
+    channel_height = int(dp(_CHANNEL_GLYPH_HEIGHT))
+    value_height = int(dp(_VALUE_GLYPH_HEIGHT))
+    channel_rows = int(math.ceil(float(_DMX_CHANNELS) / _ATLAS_COLUMNS))
+    value_rows = int(math.ceil(256.0 / _ATLAS_COLUMNS))
+    self.slot_width = slot_width
+    self.channel_height = channel_height
+    self.value_height = value_height
+    self.fbo = Fbo(size=(slot_width * _ATLAS_COLUMNS,
+                         channel_height * channel_rows +
+                         value_height * value_rows))
+    slots = []
+    with self.fbo:
+      ClearColor(0, 0, 0, 0)
+      ClearBuffers()
+      Color(1, 1, 1, 1)
+      for channel in xrange(_DMX_CHANNELS):
+        slots.append(self._draw_glyph(_CHANNEL_LABELS[channel], dp(10),
+                                      channel, 0, channel_height))
+      for value in xrange(256):
+        slots.append(self._draw_glyph(_VALUE_LABELS[value], dp(15), value,
+                                      channel_height * channel_rows,
+                                      value_height))
+    self.fbo.draw()
+    texture = self.fbo.texture
+    self.channels = [texture.get_region(*slot)
+                     for slot in slots[:_DMX_CHANNELS]]
+    self.values = [texture.get_region(*slot)
+                   for slot in slots[_DMX_CHANNELS:]]
+
+  def _draw_glyph(self, text, font_size, slot, offset, height):
+    """Draws text centered in its slot of the atlas and returns the slot
+       as (x, y, width, height)
+    """
+    label = CoreLabel(text=text, font_size=font_size)
+    label.refresh()
+    x = (slot % _ATLAS_COLUMNS) * self.slot_width
+    y = offset + (slot / _ATLAS_COLUMNS) * height
+    width, glyph_height = label.texture.size
+    Rectangle(texture=label.texture,
+              pos=(x + (self.slot_width - width) / 2,
+                   y + (height - glyph_height) / 2),
+              size=label.texture.size)
+    return (x, y, self.slot_width, height)
+
+class MonitorGrid(Widget):
+  """Draws a whole universe as one widget.  The channel levels are a
+     single texture with one texel per channel, blitted straight from the
+     frame, and the numbers are rectangles pointing into a GlyphAtlas.
+  """
+
+  def __init__(self, **kwargs):
+    super(MonitorGrid, self).__init__(**kwargs)
+    self.frames = FrameBuffer()
+    # Luminance is fixed at full and alpha carries the level, which matches
+    # the alpha blending of a MonitorCell.
+    self.levels = bytearray('\xff\x00' * _DMX_CHANNELS)
+    self.atlas = None
+    self.texture = None
+    self.columns = 0
+    self.value_rects = []
+    self._trigger_layout = Clock.create_trigger(self.do_layout)
+    self.bind(pos=self._trigger_layout, size=self._trigger_layout)
+
+  def do_layout(self, *args):
+    """Picks a number of columns that keeps cells close to square, then
+       rebuilds the canvas for the current size.
+    """
+    if self.width <= 1 or self.height <= 1:
+      return
+    if self.atlas is None:
+      self.atlas = GlyphAtlas()
+    aspect = float(self.width) / self.height
+    columns = min(_GRID_COLUMN_CHOICES,
+                  key=lambda c: abs(math.log(c * c / (_DMX_CHANNELS *
+                                                      aspect))))
+    rows = _DMX_CHANNELS / columns
+    if columns != self.columns:
+      self.columns = columns
+      self.texture = Texture.create(size=(columns, rows),
+                                    colorfmt='luminance_alpha')
+      self.texture.mag_filter = 'nearest'
+      self.texture.min_filter = 'nearest'
+      self.texture.flip_vertical()
+      self.blit_levels()
+    cell_width = float(self.width) / columns
+    cell_height = float(self.height) / rows
+    atlas = self.atlas
+    self.canvas.clear()
+    self.value_rects = []
+    with self.canvas:
+      Color(0, 0.5, 0, 1)
+      Rectangle(texture=self.texture, pos=self.pos, size=self.size)
+      Color(1, 1, 1, 1)
+      for index in xrange(_DMX_CHANNELS):
+        x = self.x + (index % columns) * cell_width + \
+            (cell_width - atlas.slot_width) / 2
+        top = self.top - (index / columns) * cell_height
+        Rectangle(texture=atlas.channels[index],
+                  pos=(x, top - atlas.channel_height),
+                  size=(atlas.slot_width, atlas.channel_height))
+        self.value_rects.append(
+          Rectangle(texture=atlas.values[self.frames.frame[index]],
+                    pos=(x, top - cell_height),
+                    size=(atlas.slot_width, atlas.value_height)))
+
+  def blit_levels(self):
+    """Uploads the channel levels of the current frame to the GPU"""
+    if self.texture:
+      self.texture.blit_buffer(str(self.levels), colorfmt='luminance_alpha',
+                               bufferfmt='ubyte')
+      self.canvas.ask_update()
+
+  def update_data(self, data):
+    """Takes the new data, uploads the levels in one blit and repoints the
+       value rectangles of the channels that changed.
+
+       Args:
+         data: a buffer of up to 512 channels of dmx data
+    """
+    changed = self.frames.take(data)
+    if not changed:
+      return
+    frame = self.frames.frame
+    self.levels[1::2] = frame
+    self.blit_levels()
+    if self.value_rects:
+      values = self.atlas.values
+      for index in changed:
+        self.value_rects[index].texture = values[frame[index]]
+
 class MonitorScreen(Screen):
   """This screen displays the values of as many DMX channels as will fit
      on the screen.
   """
-  def __init__(self, ola_listener, selected_universe_service, **kwargs):
+  latency_text = StringProperty('')
+
+  def __init__(self, ola_listener, selected_universe_service,
+               render_mode=CELLS_MODE, **kwargs):
     """Args:
          ola_listener: an OLAListener object with which to register
                        and unregister DMX listening.
          selected_universe_service: a UniverseSelectedService object for managing
                        the user-selected universe
+         render_mode: CELLS_MODE to draw a MonitorCell widget per channel on
+                      a carousel, or GRID_MODE to draw the whole universe
+                      in a single MonitorGrid widget.
     """
     super(MonitorScreen, self).__init__(**kwargs)
     self.ola_listener = ola_listener
     self.selected_universe_service = selected_universe_service
     self.on_enter = self.register_dmx_listener
     self.on_leave = self.unregister_dmx_listener
-    self.channels = []
-    for channel_index in range(_DMX_CHANNELS):
-      channel = MonitorCell(width=dp(_CELL_WIDTH),height=dp(_CELL_HEIGHT))
-      channel.ids.channel.text = str(channel_index+1)
-      self.channels.append(channel)
+    self.active = False
+    self.subscribed_universe = None
+    self.selected_universe_service.bind( \
+      selected_universe=self.change_selected_universe)
+    self.frames = FrameBuffer()
+    self.grid = None
+    self.pages = None
+    self.carousel_size = (0, 0)
+    self._trigger_relayout = Clock.create_trigger(self.relayout)
+    if render_mode == GRID_MODE:
+      self.grid = MonitorGrid()
+      self.ids.monitor.clear_widgets()
+      self.ids.monitor.add_widget(self.grid)
+      return
+    self.pages = VirtualCarousel(self.ids.monitor_car, _DMX_CHANNELS,
+                                 self.create_cell, self.bind_cell)
+
+  @staticmethod
+  def create_cell():
+    """Builds a MonitorCell for the carousel's widget pool"""
+    return MonitorCell(width=dp(_CELL_WIDTH),height=dp(_CELL_HEIGHT))
+
+  def bind_cell(self, cell, index):
+    """Points a pooled MonitorCell at a channel and draws its value.
+
+       Args:
+         cell: the MonitorCell to reuse
+         index: the 0-based index of the channel it now shows
+    """
+    cell.ids.channel.text = _CHANNEL_LABELS[index]
+    if self.frames.received:
+      self.draw_channel(cell, index)
+    else:
+      cell.ids.data.text = ''
+      cell.alpha = 0
 
   def resize_carousel(self, size):
     """The monitor screen is broken up into smaller screens that are loaded
        individually; when the screen is resized, they update the number on
-       each screen.
+       each screen.  Resizes often come several to a frame, so the
+       relayout itself is deferred to the next frame.
 
        Args:
          size: [width, height] of the Carousel widget
     """
-    width = size[0]
-    height = size[1]
+    self.carousel_size = size
+    self._trigger_relayout()
+
+  def relayout(self, dt=0):
+    """Moves the cells onto pages for the last carousel size given"""
+    if self.pages is None:
+      return
+    width = self.carousel_size[0]
+    height = self.carousel_size[1]
     channels_per_page = int(width / _CELL_WIDTH) * int(height / _CELL_HEIGHT)
-    pages = [self.channels[x:x+channels_per_page] for x in 
-             xrange(0, len(self.channels), channels_per_page)]
-    for slide in self.ids.monitor_car.slides:
-      slide.clear_widgets()
-    self.ids.monitor_car.clear_widgets()
-    for page in pages:
-      slide = StackLayout(size_hint_x=1, size_hint_y=1)
-      for cell in page:
-        slide.add_widget(cell)
-      self.ids.monitor_car.add_widget(slide)
+    self.pages.layout(channels_per_page)
+
+  def show_slide(self, slide_index):
+    """Moves the live cells along with the carousel; cells bound to a
+       channel are drawn from the current frame.
+
+       Args:
+         slide_index: the index of the slide now shown in the carousel
+    """
+    if self.pages is not None:
+      self.pages.show(slide_index)
+
+  def draw_channel(self, cell, index):
+    """Updates a cell with the value of a channel in the current frame"""
+    value = self.frames.frame[index]
+    cell.ids.data.text = _VALUE_LABELS[value]
+    cell.alpha = _VALUE_ALPHAS[value]
 
   def update_data(self, data):
-    """Takes the new data and displays it in all 512 cells
+    """Takes the new data and displays it, touching only the live cells
+       whose value changed.  Channels without a live cell are drawn when
+       their slide comes within reach.
 
        Args:
-         data: an array of size 512 containing the dmx data
+         data: a buffer of up to 512 channels of dmx data
     """
-    index = 0
-    for channel in data:
-      self.channels[index].ids.data.text = str(channel)
-      self.channels[index].alpha = float(channel) / _DMX_CHANNELS
-      index = index + 1
+    if self.grid:
+      self.grid.update_data(data)
+      return
+    changed = self.frames.take(data)
+    live_cells = self.pages.widgets
+    for index in changed:
+      cell = live_cells.get(index)
+      if cell:
+        self.draw_channel(cell, index)
+
+  def show_latency(self, latency, coalesced):
+    """Shows how stale the frames of the monitored universe are, in an
+       overlay in the corner of the screen.
+
+       Args:
+         latency: a FrameLatency snapshot
+         coalesced: the number of frames the frame mailbox replaced, per
+                    universe
+    """
+    stages = latency.get(self.subscribed_universe)
+    if not self.active or not stages:
+      self.latency_text = ''
+      return
+    milliseconds = lambda stage, quantile: stages[stage][quantile] * 1000
+    self.latency_text = (
+      'p50 %.1fms  p99 %.1fms\n'
+      'queue %.1f  update %.1f  render %.1f\n'
+      '%d coalesced' % (milliseconds('total', 'p50'),
+                        milliseconds('total', 'p99'),
+                        milliseconds('queue', 'p50'),
+                        milliseconds('update', 'p50'),
+                        milliseconds('render', 'p50'),
+                        coalesced.get(self.subscribed_universe, 0)))
 
   def update_grid_height(self):
     """The grid height must be as high as its last visible child in order
@@ -84,17 +379,26 @@ class MonitorScreen(Screen):
 
   def unregister_dmx_listener(self):
     """Executed when the ScreenManager switches away from the monitor screen"""
-    if self.selected_universe_service.selected_universe:
-      self.ola_listener.stop_dmx_listener( \
-        self.selected_universe_service.selected_universe.id, None, None)
+    self.active = False
+    if self.subscribed_universe is not None:
+      self.ola_listener.stop_dmx_listener(self.subscribed_universe,
+                                          self.update_data, None)
+      self.subscribed_universe = None
 
   def register_dmx_listener(self):
     """Executed when the ScreenManager switches to the monitor screen"""
-    if self.selected_universe_service.selected_universe:
-      self.ola_listener.fetch_dmx( \
-        self.selected_universe_service.selected_universe.id,
-        lambda s,u,d: self.update_data(d))
-      self.ola_listener.start_dmx_listener( \
-        self.selected_universe_service.selected_universe.id,
-        self.update_data, None)
+    self.active = True
+    universe = self.selected_universe_service.selected_universe
+    if universe and universe.id is not None:
+      self.ola_listener.fetch_dmx(universe.id,
+                                  lambda s,u,d: self.update_data(d))
+      self.ola_listener.start_dmx_listener(universe.id, self.update_data, None)
+      self.subscribed_universe = universe.id
 
+  def change_selected_universe(self, instance, value):
+    """Moves the subscription to the newly selected universe if the
+       monitor is being shown.
+    """
+    if self.active:
+      self.unregister_dmx_listener()
+      self.register_dmx_listener()
@@ -1,6 +1,19 @@
+import array
+import random
+import socket
 import sys
 import threading
 import time
+from olametrics import RPCMetrics, InstrumentedClient
+from olametrics import InstrumentedSelectServer, InstrumentedQueue
+from ola.OlaClient import OlaClient, RequestStatus
+from ola.rpc.SimpleRpcController import SimpleRpcController
+
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+
+DMX_UNIVERSE_SIZE = 512
 
 class UIEvent(object):
   """Describes events that the UI needs to execute"""
@@ -12,56 +25,638 @@ class UIEvent(object):
     """
     self.function = function
     self.args = args
+    self.on_run = None
 
   def run(self):
-    """Executes the UI-level event if the function is not None"""
+    """Executes the UI-level event if the function is not None, then
+       on_run if it was set
+    """
     if self.function:
       self.function(*self.args)
+    if self.on_run:
+      self.on_run()
+
+class FrameEvent(UIEvent):
+  """A UIEvent delivering a DMX frame, which remembers the universe and the
+     time the frame arrived from olad so the UI can measure its latency.
+  """
+
+  def __init__(self, function, data, universe, stamp):
+    super(FrameEvent, self).__init__(function, [data])
+    self.universe = universe
+    self.stamp = stamp
+
+class FrameMailbox(object):
+  """Holds only the newest DMX frame for each (universe, callback) pair.
+     DMX data arrives far faster than the UI can draw it, so rather than
+     queueing every frame, the UI collects whatever is newest once per tick.
+     How many frames were replaced before the UI collected them is counted
+     per universe.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._frames = {}
+    self.coalesced = {}
+
+  def __len__(self):
+    return len(self._frames)
+
+  def post(self, universe, function, data, stamp=None):
+    """Stores a frame, replacing any frame not yet collected for this
+       universe and callback.
+
+       Args:
+         universe: the universe id the frame belongs to
+         function: the UI function that will receive the data
+         data: the DMX data for the universe
+         stamp: the time the frame arrived, if it was recorded
+    """
+    key = (universe, function)
+    with self._lock:
+      if key in self._frames:
+        self.coalesced[universe] = self.coalesced.get(universe, 0) + 1
+      self._frames[key] = (data, stamp)
+
+  def collect(self):
+    """Removes every pending frame and returns a list of FrameEvents for
+       them
+    """
+    with self._lock:
+      frames = self._frames
+      self._frames = {}
+    return [FrameEvent(function, data, universe, stamp)
+            for (universe, function), (data, stamp) in frames.iteritems()]
+
+  def coalesced_counts(self):
+    """Returns a copy of the number of frames replaced per universe"""
+    with self._lock:
+      return dict(self.coalesced)
+
+def copy_frame(data):
+  """Copies a DMX frame for its subscribers.  A new bytearray is allocated
+     for every frame rather than reusing slots of a preallocated ring: the
+     mailbox may hold a frame, and the UI may keep one, for as long as they
+     like, so a ring slot could never safely be written again.  Nothing
+     writes to the copy once it is made, and indexing it gives the channel
+     values as ints.
+
+     Args:
+       data: the DMX data, an array('B') or any buffer of byte values
+     Returns:
+       a bytearray of at most DMX_UNIVERSE_SIZE channels
+  """
+  frame = bytearray(buffer(data))
+  if len(frame) > DMX_UNIVERSE_SIZE:
+    del frame[DMX_UNIVERSE_SIZE:]
+  return frame
+
+class DeviceIndex(object):
+  """An index of the devices and ports known to olad, so that patching
+     questions can be answered without fetching the device list again.
+     It is only read and changed from the OLAListener thread.
+  """
+
+  def __init__(self, status, devices):
+    """Patches made through the OLAListener update the ports in place.
+       devices_stale is set once poll_universes sees the universes change,
+       as they do when another olad client patches a port; the next use of
+       the index then fetches the devices again.
+
+       Args:
+         status: the RequestStatus of the FetchDevices that was indexed
+         devices: a list of Device objects
+    """
+    self.status = status
+    self.devices = devices
+    self.devices_stale = False
+    self.by_alias = {}
+    self.universe_ports = {}
+    self.free_ports = {}
+    for device in devices:
+      self.by_alias[device.alias] = device
+      free_ports = self.free_ports.setdefault(device.alias, [])
+      for is_output, ports in ((False, device.input_ports),
+                               (True, device.output_ports)):
+        for port in ports:
+          if port.active:
+            self.universe_ports.setdefault(port.universe, []).append(
+              (device.alias, port.id, is_output))
+          else:
+            free_ports.append((port.id, is_output))
+
+  def ports_on_universe(self, universe_id):
+    """Returns (device alias, port id, is output) for every port patched
+       to universe_id
+    """
+    return list(self.universe_ports.get(universe_id, []))
+
+  def first_free_ports(self):
+    """Returns (device alias, device name, port id, is output) for the first
+       free input and the first free output port of every device.
+    """
+    first_ports = []
+    for device in self.devices:
+      for is_output in (False, True):
+        for port_id, port_is_output in self.free_ports.get(device.alias, []):
+          if port_is_output == is_output:
+            first_ports.append((device.alias, device.name, port_id, is_output))
+            break
+    return first_ports
+
+  def patched(self, device_alias, port_id, is_output, universe_id):
+    """Records that a port was patched to a universe"""
+    port = (port_id, is_output)
+    free_ports = self.free_ports.get(device_alias, [])
+    if port in free_ports:
+      free_ports.remove(port)
+    self.universe_ports.setdefault(universe_id, []).append(
+      (device_alias, port_id, is_output))
+
+  def unpatched(self, device_alias, port_id, is_output, universe_id):
+    """Records that a port was unpatched from a universe"""
+    port = (device_alias, port_id, is_output)
+    universe_ports = self.universe_ports.get(universe_id, [])
+    if port in universe_ports:
+      universe_ports.remove(port)
+      if not universe_ports:
+        del self.universe_ports[universe_id]
+    self.free_ports.setdefault(device_alias, []).append((port_id, is_output))
+    self.free_ports[device_alias].sort()
+
+class RequestBatch(object):
+  """Queues client requests so that they are all sent from a single
+     Execute on the OLAListener thread.  Their RequestStatus results are
+     collected and delivered to the UI in one UIEvent once every request
+     has completed.
+  """
+
+  def __init__(self, ola_listener):
+    """Args:
+         ola_listener: the OLAListener whose client sends the requests
+    """
+    self.ola_listener = ola_listener
+    self.requests = []
+
+  def __len__(self):
+    return len(self.requests)
+
+  def add(self, request, on_done=None):
+    """Queues a request.
+
+       Args:
+         request: makes one client call, takes the client and the callback
+                  for that call, which takes a RequestStatus
+         on_done: called on the OLAListener thread with the RequestStatus
+                  once the request completes
+    """
+    self.requests.append((request, on_done))
+    return self
+
+  def patch_port(self, device_alias, port, is_output, action, universe_id,
+                 on_done=None):
+    """Queues a client.PatchPort request"""
+    return self.add(
+      lambda client, done: client.PatchPort(device_alias, port, is_output,
+                                            action, universe_id, done),
+      on_done)
+
+  def set_universe_name(self, universe_id, name, on_done=None):
+    """Queues a client.SetUniverseName request"""
+    return self.add(
+      lambda client, done: client.SetUniverseName(universe_id, name, done),
+      on_done)
+
+  def execute(self, callback):
+    """Sends every queued request from a single Execute.
+
+       Args:
+         callback: The UI callback that will be placed on the UI queue
+                   with the list of RequestStatus objects, in the order the
+                   requests were added; each fails if olad is not connected
+    """
+    ola_listener = self.ola_listener
+    if not (ola_listener.selectserver and ola_listener.client):
+      status = ola_listener.not_connected_status()
+      ola_listener.ui_queue.put(UIEvent(callback,
+                                        [[status] * len(self.requests)]))
+      return
+    ola_listener.selectserver.Execute(lambda: self.run(callback))
+
+  def run(self, callback):
+    """Sends every queued request; must be called on the OLAListener
+       thread.  Takes the same callback as execute().
+    """
+    ui_queue = self.ola_listener.ui_queue
+    statuses = [None] * len(self.requests)
+    remaining = [len(self.requests)]
+    if not self.requests:
+      ui_queue.put(UIEvent(callback, [statuses]))
+      return
+
+    def request_callback(index, on_done):
+      """Creates the callback that records the result of one request"""
+      def request_done(status):
+        statuses[index] = status
+        if on_done:
+          on_done(status)
+        remaining[0] -= 1
+        if remaining[0] == 0:
+          ui_queue.put(UIEvent(callback, [statuses]))
+      return request_done
+
+    client = self.ola_listener.client
+    for index, (request, on_done) in enumerate(self.requests):
+      request(client, request_callback(index, on_done))
+
+class OutputUniverse(object):
+  """The output buffer of one universe and the statistics of its sends"""
+
+  def __init__(self):
+    self.data = array.array('B', [0] * DMX_UNIVERSE_SIZE)
+    self.dirty = True
+    self.source = None
+    self.source_frame = None
+    self.last_send = 0
+    self.last_tick = None
+    self.sends = 0
+    self.keep_alives = 0
+    self.total_lateness = 0.0
+    self.max_lateness = 0.0
+    self.late_frames = 0
+    self.intervals = 0
+    self.total_jitter = 0.0
+    self.max_jitter = 0.0
+
+  def record_send(self, now, tick, period, lateness, late):
+    """Records a send made on the given tick, lateness seconds after it was
+       due.  The jitter of a send is how far the time since the previous
+       send is from the ticks between them times the period, so skipped
+       ticks do not count as jitter; there is none for the first send of a
+       chain of ticks.
+    """
+    if self.last_tick is not None:
+      jitter = abs(now - self.last_send - (tick - self.last_tick) * period)
+      self.intervals += 1
+      self.total_jitter += jitter
+      self.max_jitter = max(self.max_jitter, jitter)
+    self.last_send = now
+    self.last_tick = tick
+    self.sends += 1
+    self.total_lateness += lateness
+    self.max_lateness = max(self.max_lateness, lateness)
+    if late:
+      self.late_frames += 1
+
+  def stats(self):
+    """Returns the send statistics as a dict"""
+    return {'sends': self.sends,
+            'keep_alives': self.keep_alives,
+            'mean_lateness': (self.total_lateness / self.sends
+                              if self.sends else 0),
+            'max_lateness': self.max_lateness,
+            'mean_jitter': (self.total_jitter / self.intervals
+                            if self.intervals else 0),
+            'max_jitter': self.max_jitter,
+            'late_frames': self.late_frames}
+
+class DMXOutputScheduler(object):
+  """Sends the DMX of every active universe from the OLAListener thread at
+     a fixed rate, so the wire refresh rate does not depend on the UI's
+     frame pacing or on how often faders move.  On each tick a universe is
+     only sent if its frame changed, or if KEEP_ALIVE_INTERVAL has passed
+     since it was last sent.  Ticks are scheduled against the time the
+     scheduler started rather than the previous tick, so one late tick
+     does not push back the rest; how late each send was is recorded per
+     universe, and a send later than half a frame counts as a late frame.
+     The jitter between a universe's sends is recorded alongside.
+     The scheduler only ticks while some universe is active.
+  """
+
+  FRAME_RATE = 44
+  KEEP_ALIVE_INTERVAL = 1
+
+  def __init__(self, ola_listener, frame_rate=FRAME_RATE, clock=time.time):
+    """Args:
+         ola_listener: the OLAListener whose client sends the DMX
+         frame_rate: the number of ticks per second
+         clock: returns the current time in seconds
+    """
+    self.ola_listener = ola_listener
+    self.frame_rate = frame_rate
+    self.clock = clock
+    self.universes = {}
+    self.ticks = 0
+    self.origin = None
+    self._lock = threading.Lock()
+    self._running = False
+    self._generation = 0
+
+  def set_frame(self, universe, data):
+    """Replaces the output buffer of a universe, making it active.  May be
+       called from any thread.
+
+       Args:
+         universe: the universe id to send to
+         data: up to 512 channels of DMX, an array('B') or any buffer
+    """
+    length = min(len(data), DMX_UNIVERSE_SIZE)
+    with self._lock:
+      output = self.universes.setdefault(universe, OutputUniverse())
+      output.data[:length] = array.array('B', bytearray(data[:length]))
+      output.dirty = True
+    self.ensure_running()
+
+  def set_channel(self, universe, channel, value):
+    """Sets one channel of a universe's output buffer, making it active.
+       May be called from any thread.
+
+       Args:
+         universe: the universe id to send to
+         channel: the 0-based channel index
+         value: the new value, between 0 and 255
+    """
+    with self._lock:
+      output = self.universes.setdefault(universe, OutputUniverse())
+      output.data[channel] = int(value)
+      output.dirty = True
+    self.ensure_running()
+
+  def set_source(self, universe, source):
+    """Gives a universe a function that is called on every tick, on the
+       OLAListener thread, for a frame to send instead of the buffer.
+
+       Args:
+         universe: the universe id to send to
+         source: takes no arguments and returns an object with tostring(),
+                 such as an array('B'), or None to send the buffer; None
+                 removes the source
+    """
+    with self._lock:
+      output = self.universes.setdefault(universe, OutputUniverse())
+      output.source = source
+      output.dirty = True
+    self.ensure_running()
+
+  def remove(self, universe):
+    """Stops sending a universe and forgets its buffer and statistics"""
+    with self._lock:
+      self.universes.pop(universe, None)
+
+  def stats(self, universe):
+    """Returns the send statistics of a universe, or None if inactive"""
+    with self._lock:
+      output = self.universes.get(universe)
+      return output.stats() if output else None
+
+  def ensure_running(self):
+    """Starts ticking on the OLAListener thread if it is not already"""
+    selectserver = self.ola_listener.selectserver
+    with self._lock:
+      if self._running or not selectserver or not self.universes:
+        return
+      self._running = True
+    selectserver.Execute(self.start)
+
+  def restart(self):
+    """Starts ticking for a new connection to olad if any universe is
+       active.  Must be called on the OLAListener thread.
+    """
+    with self._lock:
+      self._running = bool(self.universes)
+    if self._running:
+      self.start()
+
+  def start(self):
+    """Starts a new chain of ticks; runs on the OLAListener thread"""
+    self._generation += 1
+    self.origin = self.clock()
+    self.ticks = 0
+    with self._lock:
+      for output in self.universes.itervalues():
+        output.last_tick = None
+    self.schedule(self._generation)
+
+  def schedule(self, generation):
+    """Schedules the next tick against the scheduler's start time"""
+    due = self.origin + (self.ticks + 1) / float(self.frame_rate)
+    delay_ms = max(due - self.clock(), 0) * 1000
+    self.ola_listener.selectserver.AddEvent(
+      delay_ms, lambda: self.tick(generation, due))
+
+  def tick(self, generation, due):
+    """Sends every active universe that is dirty or due a keep-alive.  The
+       buffers are copied under the lock, but the sources are rendered and
+       the frames sent after releasing it, so setting a frame from another
+       thread never waits on a render or a send.
+    """
+    if generation != self._generation:
+      return
+    now = self.clock()
+    period = 1. / self.frame_rate
+    lateness = now - due
+    late = lateness > period / 2
+    self.ticks += 1
+    tick = self.ticks
+    if lateness > period:
+      self.ticks += int(lateness / period)
+    client = self.ola_listener.client
+    with self._lock:
+      if not self.universes:
+        self._running = False
+        return
+      pending = []
+      for universe, output in self.universes.iteritems():
+        pending.append((universe, output, output.source, output.data[:],
+                        output.dirty))
+        output.dirty = False
+    sends = []
+    for universe, output, source, data, dirty in pending:
+      if source:
+        frame = source()
+        if frame is not None:
+          frame_bytes = frame.tostring()
+          if frame_bytes != output.source_frame:
+            output.source_frame = frame_bytes
+            dirty = True
+          data = frame
+        elif output.source_frame is not None:
+          output.source_frame = None
+          dirty = True
+      if dirty:
+        keep_alive = False
+      elif now - output.last_send >= self.KEEP_ALIVE_INTERVAL:
+        keep_alive = True
+      else:
+        continue
+      client.SendDmx(universe, data)
+      sends.append((output, keep_alive))
+    with self._lock:
+      for output, keep_alive in sends:
+        if keep_alive:
+          output.keep_alives += 1
+        output.record_send(now, tick, period, lateness, late)
+    self.schedule(generation)
 
 class OLAListener(threading.Thread):
-  """Makes all requested calls to OLA in its own thread."""
+  """Makes all requested calls to OLA in its own thread.
+
+     The thread also supervises the connection to olad: it is always in one
+     of the DISCONNECTED, CONNECTING or CONNECTED states, and on_start and
+     on_stop are only put on the UI queue when it actually moves between
+     being connected and disconnected.  While olad is down, reconnection
+     attempts back off exponentially (with jitter), but the olad port is
+     probed in between so a restarted olad is picked up straight away.
+  """
+  OLAD_ADDRESS = ('localhost', 9010)
+  RECONNECT_MIN_DELAY = 0.5
+  RECONNECT_MAX_DELAY = 30
+  PROBE_INTERVAL = 0.25
+  UNREGISTER_DELAY_MS = 2000
 
   def __init__(self, ui_queue, selectserver_builder, ola_client_builder,
-               on_start, on_stop):
+               on_start, on_stop, frame_mailbox=None, metrics=None):
     """Initializes OLA objects; determines if OLAD is running upon start.
 
        Args:
          ui_queue: A Queue where UI events are held.
          selectserver_builder: Builds a SelectServer object for OLA tasks
-         ola_client_builder: Builds the OLA Client itself
+         ola_client_builder: Builds the OLA Client itself, takes the
+                             function to call when the connection closes
          on_start: UI Method to execute upon the starting of OLAD
          on_stop: UI Method to execute upon the stopping of OLAD
+         frame_mailbox: A FrameMailbox where the newest DMX frames are held,
+                        one is created if not given.
+         metrics: An RPCMetrics to record request latencies in; it is only
+                  installed if it is enabled when the OLAListener is created.
     """
     super(OLAListener,self).__init__()
+    if metrics is None:
+      metrics = RPCMetrics()
+    self.metrics = metrics
+    if metrics.enabled:
+      ui_queue = InstrumentedQueue(ui_queue, metrics)
     self.ui_queue = ui_queue
+    if frame_mailbox is None:
+      frame_mailbox = FrameMailbox()
+    self.frame_mailbox = frame_mailbox
     self.create_select_server = selectserver_builder
     self.create_ola_client = ola_client_builder
     self.start_event = UIEvent(on_start)
     self.stop_event = UIEvent(on_stop)
     self.selectserver = None
+    self.client = None
+    self.state = DISCONNECTED
+    self._reported_state = None
+    self._stopped = False
+    self._connection_lost = False
+    self._wake = threading.Event()
+    self.reconnect_count = 0
+    self.dmx_subscribers = {}
+    self.dmx_registrations = {}
+    self._registration_callbacks = {}
+    self._unregister_tokens = {}
+    self._subscription_lock = threading.Lock()
+    self._subscription_changes = []
+    self._subscriptions_live = False
+    self.device_index = None
+    self.output = DMXOutputScheduler(self)
+    self.reset_universe_cache()
 
   def run(self):
-    """Initializes and runs an OLA SelectServer"""
-    self._stopped = False
+    """Connects to olad and runs an OLA SelectServer, reconnecting with
+       backoff whenever the connection cannot be made or is lost.
+    """
+    delay = self.RECONNECT_MIN_DELAY
     while not self._stopped:
+      self.set_state(CONNECTING)
+      try:
+        self.connect()
+      except Exception:
+        self.selectserver = None
+        self.set_state(DISCONNECTED)
+        self.wait_for_olad(delay * random.uniform(0.5, 1.0))
+        delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+        continue
+      delay = self.RECONNECT_MIN_DELAY
+      self.set_state(CONNECTED)
+      self.restore_dmx_listeners()
+      self.output.restart()
       try:
-        self.client = self.create_ola_client()
-        self.selectserver = self.create_select_server()
-        self.selectserver.AddReadDescriptor(self.client.GetSocket(),
-                                            self.client.SocketReady)
-        self.ui_queue.put(self.start_event)
         self.selectserver.Run()
-        self._stopped = True
-      except:
-        #TODO: Make a flag of some sort so that stop_event is only put
-        # on the queue once.  Also, this will allow me to remove the sleep()
-        self.ui_queue.put(self.stop_event)
+      except Exception:
+        self._connection_lost = True
+      if self._connection_lost and not self._stopped:
+        self.hold_subscription_changes()
+        self.reconnect_count += 1
         self.selectserver = None
-        time.sleep(1) #Ensures tasks are not put on the queue too quickly.
+        self.set_state(DISCONNECTED)
+      else:
+        self._stopped = True
+
+  def connect(self):
+    """Builds the client and SelectServer for a new connection to olad"""
+    self._connection_lost = False
+    self.client = self.create_ola_client(self.connection_lost)
+    self.selectserver = self.create_select_server()
+    if self.metrics.enabled:
+      self.client = InstrumentedClient(self.client, self.metrics)
+      self.selectserver = InstrumentedSelectServer(self.selectserver,
+                                                   self.metrics)
+    self.selectserver.AddReadDescriptor(self.client.GetSocket(),
+                                        self.client.SocketReady)
+    self.reset_universe_cache()
+    self.device_index = None
+
+  def connection_lost(self):
+    """Called by the client when olad closes the connection; stops the
+       SelectServer so that run() can reconnect.
+    """
+    self._connection_lost = True
+    self.hold_subscription_changes()
+    if self.selectserver:
+      self.selectserver.Terminate()
+
+  def set_state(self, state):
+    """Moves the supervisor to state, telling the UI if that changes
+       whether OLAD is connected.
+
+       Args:
+         state: one of DISCONNECTED, CONNECTING or CONNECTED
+    """
+    self.state = state
+    if state == CONNECTING or state == self._reported_state:
+      return
+    self._reported_state = state
+    if state == CONNECTED:
+      self.ui_queue.put(self.start_event)
+    else:
+      self.ui_queue.put(self.stop_event)
+
+  def olad_available(self):
+    """Returns True if olad is accepting connections"""
+    try:
+      probe = socket.create_connection(self.OLAD_ADDRESS, self.PROBE_INTERVAL)
+    except (socket.error, socket.timeout):
+      return False
+    probe.close()
+    return True
+
+  def wait_for_olad(self, delay):
+    """Waits up to delay seconds before the next connection attempt, but
+       returns early once olad accepts connections or stop() is called.
+    """
+    deadline = time.time() + delay
+    while not self._stopped:
+      remaining = deadline - time.time()
+      if remaining <= 0 or self.olad_available():
+        return
+      self._wake.wait(min(self.PROBE_INTERVAL, remaining))
 
   def stop(self):
     """Terminates the OLAListener thread if it is running"""
     self._stopped = True
+    self._wake.set()
     if self.selectserver:
       self.selectserver.Terminate()
 
@@ -88,21 +683,150 @@ class OLAListener(threading.Thread):
           self.ui_queue.put(UIEvent(callback, [status,universes]))))
 
 
+  def reset_universe_cache(self):
+    """Forgets the cached universe list and any fetch in flight, so that
+       the next poll_universes always reports to the UI.
+    """
+    self.universes = None
+    self._universe_signature = None
+    self._universe_fetch_pending = False
+
+  @staticmethod
+  def universe_signature(universes):
+    """Returns a cheaply comparable summary of a list of universes"""
+    return tuple((universe.id, universe.name, universe.merge_mode,
+                  len(getattr(universe, 'input_ports', ())),
+                  len(getattr(universe, 'output_ports', ())))
+                 for universe in universes)
+
+  def poll_universes(self, callback):
+    """Fetches the universes, but only puts callback on the UI queue when
+       the set of universes differs from the last one fetched.  No new
+       request is made while one is still waiting for a reply.
+
+        Args:
+          callback: The UI callback that will be placed on the
+                    UI queue with the universes when they change
+    """
+    if not (self.selectserver and self.client):
+      return
+    if self._universe_fetch_pending:
+      return
+    self._universe_fetch_pending = True
+
+    def universes_callback(status, universes):
+      """Caches the universes and reports them if they changed"""
+      self._universe_fetch_pending = False
+      if universes is None:
+        return
+      signature = self.universe_signature(universes)
+      if signature != self._universe_signature:
+        self._universe_signature = signature
+        self.universes = universes
+        if self.device_index:
+          self.device_index.devices_stale = True
+        self.ui_queue.put(UIEvent(callback, [status, universes]))
+
+    self.selectserver.Execute(
+      lambda: self.client.FetchUniverses(universes_callback))
+
+  @staticmethod
+  def not_connected_status():
+    """Returns a failed RequestStatus for a request that could not be sent
+       because olad is not connected
+    """
+    controller = SimpleRpcController()
+    controller.SetFailed('olad is not connected')
+    return RequestStatus(controller)
+
+  @staticmethod
+  def succeeded(status):
+    """Returns True if status is a RequestStatus for a successful request"""
+    return status is not None and status.Succeeded()
+
+  def with_device_index(self, function):
+    """Calls function with the DeviceIndex on the OLAListener thread,
+       fetching the devices from olad only if there is no index yet or its
+       devices are stale.  If olad is not connected, function gets an empty
+       index whose status failed straight away.
+
+       Args:
+         function: takes one argument, the DeviceIndex
+    """
+    if not (self.selectserver and self.client):
+      function(DeviceIndex(self.not_connected_status(), []))
+      return
+
+    def devices_callback(status, devices):
+      """Indexes the devices that were fetched"""
+      if devices is None:
+        self.device_index = None
+        function(DeviceIndex(status, []))
+        return
+      self.device_index = DeviceIndex(status, devices)
+      function(self.device_index)
+
+    def run_with_index():
+      """Runs on the OLAListener thread, where the index may be used"""
+      if self.device_index is None or self.device_index.devices_stale:
+        self.client.FetchDevices(devices_callback)
+      else:
+        function(self.device_index)
+
+    self.selectserver.Execute(run_with_index)
+
   def pull_devices(self, callback):
-    """Delivers a list of devices.
+    """Delivers a list of devices, from the device index if its devices are
+       current, otherwise from olad.  The ports of the devices are as
+       fetched; a patch made since shows up once poll_universes has seen
+       the universes change.
 
        Args:
          callback: The UI callback that will be placed on the
                    UI queue with the devices
     """
-    self.selectserver.Execute(
-      lambda: self.client.FetchDevices(
-        lambda status, devices:
-          self.ui_queue.put(UIEvent(callback, [status,devices]))))
+    self.with_device_index(
+      lambda index: self.ui_queue.put(UIEvent(callback, [index.status,
+                                                         index.devices])))
+
+  def pull_free_ports(self, callback):
+    """Delivers the first free input and output port of every device from
+       the device index, so no round trip is needed while its devices are
+       current.
+
+       Args:
+         callback: The UI callback that will be placed on the UI queue with
+                   a RequestStatus and a list of (device alias, device name,
+                   port id, is output) tuples
+    """
+    self.with_device_index(
+      lambda index: self.ui_queue.put(UIEvent(callback, [index.status,
+                                              index.first_free_ports()])))
+
+  def batch(self):
+    """Returns a new RequestBatch for sending many requests at once"""
+    return RequestBatch(self)
+
+  @classmethod
+  def first_failure(cls, statuses, fallback=None):
+    """Returns the first RequestStatus in statuses that did not succeed,
+       or the first one if they all succeeded.
+
+       Args:
+         statuses: a list of RequestStatus objects
+         fallback: returned if statuses is empty, such as the status of
+                   the request that found there was nothing to send
+    """
+    for status in statuses:
+      if not cls.succeeded(status):
+        return status
+    if not statuses:
+      return fallback
+    return statuses[0]
 
   def patch(self, device_alias, port, is_output, universe_id,
             universe_name, callback):
-    """Patch a port to a universe.
+    """Patch a port to a universe and name the universe, in a single batch.
 
        Args:
          device_alias: the alias of the device
@@ -111,57 +835,62 @@ class OLAListener(threading.Thread):
          universe_id: the universe id to patch
          universe_name: the name for this universe
          callback: The function to call once complete, takes one argument, a
-           RequestStatus object.
+           RequestStatus object; the first failure if any request failed.
     """
-    def patch_callback(callback):
-      """Creates an appropriate callback for client.PatchPort that
-         will put the OLA response directly onto the UI queue
-      """
-      return lambda status:self.ui_queue.put(UIEvent(callback,[status]))
+    def port_patched(status):
+      """Updates the device index once the port is patched"""
+      if self.device_index and self.succeeded(status):
+        self.device_index.patched(device_alias, port, is_output,
+                                  universe_id)
+      else:
+        self.device_index = None
 
-    self.selectserver.Execute(
-      lambda:self.client.PatchPort(device_alias, port, is_output,
-                                   self.client.PATCH, universe_id,
-                                   patch_callback(callback)))
-    self.selectserver.Execute(
-      lambda:self.client.SetUniverseName(universe_id, universe_name))
+    batch = self.batch()
+    batch.patch_port(device_alias, port, is_output, OlaClient.PATCH,
+                     universe_id, port_patched)
+    batch.set_universe_name(universe_id, universe_name)
+    batch.execute(lambda statuses: callback(self.first_failure(statuses)))
 
   def unpatch(self, universe_id, callback):
-    """Unpatches a universe.
+    """Unpatches a universe.  The ports patched to it are looked up in the
+       device index, so devices are only fetched if there is no current
+       index, and they are all unpatched in a single batch.
 
        Args:
          universe_id: the universe id to unpatch
          callback: The function to call once complete, takes one argument, a
-           RequestStatus object.
+           RequestStatus object; the first failure if any port failed, or
+           that of fetching the devices if it failed.
     """
 
-    def unpatch_callback(callback):
-      """Creates an appropriate callback for client.PatchPort that
-         will put the OLA response directly onto the UI queue
+    def unpatch_callback(device_alias, port_id, is_output):
+      """Creates a callback that updates the device index once a port
+         is unpatched
       """
-      return lambda status:self.ui_queue.put(UIEvent(callback,[status]))
+      def port_unpatched(status):
+        if self.device_index and self.succeeded(status):
+          self.device_index.unpatched(device_alias, port_id, is_output,
+                                      universe_id)
+        else:
+          self.device_index = None
+      return port_unpatched
 
-    def devices_callback(status, devices):
-      """We need a list of devices in order to find the port
-         of the universe we are unpatching
+    def unpatch_ports(index):
+      """Unpatches every port on the universe, unless the devices could
+         not be fetched
       """
-      for device in devices:
-        for port in device.input_ports:
-          if port.universe == universe_id:
-            self.selectserver.Execute(
-              self.create_olaclient_callback(self.client.PatchPort,
-                                             [device.alias, port.id, False,
-                                              self.client.UNPATCH, universe_id,
-                                              unpatch_callback(callback)]))
-        for port in device.output_ports:
-          if port.universe == universe_id:
-            self.selectserver.Execute(
-              self.create_olaclient_callback(self.client.PatchPort,
-                                             [device.alias, port.id, True,
-                                              self.client.UNPATCH, universe_id,
-                                              unpatch_callback(callback)]))
-    self.selectserver.Execute(
-      lambda: self.client.FetchDevices(devices_callback))
+      if not self.succeeded(index.status):
+        self.ui_queue.put(UIEvent(callback, [index.status]))
+        return
+      batch = self.batch()
+      for device_alias, port_id, is_output in \
+          index.ports_on_universe(universe_id):
+        batch.patch_port(device_alias, port_id, is_output,
+                         OlaClient.UNPATCH, universe_id,
+                         unpatch_callback(device_alias, port_id, is_output))
+      batch.run(lambda statuses:
+                callback(self.first_failure(statuses, index.status)))
+    self.with_device_index(unpatch_ports)
 
   def fetch_dmx(self, universe, callback):
     """Fetches the current array of DMX channels.  For most DMX Listening we
@@ -179,34 +908,186 @@ class OLAListener(threading.Thread):
         lambda:self.client.FetchDmx(universe, \
           lambda s,u,d: self.ui_queue.put(UIEvent(callback,[s,u,d]))))
 
-  def start_dmx_listener(self, universe, data_callback, callback=None):
-    """Starts a listener that will call data_callback every time
-       there is new DMX data.
+  def start_dmx_listener(self, universe, data_callback, callback=None,
+                         coalesce=True):
+    """Subscribes data_callback to the newest DMX data of a universe.
+       Subscribers are reference counted per universe: the universe is only
+       registered with olad for the first one, and each frame is fanned out
+       to all of them.  Frames are coalesced in the frame mailbox, so if
+       several arrive between UI ticks only the latest one is delivered.
 
        Args:
          universe: The universe id to listen for
-         data_callback: The function to call every time there is new data
-         callback: The callback for when the request is complete.
+         data_callback: The function to call every time there is new data,
+                        takes a bytearray of the frame (see frame_fanout)
+         callback: The callback for when the request is complete, takes a
+                   RequestStatus; if the universe was already registered it
+                   gets the status of that registration.  While olad is not
+                   connected, it is called once the universe is registered
+                   again after the reconnection.
+         coalesce: if False, data_callback gets every frame, called on the
+                   OLAListener thread as soon as it arrives; it must be
+                   quick and must not touch the UI.
     """
-    if self.selectserver and self.client:
-      self.selectserver.Execute(
-        lambda:self.client.RegisterUniverse(universe, self.client.REGISTER, \
-          lambda data: self.ui_queue.put(UIEvent(data_callback,[data])),
-          lambda status: self.ui_queue.put(UIEvent(callback,[status]))))
+    subscriber = (data_callback, coalesce)
+
+    def add_subscriber():
+      """Runs on the OLAListener thread, where subscriptions are kept"""
+      self.dmx_subscribers.setdefault(universe, []).append(subscriber)
+      self._unregister_tokens.pop(universe, None)
+      if universe in self._registration_callbacks:
+        self._registration_callbacks[universe].append(callback)
+      elif universe in self.dmx_registrations:
+        self.ui_queue.put(UIEvent(callback,
+                                  [self.dmx_registrations[universe]]))
+      else:
+        self.register_universe(universe, callback)
+    self.change_subscriptions(add_subscriber)
+
+  def register_universe(self, universe, callback=None):
+    """Registers a universe with olad.  Until olad replies, callback and
+       those of any later subscribers wait for the status, which is then
+       kept in dmx_registrations.  Must be called on the OLAListener thread.
+
+       Args:
+         universe: the universe id to register
+         callback: takes the RequestStatus of the registration
+    """
+    self.dmx_registrations[universe] = None
+    waiting = self._registration_callbacks.setdefault(universe, [])
+    if callback:
+      waiting.append(callback)
+
+    def registered(status):
+      """Records the status of the registration and reports it"""
+      if universe in self.dmx_registrations:
+        self.dmx_registrations[universe] = status
+      for waiting in self._registration_callbacks.pop(universe, []):
+        self.ui_queue.put(UIEvent(waiting, [status]))
+
+    self.client.RegisterUniverse(universe, self.client.REGISTER,
+                                 self.frame_fanout(universe), registered)
+
+  def change_subscriptions(self, change):
+    """Runs change on the OLAListener thread, the only one that touches the
+       subscriptions.  While olad is not connected there is no SelectServer
+       to run it on, so it is kept for restore_dmx_listeners.
+
+       Args:
+         change: takes no arguments, adds or removes a subscriber
+    """
+    with self._subscription_lock:
+      if not self._subscriptions_live:
+        self._subscription_changes.append(change)
+        return
+      selectserver = self.selectserver
+    selectserver.Execute(change)
+
+  def hold_subscription_changes(self):
+    """Keeps subscription changes for restore_dmx_listeners from now on,
+       once the connection to olad is lost
+    """
+    with self._subscription_lock:
+      self._subscriptions_live = False
+
+  def frame_fanout(self, universe):
+    """Creates the data callback for RegisterUniverse, which copies each
+       frame and hands the copy to the frame mailbox, instead of the FIFO
+       ui_queue, once for every subscriber of the universe, stamped with
+       the time it arrived so the UI can tell how stale it is.  Subscribers
+       that asked not to be coalesced are called with the frame straight
+       away instead.  The subscribers of a universe share the copy, so they
+       must not change it.
+    """
+    metrics = self.metrics if self.metrics.enabled else None
+    def data_received(data):
+      stamp = time.time()
+      frame = copy_frame(data)
+      if metrics:
+        metrics.frame(universe)
+      for data_callback, coalesce in self.dmx_subscribers.get(universe, ()):
+        if not data_callback:
+          continue
+        if coalesce:
+          self.frame_mailbox.post(universe, data_callback, frame, stamp)
+        else:
+          data_callback(frame)
+    return data_received
+
+  def restore_dmx_listeners(self):
+    """Registers every subscribed universe again after a reconnection to
+       olad, then applies the subscription changes made while olad was not
+       connected.  Must be called on the OLAListener thread.
+    """
+    self.dmx_registrations = {}
+    self._unregister_tokens = {}
+    for universe in self.dmx_subscribers.keys():
+      self.register_universe(universe)
+    with self._subscription_lock:
+      changes = self._subscription_changes
+      self._subscription_changes = []
+      self._subscriptions_live = True
+    for change in changes:
+      change()
 
   def stop_dmx_listener(self, universe, data_callback, callback=None):
-    """Stops listening for DMX updates to universe.
+    """Unsubscribes data_callback from a universe.  Once the last subscriber
+       is gone the universe is unregistered from olad, but only after
+       UNREGISTER_DELAY_MS, so that quickly subscribing again does not
+       cost two RPCs.
 
        Args:
          universe: the universe to no longer listen for
          data_callback: the data callback to stop
-         callback: the function to call once complete
+         callback: the function to call once complete, takes a
+                   RequestStatus; if the universe stays registered it gets
+                   the status of that registration.
     """
-    if self.selectserver and self.client:
-      self.selectserver.Execute(
-        lambda:self.client.RegisterUniverse(universe, self.client.UNREGISTER, \
-          lambda data: self.ui_queue.put(UIEvent(data_callback,[data])),
-          lambda status: self.ui_queue.put(UIEvent(callback,[status]))))
+    def unregister(token):
+      """Unregisters the universe unless it was subscribed to again"""
+      if self._unregister_tokens.get(universe) is not token:
+        self.ui_queue.put(UIEvent(callback,
+                                  [self.dmx_registrations.get(universe)]))
+        return
+      del self._unregister_tokens[universe]
+      self.dmx_registrations.pop(universe, None)
+      self.client.RegisterUniverse(universe, self.client.UNREGISTER, None,
+        lambda status: self.ui_queue.put(UIEvent(callback,[status])))
+
+    def remove_subscriber():
+      """Runs on the OLAListener thread, where subscriptions are kept"""
+      if universe not in self.dmx_registrations:
+        self.client.RegisterUniverse(universe, self.client.UNREGISTER, None,
+          lambda status: self.ui_queue.put(UIEvent(callback,[status])))
+        return
+      if self.drop_subscriber(universe, data_callback):
+        self.ui_queue.put(UIEvent(callback,
+                                  [self.dmx_registrations[universe]]))
+        return
+      token = object()
+      self._unregister_tokens[universe] = token
+      self.selectserver.AddEvent(self.UNREGISTER_DELAY_MS,
+                                 lambda: unregister(token))
+    self.change_subscriptions(remove_subscriber)
+
+  def drop_subscriber(self, universe, data_callback):
+    """Removes one subscription of data_callback from a universe.
+
+       Returns:
+         the number of subscribers the universe has left
+    """
+    subscribers = self.dmx_subscribers.get(universe, [])
+    for subscriber in subscribers:
+      if subscriber[0] == data_callback:
+        subscribers.remove(subscriber)
+        break
+    if not subscribers:
+      self.dmx_subscribers.pop(universe, None)
+    return len(subscribers)
+
+  def subscribed_universes(self):
+    """Returns the ids of every universe with at least one subscriber"""
+    return self.dmx_subscribers.keys()
 
   def send_dmx(self, universe, data, callback=None):
     """Sends a full array of 512 dmx channels
@@ -0,0 +1,218 @@
+"""A single-threaded front-end to OLA for headless tools.
+
+   OLAListener runs OLA in its own thread and hands every result to the UI
+   through a queue.  OLALoop instead drives an OlaClient from the caller's
+   own thread: requests are sent straight away and return PendingResult
+   objects, and the client socket is only read while the caller waits for
+   results.  Many requests can be sent before waiting on any of them, and
+   DMX subscriptions are plain iterators over frames.
+"""
+
+import select
+import socket
+import time
+from collections import deque
+from ola.OlaClient import OlaClient
+
+class PendingResult(object):
+  """The result of a request sent by an OLALoop, filled in once olad
+     replies.  values holds the arguments the client passed to its
+     callback, e.g. (status, universes) for pull_universes.
+  """
+
+  def __init__(self):
+    self.done = False
+    self.values = None
+
+  def __call__(self, *values):
+    """Used as the client callback for the request"""
+    self.values = values
+    self.done = True
+
+class DMXSubscription(object):
+  """Iterates over the DMX frames of a universe as they arrive.
+
+     Args:
+       ola_loop: the OLALoop that registered the universe
+       universe: the universe id to receive frames for
+  """
+
+  def __init__(self, ola_loop, universe):
+    self.ola_loop = ola_loop
+    self.universe = universe
+    self.frames = deque()
+    self.closed = False
+
+  def __iter__(self):
+    return self
+
+  def next(self, timeout=None):
+    """Returns the next frame, reading from olad until one arrives.
+
+       Args:
+         timeout: seconds to wait for a frame, the OLALoop default if None
+    """
+    if self.closed:
+      raise StopIteration
+    self.ola_loop.run_until(lambda: self.frames, timeout)
+    return self.frames.popleft()
+
+  def close(self):
+    """Unregisters the universe; the iteration stops"""
+    if not self.closed:
+      self.closed = True
+      self.ola_loop.unsubscribe(self)
+
+class OLALoop(object):
+  """Drives an OlaClient from the calling thread.
+
+     Args:
+       client: a connected OlaClient, one is created if not given
+       timeout: the default number of seconds to wait for olad
+  """
+
+  def __init__(self, client=None, timeout=5):
+    if client is None:
+      client = OlaClient(close_callback=self.connection_closed)
+    self.client = client
+    self.timeout = timeout
+    self.closed = False
+    self.subscriptions = {}
+
+  def connection_closed(self):
+    """Called by the client when olad closes the connection"""
+    self.closed = True
+
+  def run_until(self, predicate, timeout=None):
+    """Reads and dispatches replies from olad until predicate returns True.
+
+       Args:
+         predicate: takes no arguments, checked after every read
+         timeout: seconds to wait, the default timeout if None
+       Raises:
+         socket.timeout: if predicate is still False after timeout
+         socket.error: if olad closes the connection
+    """
+    if timeout is None:
+      timeout = self.timeout
+    deadline = time.time() + timeout
+    while not predicate():
+      if self.closed:
+        raise socket.error('olad closed the connection')
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        raise socket.timeout('No reply from olad')
+      readable, writable, errored = select.select([self.client.GetSocket()],
+                                                  [], [], remaining)
+      if readable:
+        self.client.SocketReady()
+
+  def wait(self, *results, **kwargs):
+    """Waits until every result is done.  Requests are already on their
+       way to olad, so waiting on many at once costs one round trip.
+
+       Args:
+         results: PendingResult objects
+         timeout: (keyword) seconds to wait, the default timeout if omitted
+       Returns:
+         the values of the result if one was given, otherwise a list of the
+         values of each result
+    """
+    self.run_until(lambda: all(result.done for result in results),
+                   kwargs.get('timeout'))
+    if len(results) == 1:
+      return results[0].values
+    return [result.values for result in results]
+
+  def pull_universes(self):
+    """Requests the universes; the values are (status, universes)"""
+    result = PendingResult()
+    self.client.FetchUniverses(result)
+    return result
+
+  def pull_devices(self):
+    """Requests the devices; the values are (status, devices)"""
+    result = PendingResult()
+    self.client.FetchDevices(result)
+    return result
+
+  def patch(self, device_alias, port, is_output, universe_id, universe_name):
+    """Patches a port to a universe and names it; the values of the two
+       results are each (status,)
+    """
+    patched = PendingResult()
+    named = PendingResult()
+    self.client.PatchPort(device_alias, port, is_output, self.client.PATCH,
+                          universe_id, patched)
+    self.client.SetUniverseName(universe_id, universe_name, named)
+    return patched, named
+
+  def unpatch(self, universe_id):
+    """Unpatches every port of a universe.  The devices are fetched first,
+       so this waits for them before sending the unpatch requests.
+
+       Returns:
+         a list of PendingResult, one per port, whose values are (status,)
+    """
+    status, devices = self.wait(self.pull_devices())
+    results = []
+    for device in devices or []:
+      for is_output, ports in ((False, device.input_ports),
+                               (True, device.output_ports)):
+        for port in ports:
+          if port.universe == universe_id:
+            result = PendingResult()
+            self.client.PatchPort(device.alias, port.id, is_output,
+                                  self.client.UNPATCH, universe_id, result)
+            results.append(result)
+    return results
+
+  def fetch_dmx(self, universe):
+    """Requests a universe's DMX; the values are (status, universe, data)"""
+    result = PendingResult()
+    self.client.FetchDmx(universe, result)
+    return result
+
+  def send_dmx(self, universe, data):
+    """Sends a frame of DMX; the values are (status,)"""
+    result = PendingResult()
+    self.client.SendDmx(universe, data, result)
+    return result
+
+  def subscribe(self, universe):
+    """Registers for a universe's DMX.  A universe is registered with olad
+       once; further subscriptions to it share the registration and each
+       receive every frame.
+
+       Returns:
+         a DMXSubscription that iterates over the frames as they arrive
+    """
+    subscription = DMXSubscription(self, universe)
+    subscriptions = self.subscriptions.get(universe)
+    if subscriptions:
+      subscriptions.append(subscription)
+      return subscription
+    subscriptions = [subscription]
+    self.subscriptions[universe] = subscriptions
+
+    def frame_received(data):
+      """Hands the frame to every subscription to the universe"""
+      for each in subscriptions:
+        each.frames.append(data)
+
+    self.client.RegisterUniverse(universe, self.client.REGISTER,
+                                 frame_received)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    """Drops a subscription, unregistering its universe once no
+       subscriptions to it are left
+    """
+    subscriptions = self.subscriptions.get(subscription.universe, [])
+    if subscription not in subscriptions:
+      return
+    subscriptions.remove(subscription)
+    if not subscriptions:
+      del self.subscriptions[subscription.universe]
+      self.client.RegisterUniverse(subscription.universe,
+                                   self.client.UNREGISTER, None)
@@ -0,0 +1,411 @@
+"""Measures the requests an OLAListener makes to olad.
+
+   For every request type this records three latencies:
+
+     queue_wait: from the selectserver.Execute call until the request is
+                 sent to olad on the OLAListener thread
+     round_trip: from sending the request until olad's reply arrives
+     ui_dispatch: from the reply until the UIEvent it put on the ui_queue
+                  has been run on the UI thread
+
+   along with how many requests of each type are waiting for olad, the
+   rate at which DMX frames arrive for each registered universe and how many
+   frames have been sent to each universe.  UIMetrics does the same for the
+   UI thread's ticks, and FrameLatency measures how stale the frames the UI
+   draws are.
+
+   Instrumentation is installed by wrapping the client, the SelectServer and
+   the ui_queue of an OLAListener created with an enabled RPCMetrics; a
+   disabled RPCMetrics installs nothing and costs one attribute check per
+   DMX frame.
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+
+QUEUE_WAIT = 'queue_wait'
+ROUND_TRIP = 'round_trip'
+UI_DISPATCH = 'ui_dispatch'
+STAGES = (QUEUE_WAIT, ROUND_TRIP, UI_DISPATCH)
+
+class Histogram(object):
+  """A histogram of latencies in seconds, in buckets that double in width
+     from 100us to about 13s.
+  """
+
+  BOUNDS = [0.0001 * 2 ** i for i in xrange(18)]
+
+  def __init__(self):
+    self.counts = [0] * (len(self.BOUNDS) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def observe(self, seconds):
+    """Records one latency"""
+    self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+    self.count += 1
+    self.total += seconds
+    if seconds > self.max:
+      self.max = seconds
+
+  def quantile(self, fraction):
+    """Returns an upper bound on the given quantile, from the buckets"""
+    if not self.count:
+      return 0.0
+    wanted = fraction * self.count
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if seen >= wanted:
+        if index < len(self.BOUNDS):
+          return min(self.BOUNDS[index], self.max)
+        return self.max
+    return self.max
+
+  def snapshot(self):
+    """Returns the histogram as a dict"""
+    return {'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': zip(self.BOUNDS + [float('inf')], self.counts)}
+
+class FrameCounter(object):
+  """Counts the DMX frames of one universe and their rate per second"""
+
+  WINDOW = 1.0
+
+  def __init__(self, now):
+    self.frames = 0
+    self.window_start = now
+    self.window_frames = 0
+    self.rate = 0.0
+
+  def frame(self, now):
+    """Records one frame"""
+    self.frames += 1
+    self.window_frames += 1
+    elapsed = now - self.window_start
+    if elapsed >= self.WINDOW:
+      self.rate = self.window_frames / elapsed
+      self.window_start = now
+      self.window_frames = 0
+
+  def current_rate(self, now):
+    """Returns the frame rate, falling towards 0 once frames stop"""
+    elapsed = now - self.window_start
+    if elapsed >= 2 * self.WINDOW:
+      return self.window_frames / elapsed
+    return self.rate
+
+class RPCMetrics(object):
+  """Collects request latencies and frame rates for an OLAListener.  It
+     may be read from any thread with snapshot().
+
+     Args:
+       enabled: whether an OLAListener created with this should be
+                instrumented
+  """
+
+  def __init__(self, enabled=False):
+    self.enabled = enabled
+    self._lock = threading.Lock()
+    self._context = threading.local()
+    self.reset()
+
+  def reset(self):
+    """Forgets everything recorded so far"""
+    with self._lock:
+      self.histograms = {}
+      self.in_flight = {}
+      self.completed = {}
+      self.frame_counters = {}
+      self.sent = {}
+
+  def observe(self, request, stage, seconds):
+    """Records a latency for a request type and stage"""
+    with self._lock:
+      histogram = self.histograms.get((request, stage))
+      if histogram is None:
+        histogram = self.histograms[(request, stage)] = Histogram()
+      histogram.observe(seconds)
+
+  def frame(self, universe):
+    """Records a DMX frame received for a universe"""
+    now = time.time()
+    with self._lock:
+      counter = self.frame_counters.get(universe)
+      if counter is None:
+        counter = self.frame_counters[universe] = FrameCounter(now)
+      counter.frame(now)
+
+  def frame_sent(self, universe):
+    """Records a DMX frame sent to a universe"""
+    with self._lock:
+      self.sent[universe] = self.sent.get(universe, 0) + 1
+
+  def request_sent(self, request):
+    """Records a request sent to olad; returns the time it was sent"""
+    now = time.time()
+    enqueued = getattr(self._context, 'enqueued', None)
+    if enqueued is not None:
+      self.observe(request, QUEUE_WAIT, now - enqueued)
+    with self._lock:
+      self.in_flight[request] = self.in_flight.get(request, 0) + 1
+    return now
+
+  def reply_callback(self, request, sent, callback):
+    """Wraps the callback of a request so the reply is measured, and so
+       that UIEvents put while it runs are measured when the UI runs them.
+    """
+    def reply(*args):
+      self.observe(request, ROUND_TRIP, time.time() - sent)
+      with self._lock:
+        self.in_flight[request] -= 1
+        self.completed[request] = self.completed.get(request, 0) + 1
+      if callback:
+        self._context.replying = request
+        try:
+          callback(*args)
+        finally:
+          self._context.replying = None
+    return reply
+
+  def run_queued(self, function, enqueued):
+    """Runs a function passed to Execute, noting when it was queued"""
+    self._context.enqueued = enqueued
+    try:
+      function()
+    finally:
+      self._context.enqueued = None
+
+  def event_queued(self, event):
+    """Tags a UIEvent put while a reply is handled, so its dispatch is
+       measured when it runs
+    """
+    request = getattr(self._context, 'replying', None)
+    if request is not None:
+      queued = time.time()
+      event.on_run = \
+        lambda: self.observe(request, UI_DISPATCH, time.time() - queued)
+
+  def snapshot(self):
+    """Returns everything recorded so far as a dict:
+       {'requests': {request: {'in_flight', 'completed', and a histogram
+        snapshot per stage}},
+        'universes': {universe: {'frames', 'fps', 'sent'}}}
+       where frames and fps count the frames received.
+    """
+    now = time.time()
+    with self._lock:
+      requests = {}
+      for request in set(self.in_flight) | set(self.completed) | \
+                     set(request for request, stage in self.histograms):
+        requests[request] = {'in_flight': self.in_flight.get(request, 0),
+                             'completed': self.completed.get(request, 0)}
+        for stage in STAGES:
+          histogram = self.histograms.get((request, stage))
+          if histogram:
+            requests[request][stage] = histogram.snapshot()
+      universes = {}
+      for universe in set(self.frame_counters) | set(self.sent):
+        counter = self.frame_counters.get(universe)
+        universes[universe] = {
+          'frames': counter.frames if counter else 0,
+          'fps': counter.current_rate(now) if counter else 0.0,
+          'sent': self.sent.get(universe, 0)}
+    return {'requests': requests, 'universes': universes}
+
+class UIMetrics(object):
+  """Collects how many events each display_tasks tick drains and how long
+     the UI's frames take.  It is written on the UI thread and may be read
+     from any thread with snapshot().
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.ticks = 0
+    self.events_drained = 0
+    self.last_drained = 0
+    self.frame_times = Histogram()
+
+  def tick(self, drained):
+    """Records a display_tasks tick that ran drained events"""
+    with self._lock:
+      self.ticks += 1
+      self.events_drained += drained
+      self.last_drained = drained
+
+  def frame(self, seconds):
+    """Records the time between two UI frames"""
+    with self._lock:
+      self.frame_times.observe(seconds)
+
+  def snapshot(self):
+    """Returns everything recorded so far as a dict"""
+    with self._lock:
+      return {'ticks': self.ticks,
+              'events_drained': self.events_drained,
+              'last_drained': self.last_drained,
+              'frame_time': self.frame_times.snapshot()}
+
+class FrameLatency(object):
+  """Measures how stale the DMX frames the UI shows are.  Each frame is
+     stamped when it arrives on the OLAListener thread; the UI then records
+     when it collected the frame from the frame mailbox, when update_data
+     finished with it and when the next Kivy frame was drawn.  That splits
+     the latency into the stages
+
+       queue: waiting in the frame mailbox for display_tasks
+       update: running the update_data of the screen
+       render: waiting for the frame to be drawn
+
+     and their total.  The last WINDOW frames of each universe are kept for
+     rolling quantiles.  handled() and drawn() are called on the UI thread;
+     snapshot() may be called from any thread.
+  """
+
+  WINDOW = 256
+  STAGES = ('queue', 'update', 'render', 'total')
+
+  def __init__(self, window=WINDOW):
+    self._lock = threading.Lock()
+    self.window = window
+    self.universes = {}
+    self.pending = []
+
+  def handled(self, universe, stamp, collected, updated):
+    """Records a frame update_data has finished with.
+
+       Args:
+         universe: the universe of the frame
+         stamp: when the frame arrived from olad
+         collected: when display_tasks collected it from the frame mailbox
+         updated: when update_data returned
+       Returns:
+         True if this is the first frame waiting to be drawn, in which case
+         drawn() must be called once the next frame is drawn
+    """
+    self.pending.append((universe, stamp, collected, updated))
+    return len(self.pending) == 1
+
+  def drawn(self, now):
+    """Completes the measurement of every frame handled before the Kivy
+       frame that was just drawn
+    """
+    pending = self.pending
+    self.pending = []
+    with self._lock:
+      for universe, stamp, collected, updated in pending:
+        stages = self.universes.get(universe)
+        if stages is None:
+          stages = self.universes[universe] = dict(
+            (stage, deque(maxlen=self.window)) for stage in self.STAGES)
+        stages['queue'].append(collected - stamp)
+        stages['update'].append(updated - collected)
+        stages['render'].append(now - updated)
+        stages['total'].append(now - stamp)
+
+  @staticmethod
+  def quantile(values, fraction):
+    """Returns the quantile of a sorted list, 0 if it is empty"""
+    if not values:
+      return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+  def snapshot(self):
+    """Returns {universe: {stage: {'p50', 'p99'}}} over the window, in
+       seconds
+    """
+    with self._lock:
+      stages = dict((universe, dict((stage, sorted(values))
+                                    for stage, values in by_stage.iteritems()))
+                    for universe, by_stage in self.universes.iteritems())
+    return dict((universe, dict((stage, {'p50': self.quantile(values, 0.5),
+                                         'p99': self.quantile(values, 0.99)})
+                                for stage, values in by_stage.iteritems()))
+                for universe, by_stage in stages.iteritems())
+
+class InstrumentedClient(object):
+  """Wraps an OlaClient so the requests an OLAListener makes are measured.
+     Anything other than the measured requests is passed straight through.
+  """
+
+  def __init__(self, client, metrics):
+    self._client = client
+    self._metrics = metrics
+
+  def __getattr__(self, name):
+    return getattr(self._client, name)
+
+  def _send(self, request, callback):
+    """Records a request being sent and returns its wrapped callback"""
+    metrics = self._metrics
+    return metrics.reply_callback(request, metrics.request_sent(request),
+                                  callback)
+
+  def FetchUniverses(self, callback):
+    return self._client.FetchUniverses(self._send('FetchUniverses', callback))
+
+  def FetchDevices(self, callback, *args, **kwargs):
+    return self._client.FetchDevices(self._send('FetchDevices', callback),
+                                     *args, **kwargs)
+
+  def PatchPort(self, device_alias, port, is_output, action, universe,
+                callback):
+    return self._client.PatchPort(device_alias, port, is_output, action,
+                                  universe, self._send('PatchPort', callback))
+
+  def SetUniverseName(self, universe, name, callback=None):
+    return self._client.SetUniverseName(
+      universe, name, self._send('SetUniverseName', callback))
+
+  def FetchDmx(self, universe, callback):
+    return self._client.FetchDmx(universe, self._send('FetchDmx', callback))
+
+  def SendDmx(self, universe, data, callback=None):
+    self._metrics.frame_sent(universe)
+    return self._client.SendDmx(universe, data,
+                                self._send('SendDmx', callback))
+
+  def RegisterUniverse(self, universe, action, data_callback, callback=None):
+    return self._client.RegisterUniverse(
+      universe, action, data_callback,
+      self._send('RegisterUniverse', callback))
+
+class InstrumentedSelectServer(object):
+  """Wraps a SelectServer so the time functions wait in Execute is
+     measured
+  """
+
+  def __init__(self, selectserver, metrics):
+    self._selectserver = selectserver
+    self._metrics = metrics
+
+  def __getattr__(self, name):
+    return getattr(self._selectserver, name)
+
+  def Execute(self, function):
+    enqueued = time.time()
+    self._selectserver.Execute(
+      lambda: self._metrics.run_queued(function, enqueued))
+
+class InstrumentedQueue(object):
+  """Wraps the ui_queue so UIEvents put in reply to a request are tagged"""
+
+  def __init__(self, queue, metrics):
+    self._queue = queue
+    self._metrics = metrics
+
+  def __getattr__(self, name):
+    return getattr(self._queue, name)
+
+  def put(self, event, *args, **kwargs):
+    self._metrics.event_queued(event)
+    self._queue.put(event, *args, **kwargs)
@@ -0,0 +1,83 @@
+"""
+Description: Runs the benchmarks in the bench directory
+
+Usage:
+    python run_benchmarks.py [--output FILE] [--compare BASELINE]
+                             [--threshold FRACTION] [NAME ...]
+
+Results are written as JSON.  With --compare, each result is checked against
+the same benchmark in a saved baseline, and the exit status is 1 if any got
+slower by more than the threshold.
+"""
+
+import os, sys
+import argparse
+import json
+import logging
+import platform
+import time
+
+def compare(results, baseline, threshold):
+    """Prints each result against its baseline
+
+    Returns:
+        the names of the benchmarks that regressed
+    """
+    regressions = []
+    for name in sorted(results):
+        result = results[name]
+        before = baseline.get('results', {}).get(name, {})
+        if 'seconds_per_op' not in result or 'seconds_per_op' not in before:
+            print '%-28s %s' % (name, result.get('skipped', 'no baseline'))
+            continue
+        ratio = result['seconds_per_op'] / before['seconds_per_op']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print '%-28s %12.3fus %12.3fus %6.2fx%s' % (
+            name, before['seconds_per_op'] * 1e6,
+            result['seconds_per_op'] * 1e6, ratio, flag)
+    return regressions
+
+if __name__ == '__main__':
+    path_to_benchmarks = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, path_to_benchmarks)
+    os.chdir(path_to_benchmarks)
+    import bench
+    parser = argparse.ArgumentParser(description='Runs the benchmarks.')
+    parser.add_argument('names', metavar='NAME', nargs='*',
+                        help='the benchmarks to run, all of them if none')
+    parser.add_argument('--output', default='benchmarks.json',
+                        help='where to write the results')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='a results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='how much slower than the baseline is a '
+                             'regression, as a fraction')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    bench.load_benchmarks()
+    report = {'time': time.time(),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'platform': platform.platform(),
+              'results': bench.run_benchmarks(args.names)}
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print 'Wrote %s' % args.output
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(report['results'], json.load(baseline),
+                                  args.threshold)
+        if regressions:
+            print 'Regressed: %s' % ', '.join(regressions)
+            sys.exit(1)
+    else:
+        for name in sorted(report['results']):
+            result = report['results'][name]
+            if 'seconds_per_op' in result:
+                print '%-28s %12.3fus per %s' % (
+                    name, result['seconds_per_op'] * 1e6, result['unit'])
+            else:
+                print '%-28s skipped: %s' % (name, result['skipped'])
@@ -10,6 +10,71 @@ from kivy.uix.popup import Popup
 
 Builder.load_file('settingsscreen.kv')
 
+class UniverseListAdapter(ListAdapter):
+  """A ListAdapter for universes that keeps its row views across updates.
+     ListAdapter throws away every view whenever data changes; this adapter
+     instead keys the rows by universe id and carries the views of
+     universes that are still present, and the selection, over to the new
+     data, so only inserted rows are built and only renamed rows change.
+  """
+
+  def __init__(self, **kwargs):
+    self.rows = {}
+    self._applying_diff = False
+    super(UniverseListAdapter, self).__init__(**kwargs)
+
+  def update_for_new_data(self, *args):
+    """Keeps the cached views when the data was set by apply_universes"""
+    if not self._applying_diff:
+      super(UniverseListAdapter, self).update_for_new_data(*args)
+
+  def apply_universes(self, universes):
+    """Applies the inserts, removals and renames between the current rows
+       and a new list of universes.  on_selection_change is dispatched at
+       most once, when the selected universe was removed or renamed, so
+       listeners pick up the new Universe object.
+
+       Args:
+         universes: A list of Universe objects
+    """
+    rows = dict((universe.id, universe) for universe in universes)
+    if [universe.id for universe in self.data] == \
+       [universe.id for universe in universes] and \
+       all(self.rows[universe_id].name == universe.name
+           for universe_id, universe in rows.iteritems()):
+      return
+    views = {}
+    for index, view in self.cached_views.iteritems():
+      views[self.data[index].id] = view
+    selection_changed = False
+    for universe_id, view in views.items():
+      if universe_id not in rows:
+        del views[universe_id]
+        if view in self.selection:
+          self.deselect_item_view(view)
+          selection_changed = True
+      elif rows[universe_id].name != self.rows[universe_id].name:
+        view.text = rows[universe_id].name
+        if view in self.selection:
+          selection_changed = True
+    cached_views = {}
+    for index, universe in enumerate(universes):
+      if universe.id in views:
+        views[universe.id].index = index
+        cached_views[index] = views[universe.id]
+    self.rows = rows
+    self._applying_diff = True
+    self.cached_views = cached_views
+    self.data = universes
+    self._applying_diff = False
+    if not self.allow_empty_selection and not self.selection:
+      view = self.get_view(0)
+      if view is not None:
+        self.handle_selection(view, hold_dispatch=True)
+        selection_changed = True
+    if selection_changed:
+      self.dispatch('on_selection_change')
+
 class MainScreen(Screen):
   """The settings screen that the app opens to"""
 
@@ -28,11 +93,11 @@ class MainScreen(Screen):
       lambda row_index, selectable: {'text': selectable.name,
                                      'size_hint_y': None,
                                      'height': '25dp'}
-    list_adapter = ListAdapter(data=[],
-                               args_converter=universe_converter,
-                               selection_mode='single',
-                               allow_empty_selection=False,
-                               cls=ListItemButton)
+    list_adapter = UniverseListAdapter(data=[],
+                                       args_converter=universe_converter,
+                                       selection_mode='single',
+                                       allow_empty_selection=False,
+                                       cls=ListItemButton)
     list_adapter.bind(on_selection_change=self.change_selected_universe)
     self.ids.universe_list_view.adapter = list_adapter
 
@@ -72,13 +137,14 @@ class MainScreen(Screen):
         adapter.data[adapter.selection[0].index]
 
   def display_universes(self, dt):
-    """Makes a call to fetch the active universes; then put them in the
-       UI queue to be handled by display_universes_callback.
+    """Makes a call to fetch the active universes; if they changed since the
+       last call, they are put in the UI queue to be handled by
+       display_universes_callback.
 
        Args:
          dt: time since last call
     """
-    self.ola_listener.pull_universes(self.display_universes_callback)
+    self.ola_listener.poll_universes(self.display_universes_callback)
 
   def display_universes_callback(self, status, universes):
     """Updates the user interface with the active universes.
@@ -88,8 +154,7 @@ class MainScreen(Screen):
                  was successful
          universes: A list of Universe objects
     """
-    self.ids.universe_list_view.adapter.data = universes
-    self.ids.universe_list_view.populate()
+    self.ids.universe_list_view.adapter.apply_universes(universes)
 
   def patch_popup(self):
     """Opens the universe patching interface"""
@@ -170,36 +235,24 @@ class PatchingPopup(Popup):
                                allow_empty_selection=False,
                                cls=ListItemButton)
     self.ids.device_list.adapter = port_adapter
-    self.ola_listener.pull_devices(self.update_ports)
+    self.ola_listener.pull_free_ports(self.update_ports)
 
-  def update_ports(self, status, devices):
+  def update_ports(self, status, ports):
     """Updates the listview with available ports
 
        Args:
          status: RequestStatus object indicating whether the
                  request was successful
-         devices: A list of devices
+         ports: A list of (device alias, device name, port id, is output)
+                tuples, the first free input and output port of each device
     """
     data = []
-    # Data list contains two instances per device, one for input
-    # and one for output (breaks ensure this)
-    for device in devices:
-      for port in device.input_ports:
-        if not port.active:
-          data.append((device.alias,
-                       device.name,
-                       port.id,
-                       "Input",
-                       False))
-          break
-      for port in device.output_ports:
-        if not port.active:
-          data.append((device.alias,
-                       device.name,
-                       port.id,
-                       "Output",
-                       True))
-          break
+    for device_alias, device_name, port_id, is_output in ports:
+      data.append((device_alias,
+                   device_name,
+                   port_id,
+                   "Output" if is_output else "Input",
+                   is_output))
     self.ids.device_list.adapter.data = data
     self.ids.device_list.populate()
 
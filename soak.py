@@ -0,0 +1,360 @@
+#!/usr/bin/python
+"""Soak test of the listener-to-UI pipeline, watching for memory growth.
+
+   A FakeOlad pushes synthetic DMX over a real socket to an OLAListener for
+   hours.  The UI side runs the way the application does: display_tasks
+   drains the ui_queue and frame mailbox into MonitorScreen.update_data, the
+   ConsoleScreen moves faders and calls send_console_data, and the selected
+   universe changes now and then so subscriptions come and go.  Requests
+   with a callback each, universe polls and DMX fetches, are made throughout.
+   Without Kivy the screens are left out and frames are copied by plain
+   subscribers instead.
+
+   Every sample interval the garbage is collected and the resident set
+   size, the live object count per type and, where the tracemalloc module
+   is available, the allocation snapshot are recorded.  After the warm up,
+   the RSS growth per hour is the slope of a least squares fit through the
+   samples; the run fails, with exit status 1, if it exceeds the threshold.
+
+   Usage: python soak.py [--hours H] [--interval SECONDS] [--warmup SECONDS]
+                         [--threshold MB_PER_HOUR] [--universes N]
+                         [--rate HZ] [--no-ui] [--output FILE]
+"""
+
+import argparse
+import array
+import gc
+import json
+import random
+import socket
+import sys
+import time
+from Queue import Queue, Empty
+from fakeolad import FakeOlad
+from olalistener import OLAListener, FrameMailbox, CONNECTED
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+TICK_INTERVAL = 1 / 60.
+REQUEST_INTERVAL = 1.0
+UNIVERSE_CHANGE_INTERVAL = 10.0
+TOP_COUNT = 10
+
+def rss_bytes():
+  """Returns the resident set size of this process in bytes, or None where
+     /proc is not available
+  """
+  try:
+    with open('/proc/self/status') as status:
+      for line in status:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1]) * 1024
+  except IOError:
+    pass
+  return None
+
+def type_counts():
+  """Returns the number of live objects tracked by gc, per type name"""
+  counts = {}
+  for obj in gc.get_objects():
+    name = type(obj).__name__
+    counts[name] = counts.get(name, 0) + 1
+  return counts
+
+def growth_per_hour(samples):
+  """Returns the slope of a least squares fit through (seconds, bytes)
+     samples, in bytes per hour; 0 with fewer than two samples
+  """
+  if len(samples) < 2:
+    return 0.0
+  count = float(len(samples))
+  mean_time = sum(t for t, value in samples) / count
+  mean_value = sum(value for t, value in samples) / count
+  variance = sum((t - mean_time) ** 2 for t, value in samples)
+  if not variance:
+    return 0.0
+  covariance = sum((t - mean_time) * (value - mean_value)
+                   for t, value in samples)
+  return covariance / variance * 3600
+
+class MemorySampler(object):
+  """Samples the memory of this process, keeping the first sample after
+     the warm up as the baseline the growth is measured from.
+
+     Args:
+       warmup: seconds from the start before samples count towards growth
+  """
+
+  def __init__(self, warmup):
+    self.warmup = warmup
+    self.start = time.time()
+    self.samples = []
+    self.baseline_types = None
+    self.baseline_snapshot = None
+    self.last_types = None
+    self.last_snapshot = None
+    if tracemalloc and not tracemalloc.is_tracing():
+      tracemalloc.start()
+
+  def sample(self):
+    """Collects garbage and records a sample"""
+    gc.collect()
+    elapsed = time.time() - self.start
+    rss = rss_bytes()
+    self.last_types = type_counts()
+    if tracemalloc:
+      self.last_snapshot = tracemalloc.take_snapshot()
+    if elapsed < self.warmup:
+      return
+    if self.baseline_types is None:
+      self.baseline_types = self.last_types
+      self.baseline_snapshot = self.last_snapshot
+    if rss is not None:
+      self.samples.append((elapsed, rss))
+
+  def growth_per_hour(self):
+    """Returns the RSS growth since the warm up in bytes per hour"""
+    return growth_per_hour(self.samples)
+
+  def type_growth(self, count=TOP_COUNT):
+    """Returns the types whose live object count grew the most since the
+       warm up, as a list of (type name, growth)
+    """
+    if self.baseline_types is None:
+      return []
+    growth = [(name, number - self.baseline_types.get(name, 0))
+              for name, number in self.last_types.iteritems()]
+    growth = [item for item in growth if item[1] > 0]
+    growth.sort(key=lambda item: -item[1])
+    return growth[:count]
+
+  def top_allocators(self, count=TOP_COUNT):
+    """Returns the source lines whose allocations grew the most since the
+       warm up, if tracemalloc is available
+    """
+    if not (self.baseline_snapshot and self.last_snapshot):
+      return []
+    return [str(statistic) for statistic in
+            self.last_snapshot.compare_to(self.baseline_snapshot,
+                                          'lineno')[:count]]
+
+  def report(self):
+    """Returns the samples and growth as a dict"""
+    return {'samples': self.samples,
+            'growth_per_hour': self.growth_per_hour(),
+            'type_growth': self.type_growth(),
+            'top_allocators': self.top_allocators()}
+
+class SoakPipeline(object):
+  """Drives the OLAListener and, when Kivy is available, the monitor and
+     console screens against a FakeOlad.
+
+     Args:
+       universes: how many universes the FakeOlad pushes
+       rate: frames a second pushed to each universe
+       ui: whether to drive the screens; they are left out without Kivy
+  """
+
+  def __init__(self, universes=8, rate=44, ui=True):
+    self.universe_ids = range(1, universes + 1)
+    self.rate = rate
+    self.ui = ui
+    self.app = None
+    self.monitor = None
+    self.console = None
+    self.frames = 0
+    self.replies = 0
+    self.last_request = 0
+    self.last_universe_change = 0
+    self.selected = 0
+    self.random = random.Random(0)
+    self.data = array.array('B', [0] * 512)
+
+  def start(self, timeout=10):
+    """Starts the FakeOlad and OLAListener and waits for the connection"""
+    from ola.ClientWrapper import SelectServer
+    from ola.OlaClient import OlaClient
+    self.olad = FakeOlad(self.universe_ids, rate=self.rate)
+    self.olad.start()
+    self.ui_queue = Queue()
+    self.frame_mailbox = FrameMailbox()
+    self.ola_listener = OLAListener(self.ui_queue, SelectServer,
+      lambda close_callback=None: OlaClient(
+        socket.create_connection(self.olad.address), close_callback),
+      None, None, self.frame_mailbox)
+    self.ola_listener.OLAD_ADDRESS = self.olad.address
+    self.ola_listener.start()
+    deadline = time.time() + timeout
+    while self.ola_listener.state != CONNECTED:
+      if time.time() > deadline:
+        raise RuntimeError('Could not connect to the FakeOlad')
+      self.drain()
+      time.sleep(TICK_INTERVAL)
+    if self.ui:
+      self.create_screens()
+    for universe in self.universe_ids[1:]:
+      self.ola_listener.start_dmx_listener(universe, self.frame_received)
+    if not self.monitor:
+      self.ola_listener.start_dmx_listener(self.universe_ids[0],
+                                           self.frame_received)
+
+  def create_screens(self):
+    """Builds the monitor and console screens if Kivy is available"""
+    try:
+      import main
+    except ImportError:
+      self.ui = False
+      return
+    self.app = main.RPiUI()
+    self.app.ui_queue = self.ui_queue
+    self.app.frame_mailbox = self.frame_mailbox
+    service = main.UniverseSelectedService()
+    service.selected_universe = main.Universe(self.universe_ids[0], 'Soak',
+                                              main.Universe.LTP)
+    self.selected_universe_service = service
+    self.universe_class = main.Universe
+    self.monitor = main.MonitorScreen(self.ola_listener, service,
+                                      main.CELLS_MODE, name='DMX Monitor')
+    self.console = main.ConsoleScreen(self.ola_listener, service,
+                                      name='DMX Console')
+    for screen in (self.monitor, self.console):
+      screen.carousel_size = (800, 480)
+      screen.relayout()
+    self.monitor.register_dmx_listener()
+    self.console.switch_in()
+
+  def frame_received(self, data):
+    """Stands in for a screen, reading the frame's channels"""
+    self.frames += 1
+    array.array('B', data)
+
+  def reply_received(self, *args):
+    self.replies += 1
+
+  def drain(self):
+    """Runs queued events the way RPiUI.display_tasks does"""
+    if self.app:
+      self.app.display_tasks()
+      return
+    while True:
+      try:
+        event = self.ui_queue.get(False)
+      except Empty:
+        break
+      event.run()
+    for event in self.frame_mailbox.collect():
+      event.run()
+
+  def step(self, now):
+    """One UI tick: drains events, moves a fader and makes the periodic
+       requests and universe changes
+    """
+    self.drain()
+    channel = self.random.randint(1, 24)
+    value = self.random.randint(0, 255)
+    if self.console:
+      self.console.set_channel(channel, value)
+      self.console.send_console_data()
+    else:
+      self.data[channel - 1] = value
+      self.ola_listener.output.set_frame(self.universe_ids[0], self.data)
+    if now - self.last_request >= REQUEST_INTERVAL:
+      self.last_request = now
+      self.ola_listener.poll_universes(self.reply_received)
+      self.ola_listener.fetch_dmx(self.universe_ids[-1], self.reply_received)
+    if now - self.last_universe_change >= UNIVERSE_CHANGE_INTERVAL:
+      self.last_universe_change = now
+      self.change_universe()
+
+  def change_universe(self):
+    """Selects the next universe, so subscriptions are dropped and made"""
+    previous = self.universe_ids[self.selected]
+    self.selected = (self.selected + 1) % len(self.universe_ids)
+    universe = self.universe_ids[self.selected]
+    if self.monitor:
+      self.selected_universe_service.selected_universe = \
+        self.universe_class(universe, 'Soak', self.universe_class.LTP)
+      return
+    self.ola_listener.stop_dmx_listener(previous, self.frame_received)
+    self.ola_listener.start_dmx_listener(universe, self.frame_received)
+
+  def stop(self):
+    if self.console:
+      self.console.switch_out()
+    self.ola_listener.stop()
+    self.ola_listener.join(5)
+    self.olad.stop()
+
+def soak(duration, interval, warmup, threshold, pipeline):
+  """Runs pipeline for duration seconds, sampling memory every interval.
+
+     Args:
+       duration: how long to run, in seconds
+       interval: seconds between memory samples
+       warmup: seconds before samples count towards growth
+       threshold: the most RSS growth allowed, in bytes per hour
+       pipeline: a SoakPipeline, not yet started
+     Returns:
+       a tuple of whether the growth was within the threshold and a report
+       dict
+  """
+  sampler = MemorySampler(warmup)
+  pipeline.start()
+  start = time.time()
+  next_sample = start
+  try:
+    while True:
+      now = time.time()
+      if now >= next_sample:
+        sampler.sample()
+        next_sample += interval
+      if now - start >= duration:
+        break
+      pipeline.step(now)
+      time.sleep(TICK_INTERVAL)
+  finally:
+    pipeline.stop()
+  report = sampler.report()
+  report.update({'frames': pipeline.frames, 'replies': pipeline.replies,
+                 'ui': pipeline.ui, 'olad': pipeline.olad.stats(),
+                 'threshold': threshold, 'duration': duration})
+  return report['growth_per_hour'] <= threshold, report
+
+def main(argv):
+  parser = argparse.ArgumentParser(
+    description='Soak tests the listener-to-UI pipeline.')
+  parser.add_argument('--hours', type=float, default=4)
+  parser.add_argument('--interval', type=float, default=60,
+                      help='seconds between memory samples')
+  parser.add_argument('--warmup', type=float, default=300,
+                      help='seconds before growth is measured')
+  parser.add_argument('--threshold', type=float, default=8,
+                      help='most RSS growth allowed, in MB per hour')
+  parser.add_argument('--universes', type=int, default=8)
+  parser.add_argument('--rate', type=float, default=44)
+  parser.add_argument('--no-ui', action='store_true',
+                      help='leave the screens out even if Kivy is available')
+  parser.add_argument('--output', help='where to write the report as JSON')
+  args = parser.parse_args(argv[1:])
+  passed, report = soak(args.hours * 3600, args.interval, args.warmup,
+                        args.threshold * 1024 * 1024,
+                        SoakPipeline(args.universes, args.rate,
+                                     not args.no_ui))
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  sys.stderr.write('RSS growth %.2f MB per hour (threshold %.2f), %d frames,'
+                   ' UI %s\n' % (report['growth_per_hour'] / 1024 / 1024,
+                                 args.threshold, report['frames'],
+                                 'driven' if report['ui'] else 'left out'))
+  for name, growth in report['type_growth']:
+    sys.stderr.write('  %+d %s\n' % (growth, name))
+  for line in report['top_allocators']:
+    sys.stderr.write('  %s\n' % line)
+  return 0 if passed else 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,70 @@
+import unittest
+from mock import MagicMock
+from cueengine import CueEngine, HTP, LTP, numpy
+
+@unittest.skipIf(numpy is None, 'The cue engine needs NumPy')
+class TestCueEngine(unittest.TestCase):
+  """Tests rendering cues and crossfades"""
+
+  def setUp(self):
+    self.engine = CueEngine([1, 2])
+    self.engine.store_cue('dim', {1: [100] * 512}, fade_time=2)
+    self.engine.store_cue('bright', {1: [200] * 256, 2: [50]}, fade_time=2)
+    self.engine.store_cue('flash', {2: [255] * 4}, fade_time=0, merge=HTP)
+
+  def test_crossfade(self):
+    """Tests that an LTP cue crossfades from the cue below it"""
+    self.engine.go('dim', now=0)
+    self.assertEqual(self.engine.render(now=1)[0][0], 50)
+    self.engine.go('bright', now=2)
+    frame = self.engine.render(now=3)
+    self.assertEqual(frame[0][0], 150)
+    self.assertEqual(frame[0][300], 50)
+    self.assertEqual(frame[1][0], 25)
+    frame = self.engine.render(now=4)
+    self.assertEqual(frame[0][300], 0)
+    self.assertEqual(len(self.engine.playbacks), 1)
+
+  def test_htp(self):
+    """Tests that an HTP cue only raises channels"""
+    self.engine.go('bright', fade_time=0, now=0)
+    self.engine.go('flash', now=0)
+    frame = self.engine.render(now=0)
+    self.assertEqual(list(frame[1][:5]), [255, 255, 255, 255, 0])
+    self.engine.release('flash', fade_time=2, now=0)
+    frame = self.engine.render(now=1)
+    self.assertEqual(list(frame[1][:2]), [128, 128])
+    frame = self.engine.render(now=2)
+    self.assertEqual(list(frame[1][:2]), [50, 0])
+    self.assertEqual(len(self.engine.playbacks), 1)
+
+  def test_manual(self):
+    """Tests that manual levels are merged over the cues"""
+    self.engine.go('dim', fade_time=0, now=0)
+    self.engine.set_manual(1, 0, 250)
+    self.engine.set_manual_frame(2, bytearray([9, 9]))
+    frame = self.engine.render(now=0)
+    self.assertEqual(frame[0][0], 250)
+    self.assertEqual(frame[0][1], 100)
+    self.assertEqual(list(frame[1][:3]), [9, 9, 0])
+
+  def test_active(self):
+    """Tests that cues that have faded out no longer count as active"""
+    self.engine.go('dim', now=0)
+    self.engine.release('dim', fade_time=2, now=1)
+    self.assertTrue(self.engine.active(now=2))
+    self.assertFalse(self.engine.active(now=3))
+    self.assertEqual(self.engine.playbacks, [])
+
+  def test_send_frame(self):
+    """Tests that only changed universes are sent, with a keep-alive"""
+    self.engine.ola_listener = MagicMock()
+    self.engine.go('dim', fade_time=0, now=0)
+    self.engine.send_frame(self.engine.render(now=0))
+    self.assertEqual(self.engine.ola_listener.send_dmx.call_count, 2)
+    self.engine.send_frame(self.engine.render(now=0))
+    self.assertEqual(self.engine.ola_listener.send_dmx.call_count, 2)
+    self.engine.last_send[2] = 0
+    self.engine.send_frame(self.engine.render(now=0))
+    self.assertEqual(self.engine.ola_listener.send_dmx.call_args[0][0], 2)
+    self.assertEqual(self.engine.stats()['frames'], 3)
@@ -0,0 +1,107 @@
+import unittest
+import os
+import shutil
+import tempfile
+from mock import MagicMock
+from dmxrecorder import ShowWriter
+from dmxplayer import ShowFile, Playhead, DMXPlayer
+
+def frame(value, first=None):
+  """Returns a 512 channel frame of value, with channel 1 set to first"""
+  if first is None:
+    first = value
+  return chr(first) + chr(value) * 511
+
+class FakeClock(object):
+  """A clock that only moves when it is slept on"""
+
+  def __init__(self):
+    self.start = self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+
+class TestShowPlayback(unittest.TestCase):
+  """Tests reading and playing back show files"""
+
+  def setUp(self):
+    """Records two universes for three seconds, one frame every 100ms"""
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'show.dmx')
+    writer = ShowWriter(self.path)
+    for step in xrange(31):
+      writer.write_frame(step * 100, 1, frame(0, step))
+      writer.write_frame(step * 100 + 50, 2, frame(7, 100 - step))
+    writer.close()
+    self.show = ShowFile(self.path)
+
+  def tearDown(self):
+    self.show.close()
+    shutil.rmtree(self.directory)
+
+  def test_show_file(self):
+    """Tests that the universes and duration are read from the show"""
+    self.assertEqual(self.show.universes, set([1, 2]))
+    self.assertEqual(self.show.duration, 3050)
+    self.assertEqual(self.show.keyframes_before(1049), 3)
+    self.assertEqual(self.show.keyframes_before(1050), 4)
+
+  def test_seek(self):
+    """Tests that seeking decodes the frames from the nearest keyframes"""
+    playhead = Playhead(self.show)
+    playhead.seek(2260)
+    self.assertEqual(playhead.frames[1][0], 22)
+    self.assertEqual(playhead.frames[2][0], 78)
+    self.assertEqual(playhead.next_time(), 2300)
+    playhead.seek(120)
+    self.assertEqual(playhead.frames[1][0], 1)
+    self.assertEqual(playhead.frames[2][0], 100)
+
+  def test_advance(self):
+    """Tests that advancing decodes deltas for the chosen universes only"""
+    playhead = Playhead(self.show, [1])
+    self.assertEqual(playhead.advance(420), set([1]))
+    self.assertEqual(playhead.frames[1][:2], bytearray('\x04\x00'))
+    self.assertEqual(playhead.frames.keys(), [1])
+
+  def test_play(self):
+    """Tests that a fast, looping playback sends every universe on time,
+       driven by a clock that only moves when the player sleeps
+    """
+    clock = FakeClock()
+    ola_listener = MagicMock()
+    sent = []
+    copies = []
+    def send_dmx(universe, data):
+      sent.append((universe, clock.now, data[0], len(data)))
+      copies.append((data, data.tolist()))
+    ola_listener.send_dmx = send_dmx
+    player = DMXPlayer(ola_listener, self.show, speed=20, loop=True,
+                       clock=clock.time, sleep=clock.sleep)
+    def sleep(seconds):
+      """Plays the show through one more time, then to its end"""
+      clock.sleep(seconds)
+      if player.loops:
+        player.loop = False
+    player.sleep = sleep
+    player.cue(2500)
+    player.play()
+    stats = player.stats()
+    self.assertEqual(stats['loops'], 1)
+    self.assertEqual(stats['late_frames'], 0)
+    self.assertAlmostEqual(stats['max_drift'], 0)
+    self.assertEqual(stats['passes'], 11 + 61)
+    self.assertEqual(set(universe for universe, now, first, length in sent),
+                     set([1, 2]))
+    self.assertEqual(set(length for universe, now, first, length in sent),
+                     set([512]))
+    for data, values in copies:
+      self.assertEqual(data.tolist(), values)
+    self.assertEqual(sent[2][::2], (2, 75))
+    self.assertAlmostEqual(sent[2][1], clock.start + 0.0025)
+    self.assertAlmostEqual(sent[-1][1], clock.start + (3050 * 2 - 2500) /
+                                        1000. / 20)
+    self.assertEqual(sent[-1][2], 70)
@@ -0,0 +1,147 @@
+import unittest
+import array
+import os
+import shutil
+import struct
+import tempfile
+import time
+from Queue import Queue
+from mock import MagicMock
+from dmxrecorder import ShowWriter, DMXRecorder, encode_delta, apply_delta
+from dmxrecorder import SHOW_MAGIC, INDEX_MAGIC, RECORD, INDEX_ENTRY
+from dmxrecorder import KEYFRAME, DELTA
+from olalistener import OLAListener
+from test.test_olalistener import MockSelectServer, MockOlaClient
+
+def read_records(path):
+  """Returns (time, universe, kind, payload) for every record of a show"""
+  with open(path, 'rb') as show:
+    data = show.read()
+  records = []
+  offset = len(SHOW_MAGIC)
+  while offset < len(data):
+    timestamp, universe, kind, length = RECORD.unpack_from(data, offset)
+    offset += RECORD.size
+    records.append((timestamp, universe, kind, data[offset:offset + length]))
+    offset += length
+  return records
+
+def read_index(path):
+  """Returns the (time, universe, offset) entries of a show's index"""
+  with open(path + '.idx', 'rb') as index:
+    data = index.read()
+  return [INDEX_ENTRY.unpack_from(data, offset)
+          for offset in xrange(len(INDEX_MAGIC), len(data), INDEX_ENTRY.size)]
+
+class TestDelta(unittest.TestCase):
+  """Tests the delta encoding of frames"""
+
+  def test_round_trip(self):
+    """Tests that applying an encoded delta to the old frame gives the new"""
+    old = '\x00' * 512
+    new = bytearray(old)
+    new[0] = 1
+    new[3] = 2
+    new[300:310] = '\x05' * 10
+    new[511] = 255
+    payload = encode_delta(old, str(new))
+    frame = bytearray(old)
+    apply_delta(frame, payload)
+    self.assertEqual(frame, new)
+    self.assertTrue(len(payload) < 40)
+
+  def test_unchanged(self):
+    """Tests that an unchanged frame encodes to an empty delta"""
+    self.assertEqual(encode_delta('\x01' * 512, '\x01' * 512), '')
+
+class TestShowWriter(unittest.TestCase):
+  """Tests writing show files and their index"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'show.dmx')
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_keyframes_and_deltas(self):
+    """Tests that a universe starts with a keyframe, continues with deltas
+       and gets a new keyframe once KEYFRAME_INTERVAL has passed.
+    """
+    writer = ShowWriter(self.path)
+    writer.write_frame(0, 1, '\x00' * 512)
+    writer.write_frame(0, 2, '\x07' * 512)
+    writer.write_frame(25, 1, '\x01' + '\x00' * 511)
+    writer.write_frame(1000, 1, '\x02' + '\x00' * 511)
+    writer.close()
+    records = read_records(self.path)
+    self.assertEqual([record[:3] for record in records],
+                     [(0, 1, KEYFRAME), (0, 2, KEYFRAME), (25, 1, DELTA),
+                      (1000, 1, KEYFRAME)])
+    index = read_index(self.path)
+    self.assertEqual([entry[:2] for entry in index], [(0, 1), (0, 2),
+                                                      (1000, 1)])
+    with open(self.path, 'rb') as show:
+      show.seek(index[2][2])
+      self.assertEqual(RECORD.unpack(show.read(RECORD.size))[:3],
+                       (1000, 1, KEYFRAME))
+
+  def test_unchanged_frames(self):
+    """Tests that unchanged frames are left out until a keyframe is due"""
+    writer = ShowWriter(self.path)
+    for timestamp in xrange(0, 1500, 25):
+      writer.write_frame(timestamp, 1, '\x05' * 512)
+    writer.write_frame(1500, 1, '\x06' * 512)
+    writer.close()
+    records = read_records(self.path)
+    self.assertEqual([record[:3] for record in records],
+                     [(0, 1, KEYFRAME), (1000, 1, KEYFRAME),
+                      (1500, 1, DELTA)])
+    self.assertEqual(writer.frames_written, 3)
+    self.assertEqual(writer.frames_unchanged, 58)
+
+  def test_buffered(self):
+    """Tests that records are held in memory until a flush"""
+    writer = ShowWriter(self.path)
+    writer.write_frame(0, 1, '\x00' * 512)
+    self.assertEqual(os.path.getsize(self.path), len(SHOW_MAGIC))
+    writer.flush()
+    self.assertEqual(os.path.getsize(self.path),
+                     len(SHOW_MAGIC) + RECORD.size + 512)
+    writer.close()
+
+class TestDMXRecorder(unittest.TestCase):
+  """Tests recording through an OLAListener"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'show.dmx')
+    self.ola_listener = OLAListener(Queue(), MockSelectServer,
+      lambda close_callback=None: MockOlaClient(), MagicMock(), MagicMock())
+    self.ola_listener.start()
+    time.sleep(0.1) #Give the OLAListenerThread time to initialize
+
+  def tearDown(self):
+    self.ola_listener.stop()
+    shutil.rmtree(self.directory)
+
+  def test_records_every_frame(self):
+    """Tests that frames are recorded uncoalesced, for every universe"""
+    data_callbacks = {}
+    def register_universe(universe, action, data_callback, callback=None):
+      data_callbacks[universe] = data_callback
+    self.ola_listener.client.RegisterUniverse = register_universe
+    recorder = DMXRecorder(self.ola_listener, [1, 2], ShowWriter(self.path))
+    recorder.start()
+    for value in xrange(3):
+      data_callbacks[1](array.array('B', [value] * 512))
+    data_callbacks[2](array.array('B', [9] * 512))
+    recorder.stop()
+    records = read_records(self.path)
+    self.assertEqual([record[1:3] for record in records],
+                     [(1, KEYFRAME), (1, DELTA), (1, DELTA), (2, KEYFRAME)])
+    frame = bytearray(records[0][3])
+    for record in records[1:3]:
+      apply_delta(frame, record[3])
+    self.assertEqual(frame, bytearray('\x02' * 512))
+    self.assertEqual(self.ola_listener.subscribed_universes(), [])
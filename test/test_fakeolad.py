@@ -0,0 +1,115 @@
+import unittest
+import array
+import socket
+import time
+from Queue import Queue, Empty
+from ola.ClientWrapper import SelectServer
+from ola.OlaClient import OlaClient
+from fakeolad import FakeOlad, FakeDevice
+from olalistener import OLAListener, CONNECTED
+
+class TestFakeOlad(unittest.TestCase):
+  """Runs an OLAListener against a FakeOlad over a real socket"""
+
+  def start(self, **kwargs):
+    """Starts a FakeOlad with kwargs and an OLAListener connected to it"""
+    self.olad = FakeOlad(**kwargs)
+    self.olad.start()
+    self.ui_queue = Queue()
+    self.ola_listener = OLAListener(self.ui_queue, SelectServer,
+      lambda close_callback=None: OlaClient(
+        socket.create_connection(self.olad.address), close_callback),
+      None, None)
+    self.ola_listener.OLAD_ADDRESS = self.olad.address
+    self.ola_listener.start()
+    self.wait_for(lambda: self.ola_listener.state == CONNECTED)
+
+  def tearDown(self):
+    self.ola_listener.stop()
+    self.ola_listener.join(5)
+    self.olad.stop()
+
+  def wait_for(self, predicate, timeout=5):
+    """Runs UIEvents until predicate is true, failing after timeout"""
+    deadline = time.time() + timeout
+    while not predicate():
+      remaining = deadline - time.time()
+      if remaining <= 0:
+        self.fail('Timed out')
+      try:
+        self.ui_queue.get(True, min(remaining, 0.05)).run()
+      except Empty:
+        pass
+
+  def test_requests(self):
+    """Tests universes, devices, patching and DMX through the protocol"""
+    self.start(universes=[1, 2], devices=[FakeDevice(7, 'Test Device', 1, 2)])
+    results = {}
+    self.ola_listener.pull_universes(
+      lambda status, universes: results.setdefault('universes', universes))
+    self.wait_for(lambda: 'universes' in results)
+    self.assertEqual([(universe.id, universe.name)
+                      for universe in results['universes']],
+                     [(1, 'Universe 1'), (2, 'Universe 2')])
+    self.ola_listener.patch(7, 1, True, 3, 'Patched',
+      lambda status: results.setdefault('patch', status))
+    self.wait_for(lambda: 'patch' in results)
+    self.assertTrue(results['patch'].Succeeded())
+    self.assertEqual(self.olad.devices[0].output_ports[1].universe, 3)
+    self.assertEqual(self.olad.universes[3].name, 'Patched')
+    self.ola_listener.send_dmx(3, array.array('B', [1, 2, 3]),
+      lambda status: results.setdefault('sent', status))
+    self.wait_for(lambda: 'sent' in results)
+    self.ola_listener.fetch_dmx(3,
+      lambda status, universe, data: results.setdefault('dmx', data))
+    self.wait_for(lambda: 'dmx' in results)
+    self.assertEqual(list(results['dmx']), [1, 2, 3])
+
+  def test_push_and_reconnect(self):
+    """Tests that pushed frames arrive, and arrive again once the listener
+       has reconnected after a disconnection
+    """
+    self.start(universes=[1], rate=100)
+    frames = []
+    self.ola_listener.start_dmx_listener(1, lambda data:
+                                         frames.append(bytes(data)),
+                                         coalesce=False)
+    self.wait_for(lambda: len(frames) >= 5)
+    self.assertNotEqual(frames[0], frames[1])
+    self.olad.disconnect()
+    self.wait_for(lambda: self.ola_listener.reconnect_count == 1)
+    received = len(frames)
+    self.wait_for(lambda: len(frames) >= received + 5)
+    self.assertEqual(self.olad.stats()['disconnects'], 1)
+
+  def test_latency_and_drops(self):
+    """Tests that replies are delayed by the latency, and that dropped
+       requests are never answered
+    """
+    self.start(latency=0.1)
+    replies = []
+    started = time.time()
+    self.ola_listener.fetch_dmx(1, lambda status, universe, data:
+                                   replies.append(time.time() - started))
+    self.wait_for(lambda: replies)
+    self.assertGreaterEqual(replies[0], 0.1)
+    self.olad.drop = 1
+    self.ola_listener.fetch_dmx(1, lambda status, universe, data:
+                                   replies.append(time.time() - started))
+    self.assertRaises(self.failureException, self.wait_for,
+                      lambda: len(replies) > 1, 0.3)
+    self.assertEqual(self.olad.stats()['dropped'], 1)
+
+  def test_load(self):
+    """Tests 64 universes at 44Hz reach the listener"""
+    universes = range(1, 65)
+    self.start(universes=universes, rate=44)
+    counts = dict((universe, 0) for universe in universes)
+    def counter(universe):
+      def data_callback(data):
+        counts[universe] += 1
+      return data_callback
+    for universe in universes:
+      self.ola_listener.start_dmx_listener(universe, counter(universe),
+                                           coalesce=False)
+    self.wait_for(lambda: min(counts.values()) >= 20, timeout=10)
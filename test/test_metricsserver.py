@@ -0,0 +1,80 @@
+import unittest
+import array
+import urllib2
+from Queue import Queue, Empty
+from metricsserver import MetricsServer, render_metrics, CONTENT_TYPE
+from olametrics import RPCMetrics, UIMetrics
+from olalistener import OLAListener
+from test.test_olalistener import MockSelectServer, MockOlaClient
+
+class TestMetricsServer(unittest.TestCase):
+  """Tests the Prometheus exposition of the listener and UI metrics"""
+
+  def setUp(self):
+    """Creates a connected, instrumented OLAListener without its thread"""
+    self.ui_queue = Queue()
+    self.ui_metrics = UIMetrics()
+    self.ola_listener = OLAListener(self.ui_queue, MockSelectServer,
+      lambda close_callback=None: MockOlaClient(), None, None,
+      metrics=RPCMetrics(enabled=True))
+    self.ola_listener.connect()
+
+  def clear_ui_queue(self):
+    """Executes every UIEvent in the UI Queue"""
+    while True:
+      try:
+        event = self.ui_queue.get(False)
+      except Empty:
+        break
+      event.run()
+
+  def test_render(self):
+    """Tests that every counter appears in the exposition"""
+    self.ola_listener.fetch_dmx(1, None)
+    self.ola_listener.send_dmx(2, array.array('B', [0] * 512), None)
+    self.ola_listener.frame_fanout(1)(array.array('B', [0] * 512))
+    self.ui_metrics.tick(self.ui_queue.qsize())
+    self.ui_metrics.frame(1 / 60.)
+    self.ola_listener.reconnect_count = 3
+    lines = render_metrics(self.ola_listener, self.ui_metrics).splitlines()
+    self.assertIn('ola_rpiui_olad_reconnects_total 3', lines)
+    self.assertIn('ola_rpiui_ui_queue_depth 2', lines)
+    self.assertIn('ola_rpiui_ui_events_drained 2', lines)
+    self.assertIn('ola_rpiui_ui_frame_time_seconds_count 1', lines)
+    self.assertIn('ola_rpiui_dmx_frames_received_total{universe="1"} 1',
+                  lines)
+    self.assertIn('ola_rpiui_dmx_frames_sent_total{universe="2"} 1', lines)
+    self.assertIn('ola_rpiui_rpc_completed_total{request="FetchDmx"} 1',
+                  lines)
+    self.assertIn('ola_rpiui_rpc_latency_seconds_count'
+                  '{request="FetchDmx",stage="round_trip"} 1', lines)
+    self.assertIn('# TYPE ola_rpiui_rpc_latency_seconds summary', lines)
+    self.clear_ui_queue()
+    lines = render_metrics(self.ola_listener).splitlines()
+    self.assertIn('ola_rpiui_rpc_latency_seconds_count'
+                  '{request="FetchDmx",stage="ui_dispatch"} 1', lines)
+    self.assertFalse([line for line in lines if 'ui_frame_time' in line])
+
+  def test_disabled_metrics(self):
+    """Tests that only the listener's own counters are exported when its
+       RPCMetrics is disabled
+    """
+    ola_listener = OLAListener(Queue(), MockSelectServer,
+      lambda close_callback=None: MockOlaClient(), None, None)
+    text = render_metrics(ola_listener)
+    self.assertIn('ola_rpiui_olad_reconnects_total 0', text)
+    self.assertNotIn('rpc_latency', text)
+
+  def test_serve(self):
+    """Tests scraping the endpoint over HTTP"""
+    server = MetricsServer(self.ola_listener, self.ui_metrics, port=0)
+    server.start()
+    try:
+      url = 'http://127.0.0.1:%d' % server.port
+      response = urllib2.urlopen(url + '/metrics', timeout=5)
+      self.assertEqual(response.info()['Content-Type'], CONTENT_TYPE)
+      self.assertIn('ola_rpiui_ui_queue_depth 0', response.read())
+      with self.assertRaises(urllib2.HTTPError):
+        urllib2.urlopen(url + '/other', timeout=5)
+    finally:
+      server.stop()
@@ -1,14 +1,29 @@
 import unittest
 import socket
+import threading
 import array
+from collections import namedtuple
 from mock import Mock, MagicMock, patch
-from olalistener import UIEvent, OLAListener
+from olalistener import UIEvent, OLAListener, FrameMailbox, copy_frame
+from olalistener import CONNECTED, DMX_UNIVERSE_SIZE
 from ola.ClientWrapper import SelectServer
 from ola.OlaClient import OlaClient, RequestStatus, Universe
 from ola.OlaClient import Device, Plugin, Port
+from ola.rpc.SimpleRpcController import SimpleRpcController
 from Queue import Queue, Empty
 import time
 
+FakeUniverse = namedtuple('FakeUniverse', ['id', 'name', 'merge_mode'])
+def request_status(error=None):
+  """Returns a RequestStatus, failed with error if one is given"""
+  controller = SimpleRpcController()
+  if error:
+    controller.SetFailed(error)
+  return RequestStatus(controller)
+
+PortedUniverse = namedtuple('PortedUniverse', ['id', 'name', 'merge_mode',
+                                               'input_ports', 'output_ports'])
+
 class TestUIEvent(unittest.TestCase):
   """Tests the UIEvent class for passing functions to the UI"""
 
@@ -50,6 +65,53 @@ class TestUIEvent(unittest.TestCase):
     self.assertFalse(self._function_executed)
     self.assertIsNone(self._args)
 
+class TestFrameMailbox(unittest.TestCase):
+  """Tests the FrameMailbox that coalesces DMX frames for the UI"""
+
+  def setUp(self):
+    """Creates an empty mailbox and resets testing variables"""
+    self.mailbox = FrameMailbox()
+    self._frames = []
+
+  def frame_function(self, data):
+    """A function that records every frame it receives"""
+    self._frames.append(data)
+
+  def test_latest_frame_wins(self):
+    """Tests that only the newest frame posted for a universe is delivered"""
+    self.mailbox.post(1, self.frame_function, [1])
+    self.mailbox.post(1, self.frame_function, [2])
+    self.mailbox.post(1, self.frame_function, [3])
+    self.assertEqual(len(self.mailbox), 1)
+    for event in self.mailbox.collect():
+      event.run()
+    self.assertEqual(self._frames, [[3]])
+    self.assertEqual(len(self.mailbox), 0)
+
+  def test_universes_kept_apart(self):
+    """Tests that frames for different universes do not replace each other"""
+    self.mailbox.post(1, self.frame_function, [1])
+    self.mailbox.post(2, self.frame_function, [2])
+    for event in self.mailbox.collect():
+      event.run()
+    self.assertEqual(sorted(self._frames), [[1], [2]])
+
+  def test_collect_empty(self):
+    """Tests that collecting an empty mailbox returns no events"""
+    self.assertEqual(self.mailbox.collect(), [])
+
+  def test_stamps_and_coalesced(self):
+    """Tests that events carry the universe and stamp of their frame, and
+       that replaced frames are counted
+    """
+    self.mailbox.post(1, self.frame_function, [1], 10.0)
+    self.mailbox.post(1, self.frame_function, [2], 11.0)
+    self.mailbox.post(2, self.frame_function, [3])
+    events = sorted(self.mailbox.collect(), key=lambda event: event.universe)
+    self.assertEqual([(event.universe, event.stamp) for event in events],
+                     [(1, 11.0), (2, None)])
+    self.assertEqual(self.mailbox.coalesced_counts(), {1: 1})
+
 class MockSelectServer(SelectServer):
   def __init__(self):
     pass
@@ -136,6 +198,156 @@ class MockOlaClient(OlaClient):
     callback(None)
     return True
 
+class BlockingSelectServer(MockSelectServer):
+  """A MockSelectServer whose Run blocks until Terminate is called"""
+  def __init__(self):
+    self._terminated = threading.Event()
+  def Run(self):
+    self._terminated.wait()
+  def Terminate(self):
+    self._terminated.set()
+
+class TestCopyFrame(unittest.TestCase):
+  """Tests the frame copies handed to DMX subscribers"""
+
+  def test_copy(self):
+    """Tests that each frame gets its own copy, cut to a universe, whose
+       channels index as ints
+    """
+    data = array.array('B', [1] * (DMX_UNIVERSE_SIZE + 1))
+    first = copy_frame(data)
+    second = copy_frame(array.array('B', [2, 3]))
+    data[0] = 4
+    self.assertEqual(len(first), DMX_UNIVERSE_SIZE)
+    self.assertEqual(first[0], 1)
+    self.assertEqual(list(second), [2, 3])
+    self.assertEqual(array.array('B', second[:2]), array.array('B', [2, 3]))
+
+class TestConnectionSupervisor(unittest.TestCase):
+  """Tests how the OLAListener connects and reconnects to olad"""
+
+  def setUp(self):
+    """Creates an OLAListener that fails to connect a few times"""
+    self.ui_queue = Queue()
+    self.events = []
+    self.failures = 3
+    self.registered = []
+    self.ola_listener = OLAListener(self.ui_queue,
+                                    BlockingSelectServer,
+                                    self.create_ola_client,
+                                    lambda: self.events.append('start'),
+                                    lambda: self.events.append('stop'))
+    self.ola_listener.RECONNECT_MIN_DELAY = 0.01
+    self.ola_listener.olad_available = lambda: False
+
+  def tearDown(self):
+    """Stops the listener thread"""
+    self.ola_listener.stop()
+    self.ola_listener.join(1)
+
+  def create_ola_client(self, close_callback=None):
+    """Fails while self.failures is positive, then builds a client that
+       records universe registrations
+    """
+    if self.failures > 0:
+      self.failures -= 1
+      raise socket.error('Connection refused')
+    client = MockOlaClient(close_callback=close_callback)
+    def register_universe(universe, action, data_callback, callback=None):
+      """Records the registration; its status is how many were made"""
+      self.registered.append((universe, action))
+      if callback:
+        callback(len(self.registered))
+    client.RegisterUniverse = register_universe
+    return client
+
+  def run_ui_events(self):
+    """Runs every UIEvent currently in the UI queue"""
+    while True:
+      try:
+        self.ui_queue.get(True, 0.2).run()
+      except Empty:
+        return
+
+  def wait_for(self, predicate, timeout=5):
+    """Runs UIEvents until predicate is true, failing after timeout"""
+    deadline = time.time() + timeout
+    while not predicate():
+      if time.time() > deadline:
+        self.fail('Timed out')
+      try:
+        self.ui_queue.get(True, 0.05).run()
+      except Empty:
+        pass
+
+  def disconnect(self):
+    """Loses the connection, keeping olad away until self.failures is
+       set to 0
+    """
+    self.failures = float('inf')
+    self.ola_listener.olad_available = lambda: self.failures == 0
+    self.ola_listener.connection_lost()
+    self.wait_for(lambda: self.events[-1] == 'stop')
+
+  def test_single_transitions(self):
+    """Tests that repeated failures only report OLAD stopping once"""
+    self.ola_listener.start()
+    self.run_ui_events()
+    self.assertEqual(self.events, ['stop', 'start'])
+    self.assertEqual(self.ola_listener.state, CONNECTED)
+
+  def test_reconnect_restores_listeners(self):
+    """Tests that a lost connection is reported once, reconnected, and
+       that DMX listeners are registered again.
+    """
+    self.failures = 0
+    self.ola_listener.start()
+    self.run_ui_events()
+    self.ola_listener.start_dmx_listener(1, None)
+    self.ola_listener.connection_lost()
+    self.run_ui_events()
+    self.assertEqual(self.events, ['start', 'stop', 'start'])
+    self.assertEqual(self.ola_listener.reconnect_count, 1)
+    self.assertEqual([universe for universe, action in self.registered],
+                     [1, 1])
+
+  def test_subscribe_while_disconnected(self):
+    """Tests that subscriptions made while olad is not connected are left
+       to the OLAListener thread, and are called back once the universe is
+       registered after the reconnection.
+    """
+    self.failures = 0
+    self.ola_listener.start()
+    self.wait_for(lambda: self.events == ['start'])
+    self.disconnect()
+    statuses = []
+    listener = lambda data: None
+    self.ola_listener.start_dmx_listener(1, listener, statuses.append)
+    self.ola_listener.start_dmx_listener(2, listener, statuses.append)
+    self.ola_listener.stop_dmx_listener(2, listener)
+    self.assertEqual(self.ola_listener.dmx_subscribers, {})
+    self.failures = 0
+    self.wait_for(lambda: len(statuses) == 2)
+    self.assertEqual(statuses, [1, 2])
+    self.assertEqual(self.ola_listener.subscribed_universes(), [1])
+
+  def test_restored_registration_status(self):
+    """Tests that the status of a registration restored after a
+       reconnection is kept for later subscribers
+    """
+    self.failures = 0
+    self.ola_listener.start()
+    self.wait_for(lambda: self.events == ['start'])
+    statuses = []
+    self.ola_listener.start_dmx_listener(1, None, statuses.append)
+    self.wait_for(lambda: statuses)
+    self.disconnect()
+    self.failures = 0
+    self.wait_for(lambda: len(self.registered) == 2)
+    self.ola_listener.start_dmx_listener(1, None, statuses.append)
+    self.wait_for(lambda: len(statuses) == 2)
+    self.assertEqual(statuses, [1, 2])
+
 class TestOLAListener(unittest.TestCase):
   """Tests the system which gets requests from the UI and evaluates them
      using a selectserver.
@@ -159,8 +371,8 @@ class TestOLAListener(unittest.TestCase):
     return MockSelectServer()
 
   @staticmethod
-  def create_mock_ola_client():
-    return MockOlaClient()
+  def create_mock_ola_client(close_callback=None):
+    return MockOlaClient(close_callback=close_callback)
 
   def clear_ui_queue(self):
     """Executes every UIEvent in the UI Queue, then terminates"""
@@ -182,6 +394,39 @@ class TestOLAListener(unittest.TestCase):
     self.clear_ui_queue()
     self.assertTrue(self.callback_executed)
 
+  def test_poll_universes_reports_changes(self):
+    """Tests that poll_universes only reports to the UI when the universe
+       list differs from the previous poll.
+    """
+    universes = [FakeUniverse(1, "One", 0)]
+    self.ola_listener.client.FetchUniverses = \
+      lambda callback: callback(None, list(universes))
+    self.clear_ui_queue()
+    reports = []
+    def callback(status, universes):
+      reports.append([universe.name for universe in universes])
+    self.ola_listener.poll_universes(callback)
+    self.ola_listener.poll_universes(callback)
+    universes.append(FakeUniverse(2, "Two", 0))
+    self.ola_listener.poll_universes(callback)
+    universes[0] = FakeUniverse(1, "Renamed", 0)
+    self.ola_listener.poll_universes(callback)
+    self.clear_ui_queue()
+    self.assertEqual(reports, [["One"], ["One", "Two"], ["Renamed", "Two"]])
+
+  def test_poll_universes_in_flight(self):
+    """Tests that poll_universes does not issue a second fetch while the
+       first is still waiting for a reply.
+    """
+    pending = []
+    self.ola_listener.client.FetchUniverses = pending.append
+    self.ola_listener.poll_universes(None)
+    self.ola_listener.poll_universes(None)
+    self.assertEqual(len(pending), 1)
+    pending[0](None, [])
+    self.ola_listener.poll_universes(None)
+    self.assertEqual(len(pending), 2)
+
   def test_pull_devices(self):
     """Tests the OLAListener's pull_devices method"""
     self.callback_executed = False
@@ -216,6 +461,279 @@ class TestOLAListener(unittest.TestCase):
     self.clear_ui_queue()
     self.assertTrue(self.callback_executed)
 
+  def start_output(self):
+    """Replaces AddEvent and SendDmx so ticks of the output scheduler can
+       be run one at a time; returns the scheduled ticks and the sends.
+    """
+    events = []
+    sent = []
+    self.ola_listener.selectserver.AddEvent = \
+      lambda time_in_ms, callback: events.append(callback)
+    self.ola_listener.client.SendDmx = \
+      lambda universe, data, callback=None: \
+        sent.append((universe, data.tostring()))
+    return events, sent
+
+  def test_output_scheduler(self):
+    """Tests that the output scheduler only sends changed universes, apart
+       from keep-alives, and stops ticking once nothing is active.
+    """
+    events, sent = self.start_output()
+    output = self.ola_listener.output
+    output.set_frame(1, array.array('B', [1, 2, 3]))
+    events.pop()()
+    self.assertEqual(sent, [(1, '\x01\x02\x03' + '\x00' * 509)])
+    events.pop()()
+    self.assertEqual(len(sent), 1)
+    output.set_channel(1, 0, 9)
+    events.pop()()
+    self.assertEqual(sent[-1][1][:3], '\x09\x02\x03')
+    output.universes[1].last_send = 0
+    events.pop()()
+    self.assertEqual(len(sent), 3)
+    self.assertEqual(output.stats(1)['keep_alives'], 1)
+    output.remove(1)
+    events.pop()()
+    self.assertEqual(events, [])
+    output.set_frame(2, array.array('B', [4]))
+    self.assertEqual(len(events), 1)
+
+  def test_output_scheduler_late(self):
+    """Tests that late ticks are counted and skipped over"""
+    events, sent = self.start_output()
+    output = self.ola_listener.output
+    output.set_frame(1, array.array('B', [1]))
+    events.pop()
+    output.tick(output._generation, time.time() - 1)
+    stats = output.stats(1)
+    self.assertEqual(stats['late_frames'], 1)
+    self.assertTrue(stats['max_lateness'] >= 1)
+    self.assertTrue(output.ticks > output.frame_rate)
+
+  def test_output_scheduler_jitter(self):
+    """Tests that the jitter of each interval between sends is measured
+       against the ticks between them, with a clock set by the test
+    """
+    events, sent = self.start_output()
+    output = self.ola_listener.output
+    now = [1000.0]
+    output.clock = lambda: now[0]
+    output.set_frame(1, array.array('B', [1]))
+    period = 1. / output.frame_rate
+    for tick, offset, channel in ((1, 0, None), (2, 0.002, 2), (3, 0, 3),
+                                  (4, 0, None), (5, 0, 5)):
+      now[0] = 1000 + tick * period + offset
+      if channel:
+        output.set_channel(1, 0, channel)
+      events.pop()()
+    self.assertEqual(len(sent), 4)
+    stats = output.stats(1)
+    self.assertAlmostEqual(stats['max_jitter'], 0.002)
+    self.assertAlmostEqual(stats['mean_jitter'], 0.004 / 3)
+    self.assertEqual(stats['late_frames'], 0)
+
+  def test_output_scheduler_source(self):
+    """Tests that a universe's source is sent in place of its buffer"""
+    events, sent = self.start_output()
+    output = self.ola_listener.output
+    frames = [array.array('B', [7]), array.array('B', [7]), None]
+    output.set_frame(1, array.array('B', [1]))
+    output.set_source(1, lambda: frames.pop(0))
+    for tick in xrange(3):
+      events.pop()()
+    self.assertEqual([data[:1] for universe, data in sent], ['\x07', '\x01'])
+
+  def test_output_scheduler_unlocked_source(self):
+    """Tests that a source is rendered without the scheduler's lock held,
+       so it may set another universe's frame
+    """
+    events, sent = self.start_output()
+    output = self.ola_listener.output
+    def source():
+      output.set_channel(2, 0, 5)
+      return array.array('B', [7])
+    output.set_source(1, source)
+    events.pop()()
+    self.assertEqual([data[:1] for universe, data in sent], ['\x07'])
+    events.pop()()
+    self.assertEqual(sent[-1], (2, '\x05' + '\x00' * 511))
+
+  def test_batch(self):
+    """Tests that a batch sends all of its requests from one Execute and
+       delivers their statuses in a single UIEvent.
+    """
+    executes = []
+    execute = self.ola_listener.selectserver.Execute
+    def counting_execute(f):
+      executes.append(f)
+      execute(f)
+    self.ola_listener.selectserver.Execute = counting_execute
+    self.clear_ui_queue()
+    done = []
+    results = []
+    batch = self.ola_listener.batch()
+    for port in range(16):
+      batch.patch_port(1, port, True, OlaClient.PATCH, 2, done.append)
+    batch.set_universe_name(2, "Test Universe")
+    batch.execute(results.append)
+    self.assertEqual(len(executes), 1)
+    self.assertEqual(len(done), 16)
+    self.assertEqual(self.ui_queue.qsize(), 1)
+    self.clear_ui_queue()
+    self.assertEqual(results, [[None] * 17])
+
+  def test_unpatch_uses_device_index(self):
+    """Tests that a second unpatch is answered from the device index
+       without fetching the devices again.
+    """
+    fetches = []
+    fetch_devices = self.ola_listener.client.FetchDevices
+    def counting_fetch_devices(callback):
+      fetches.append(callback)
+      fetch_devices(callback)
+    self.ola_listener.client.FetchDevices = counting_fetch_devices
+    self.ola_listener.pull_devices(None)
+    self.assertEqual(len(fetches), 1)
+    self.assertEqual(self.ola_listener.device_index.ports_on_universe(50),
+                     [(1, 1, False)])
+    self.ola_listener.unpatch(50, None)
+    self.assertEqual(len(fetches), 1)
+
+  def test_unpatch_without_ports(self):
+    """Tests that unpatching a universe with no ports still calls back,
+       with a successful status
+    """
+    statuses = []
+    self.patchable_device({(1, False): 50})
+    self.clear_ui_queue()
+    self.ola_listener.unpatch(99, statuses.append)
+    self.clear_ui_queue()
+    self.assertEqual(len(statuses), 1)
+    self.assertTrue(statuses[0].Succeeded())
+
+  def test_unpatch_devices_failed(self):
+    """Tests that unpatch reports the failure to fetch the devices, and
+       sends nothing
+    """
+    patched = []
+    self.ola_listener.client.FetchDevices = \
+      lambda callback: callback(request_status('olad went away'), None)
+    self.ola_listener.client.PatchPort = \
+      lambda *args, **kwargs: patched.append(args)
+    statuses = []
+    self.clear_ui_queue()
+    self.ola_listener.unpatch(50, statuses.append)
+    self.clear_ui_queue()
+    self.assertEqual(patched, [])
+    self.assertEqual(len(statuses), 1)
+    self.assertFalse(statuses[0].Succeeded())
+    self.assertEqual(statuses[0].message, 'olad went away')
+
+  def test_patch_disconnected(self):
+    """Tests that patching and unpatching report a failure while olad is
+       not connected
+    """
+    self.ola_listener.selectserver = None
+    self.ola_listener.client = None
+    statuses = []
+    self.clear_ui_queue()
+    self.ola_listener.patch(1, 2, True, 3, "Three", statuses.append)
+    self.ola_listener.unpatch(3, statuses.append)
+    self.clear_ui_queue()
+    self.assertEqual([status.Succeeded() for status in statuses],
+                     [False, False])
+    self.assertEqual(statuses[0].message, 'olad is not connected')
+
+  def patchable_device(self, port_universes):
+    """Makes the mock olad report one device whose ports are patched as
+       port_universes says, and keep it up to date when ports are patched.
+
+       Args:
+         port_universes: a dict of (port id, is output) to the universe id
+                         the port is patched to, or None
+    """
+    def fetch_devices(callback):
+      ports = dict((is_output, []) for is_output in (False, True))
+      for (port_id, is_output), universe in sorted(port_universes.items()):
+        ports[is_output].append(Port(port_id, universe or 0,
+                                     universe is not None, "", False))
+      callback(request_status(), [Device(123, 1, "Test Device", None,
+                                         ports[False], ports[True])])
+    def patch_port(device_alias, port, is_output, action, universe,
+                   callback=None):
+      patched = action == OlaClient.PATCH
+      port_universes[(port, is_output)] = universe if patched else None
+      if callback:
+        callback(request_status())
+    def fetch_universes(callback):
+      universes = {}
+      for (port_id, is_output), universe in port_universes.items():
+        if universe is not None:
+          universes.setdefault(universe, ([], []))[is_output].append(port_id)
+      callback(None, [PortedUniverse(universe, str(universe), 0,
+                                     inputs, outputs)
+                      for universe, (inputs, outputs) in
+                      sorted(universes.items())])
+    self.ola_listener.client.FetchDevices = fetch_devices
+    self.ola_listener.client.PatchPort = patch_port
+    self.ola_listener.client.FetchUniverses = fetch_universes
+
+  def test_pull_free_ports(self):
+    """Tests that free ports come from the device index and that patching
+       and unpatching keep them up to date without fetching the devices
+       again.
+    """
+    free_ports = []
+    def callback(status, ports):
+      free_ports.append(ports)
+    self.patchable_device({(1, False): 50, (2, False): None})
+    fetches = []
+    fetch_devices = self.ola_listener.client.FetchDevices
+    def counting_fetch_devices(callback):
+      fetches.append(callback)
+      fetch_devices(callback)
+    self.ola_listener.client.FetchDevices = counting_fetch_devices
+    self.clear_ui_queue()
+    self.ola_listener.pull_free_ports(callback)
+    self.ola_listener.patch(1, 2, False, 51, "Fifty One", lambda status: None)
+    self.assertEqual(self.ola_listener.device_index.ports_on_universe(51),
+                     [(1, 2, False)])
+    self.ola_listener.pull_free_ports(callback)
+    self.ola_listener.unpatch(50, lambda status: None)
+    self.assertEqual(self.ola_listener.device_index.ports_on_universe(50), [])
+    self.ola_listener.pull_free_ports(callback)
+    self.clear_ui_queue()
+    self.assertEqual(free_ports, [[(1, "Test Device", 2, False)],
+                                  [],
+                                  [(1, "Test Device", 1, False)]])
+    self.assertEqual(len(fetches), 1)
+
+  def test_patched_by_another_client(self):
+    """Tests that ports patched and unpatched behind the listener's back are
+       picked up once poll_universes sees the universes change.
+    """
+    port_universes = {(1, False): 50, (2, False): None, (3, True): None}
+    self.patchable_device(port_universes)
+    self.clear_ui_queue()
+    self.ola_listener.poll_universes(lambda status, universes: None)
+    self.ola_listener.pull_devices(lambda status, devices: None)
+    port_universes[(3, True)] = 50
+    self.ola_listener.poll_universes(lambda status, universes: None)
+    self.assertTrue(self.ola_listener.device_index.devices_stale)
+    unpatched = []
+    self.ola_listener.unpatch(50, unpatched.append)
+    self.assertEqual(port_universes,
+                     {(1, False): None, (2, False): None, (3, True): None})
+    port_universes[(2, False)] = 52
+    self.ola_listener.poll_universes(lambda status, universes: None)
+    free_ports = []
+    self.ola_listener.pull_free_ports(
+      lambda status, ports: free_ports.append(ports))
+    self.clear_ui_queue()
+    self.assertEqual(len(unpatched), 1)
+    self.assertEqual(free_ports, [[(1, "Test Device", 1, False),
+                                   (1, "Test Device", 3, True)]])
+
   def test_fetch_dmx(self):
     """Tests the OLAListener's fetch_dmx method"""
     self.callback_executed = False
@@ -235,6 +753,87 @@ class TestOLAListener(unittest.TestCase):
     self.clear_ui_queue()
     self.assertTrue(self.callback_executed)
 
+  def test_start_dmx_listener_coalesces(self):
+    """Tests that DMX frames go to the frame mailbox rather than the
+       ui_queue, and that only the newest frame is kept.
+    """
+    frames = []
+    def data_callback(data):
+      frames.append(data)
+    def register_universe(universe, action, data_callback, callback=None):
+      data_callback(array.array('B', [1]))
+      data_callback(array.array('B', [2]))
+    self.ola_listener.client.RegisterUniverse = register_universe
+    self.clear_ui_queue()
+    self.ola_listener.start_dmx_listener(1, data_callback)
+    self.assertTrue(self.ui_queue.empty())
+    for event in self.ola_listener.frame_mailbox.collect():
+      event.run()
+    self.assertEqual([list(frame) for frame in frames], [[2]])
+
+  def test_subscribers_keep_frames(self):
+    """Tests that subscribers can index the frames they are handed and
+       keep them while more frames arrive
+    """
+    frames = []
+    def data_callback(data):
+      frames.append((data[0], array.array('B', data[:2]), data))
+    data_received = []
+    self.ola_listener.client.RegisterUniverse = \
+      lambda universe, action, data_callback, callback=None: \
+        data_received.append(data_callback)
+    self.ola_listener.start_dmx_listener(1, data_callback, coalesce=False)
+    for value in xrange(10):
+      data_received[0](array.array('B', [value, value + 1]))
+    self.assertEqual(frames[0][:2], (0, array.array('B', [0, 1])))
+    self.assertEqual([list(data) for first, pair, data in frames],
+                     [[value, value + 1] for value in xrange(10)])
+
+  def test_dmx_subscriptions_reference_counted(self):
+    """Tests that a universe is registered once for many subscribers, and
+       unregistered only after the last one leaves and the delay passes.
+    """
+    actions = []
+    events = []
+    self.ola_listener.client.RegisterUniverse = \
+      lambda universe, action, data_callback, callback=None: \
+        actions.append((universe, action))
+    self.ola_listener.selectserver.AddEvent = \
+      lambda time_in_ms, callback: events.append(callback)
+    first = lambda data: None
+    second = lambda data: None
+    self.ola_listener.start_dmx_listener(1, first)
+    self.ola_listener.start_dmx_listener(1, second)
+    self.ola_listener.start_dmx_listener(2, first)
+    self.assertEqual(actions, [(1, OlaClient.REGISTER),
+                               (2, OlaClient.REGISTER)])
+    self.assertEqual(sorted(self.ola_listener.subscribed_universes()), [1, 2])
+    self.ola_listener.stop_dmx_listener(1, first)
+    self.assertEqual(events, [])
+    self.ola_listener.stop_dmx_listener(1, second)
+    self.assertEqual(len(events), 1)
+    events.pop()()
+    self.assertEqual(actions[-1], (1, OlaClient.UNREGISTER))
+    self.assertEqual(self.ola_listener.subscribed_universes(), [2])
+
+  def test_dmx_resubscribe_cancels_unregister(self):
+    """Tests that subscribing again before the unregister delay passes
+       keeps the universe registered without any further RPC.
+    """
+    actions = []
+    events = []
+    self.ola_listener.client.RegisterUniverse = \
+      lambda universe, action, data_callback, callback=None: \
+        actions.append((universe, action))
+    self.ola_listener.selectserver.AddEvent = \
+      lambda time_in_ms, callback: events.append(callback)
+    listener = lambda data: None
+    self.ola_listener.start_dmx_listener(1, listener)
+    self.ola_listener.stop_dmx_listener(1, listener)
+    self.ola_listener.start_dmx_listener(1, listener)
+    events.pop()()
+    self.assertEqual(actions, [(1, OlaClient.REGISTER)])
+
   def test_stop_dmx_listener(self):
     """Tests the OLAListener's stop_dmx_listener method"""
     self.callback_executed = False
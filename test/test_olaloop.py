@@ -0,0 +1,81 @@
+import unittest
+import socket
+import array
+from olaloop import OLALoop
+from test.test_olalistener import MockOlaClient
+
+class SocketOlaClient(MockOlaClient):
+  """A MockOlaClient with a real socket; each byte written to the other end
+     delivers one DMX frame to the registered universe callbacks.
+  """
+  def __init__(self, our_socket=None, close_callback=None):
+    self.ours, self.theirs = socket.socketpair()
+    self.data_callbacks = {}
+  def GetSocket(self):
+    return self.ours
+  def SocketReady(self):
+    value = ord(self.ours.recv(1))
+    for data_callback in self.data_callbacks.values():
+      data_callback(array.array('B', [value]))
+  def RegisterUniverse(self, universe, action, data_callback, callback=None):
+    if action == self.REGISTER:
+      self.data_callbacks[universe] = data_callback
+    else:
+      self.data_callbacks.pop(universe, None)
+    if callback:
+      callback(None)
+
+class TestOLALoop(unittest.TestCase):
+  """Tests the single-threaded OLALoop front-end"""
+
+  def setUp(self):
+    """Creates an OLALoop around a client with a real socket"""
+    self.client = SocketOlaClient()
+    self.ola_loop = OLALoop(self.client, timeout=0.5)
+
+  def test_wait_many(self):
+    """Tests that several requests can be sent before waiting on them"""
+    devices = self.ola_loop.pull_devices()
+    dmx = self.ola_loop.fetch_dmx(1)
+    sent = self.ola_loop.send_dmx(1, array.array('B', [1, 2, 3]))
+    results = self.ola_loop.wait(devices, dmx, sent)
+    self.assertEqual(results[0][1][0].name, "Test Device")
+    self.assertEqual(results[1][2], [0, 1, 2, 3])
+    self.assertEqual(results[2], (None,))
+
+  def test_unpatch(self):
+    """Tests that unpatch finds the ports patched to the universe"""
+    results = self.ola_loop.unpatch(50)
+    self.assertEqual(len(results), 1)
+    self.assertEqual(self.ola_loop.wait(*results), (None,))
+
+  def test_subscribe(self):
+    """Tests that a subscription iterates over frames as they arrive"""
+    subscription = self.ola_loop.subscribe(1)
+    self.client.theirs.send('\x05\x06')
+    self.assertEqual(subscription.next(), array.array('B', [5]))
+    self.assertEqual(subscription.next(), array.array('B', [6]))
+    subscription.close()
+    self.assertEqual(self.client.data_callbacks, {})
+    self.assertRaises(StopIteration, subscription.next)
+
+  def test_subscribe_twice(self):
+    """Tests that two subscriptions to a universe share one registration,
+       which is only dropped with the last of them
+    """
+    first = self.ola_loop.subscribe(1)
+    second = self.ola_loop.subscribe(1)
+    self.client.theirs.send('\x05')
+    self.assertEqual(first.next(), array.array('B', [5]))
+    self.assertEqual(second.next(), array.array('B', [5]))
+    first.close()
+    self.assertIn(1, self.client.data_callbacks)
+    self.client.theirs.send('\x06')
+    self.assertEqual(second.next(), array.array('B', [6]))
+    second.close()
+    self.assertEqual(self.client.data_callbacks, {})
+
+  def test_timeout(self):
+    """Tests that waiting for a frame that never comes times out"""
+    subscription = self.ola_loop.subscribe(1)
+    self.assertRaises(socket.timeout, subscription.next, 0.05)
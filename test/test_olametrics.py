@@ -0,0 +1,149 @@
+import unittest
+import array
+import time
+from Queue import Queue, Empty
+from olametrics import Histogram, FrameCounter, RPCMetrics, FrameLatency
+from olametrics import QUEUE_WAIT, ROUND_TRIP, UI_DISPATCH
+from olalistener import OLAListener
+from test.test_olalistener import MockSelectServer, MockOlaClient
+
+class TestHistogram(unittest.TestCase):
+  """Tests the latency Histogram"""
+
+  def test_empty(self):
+    """Tests that an empty histogram reports zeros"""
+    snapshot = Histogram().snapshot()
+    self.assertEqual(snapshot['count'], 0)
+    self.assertEqual(snapshot['p99'], 0.0)
+
+  def test_quantiles(self):
+    """Tests that quantiles are the upper bound of the bucket they fall in,
+       and never more than the largest latency seen.
+    """
+    histogram = Histogram()
+    for i in xrange(98):
+      histogram.observe(0.00015)
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    self.assertEqual(histogram.count, 100)
+    self.assertAlmostEqual(histogram.quantile(0.5), 0.0002)
+    self.assertAlmostEqual(histogram.quantile(0.99), 0.1024)
+    self.assertEqual(histogram.quantile(1.0), 0.5)
+    histogram.observe(100)
+    self.assertEqual(histogram.counts[-1], 1)
+    self.assertEqual(histogram.quantile(1.0), 100)
+
+class TestFrameCounter(unittest.TestCase):
+  """Tests the per universe FrameCounter"""
+
+  def test_rate(self):
+    """Tests that the rate is taken over each window and falls once frames
+       stop arriving
+    """
+    counter = FrameCounter(0.0)
+    for i in xrange(1, 41):
+      counter.frame(i * 0.025)
+    self.assertEqual(counter.frames, 40)
+    self.assertAlmostEqual(counter.current_rate(1.0), 40.0)
+    self.assertAlmostEqual(counter.current_rate(5.0), 0.0)
+
+class TestFrameLatency(unittest.TestCase):
+  """Tests the measurement of how stale the frames the UI draws are"""
+
+  def test_stages(self):
+    """Tests that each frame is split into its stages once drawn"""
+    latency = FrameLatency(window=4)
+    self.assertTrue(latency.handled(1, 0.0, 0.010, 0.012))
+    self.assertFalse(latency.handled(2, 0.005, 0.010, 0.011))
+    self.assertEqual(latency.snapshot(), {})
+    latency.drawn(0.020)
+    self.assertEqual(latency.pending, [])
+    snapshot = latency.snapshot()
+    self.assertAlmostEqual(snapshot[1]['queue']['p50'], 0.010)
+    self.assertAlmostEqual(snapshot[1]['update']['p50'], 0.002)
+    self.assertAlmostEqual(snapshot[1]['render']['p50'], 0.008)
+    self.assertAlmostEqual(snapshot[1]['total']['p99'], 0.020)
+    self.assertAlmostEqual(snapshot[2]['total']['p50'], 0.015)
+
+  def test_rolling_window(self):
+    """Tests that only the last frames of the window count"""
+    latency = FrameLatency(window=4)
+    for stamp in xrange(10):
+      latency.handled(1, -stamp, 0, 0)
+    latency.drawn(0)
+    total = latency.snapshot()[1]['total']
+    self.assertEqual(total['p50'], 8)
+    self.assertEqual(total['p99'], 9)
+
+class TestRPCMetrics(unittest.TestCase):
+  """Tests an OLAListener instrumented with an enabled RPCMetrics"""
+
+  def setUp(self):
+    """Creates a connected OLAListener without running its thread"""
+    self.ui_queue = Queue()
+    self.metrics = RPCMetrics(enabled=True)
+    self.ola_listener = OLAListener(self.ui_queue, MockSelectServer,
+      lambda close_callback=None: MockOlaClient(), None, None,
+      metrics=self.metrics)
+    self.ola_listener.connect()
+
+  def clear_ui_queue(self):
+    """Executes every UIEvent in the UI Queue"""
+    while True:
+      try:
+        event = self.ui_queue.get(False)
+      except Empty:
+        break
+      event.run()
+
+  def test_disabled(self):
+    """Tests that a disabled RPCMetrics installs nothing"""
+    ola_listener = OLAListener(Queue(), MockSelectServer,
+      lambda close_callback=None: MockOlaClient(), None, None)
+    ola_listener.connect()
+    self.assertFalse(ola_listener.metrics.enabled)
+    self.assertIsInstance(ola_listener.client, MockOlaClient)
+    self.assertIsInstance(ola_listener.selectserver, MockSelectServer)
+
+  def test_request_stages(self):
+    """Tests that a request is measured from Execute to the UI"""
+    received = []
+    self.ola_listener.fetch_dmx(1, lambda status, universe, data:
+                                   received.append(data))
+    self.clear_ui_queue()
+    self.assertEqual(len(received), 1)
+    fetch_dmx = self.metrics.snapshot()['requests']['FetchDmx']
+    self.assertEqual(fetch_dmx['in_flight'], 0)
+    self.assertEqual(fetch_dmx['completed'], 1)
+    for stage in (QUEUE_WAIT, ROUND_TRIP, UI_DISPATCH):
+      self.assertEqual(fetch_dmx[stage]['count'], 1)
+
+  def test_in_flight(self):
+    """Tests that requests olad has not answered are counted"""
+    self.ola_listener.client._client.FetchDmx = \
+      lambda universe, callback: None
+    self.ola_listener.fetch_dmx(1, None)
+    self.ola_listener.fetch_dmx(2, None)
+    fetch_dmx = self.metrics.snapshot()['requests']['FetchDmx']
+    self.assertEqual(fetch_dmx['in_flight'], 2)
+    self.assertEqual(fetch_dmx['completed'], 0)
+    self.assertNotIn(ROUND_TRIP, fetch_dmx)
+
+  def test_frames_counted(self):
+    """Tests that DMX frames are counted per universe"""
+    data_received = self.ola_listener.frame_fanout(3)
+    frame = array.array('B', [0] * 512)
+    for i in xrange(5):
+      data_received(frame)
+    self.assertEqual(self.metrics.snapshot()['universes'][3]['frames'], 5)
+
+  def test_frames_stamped(self):
+    """Tests that frames posted to the frame mailbox carry their arrival
+       time
+    """
+    self.ola_listener.dmx_subscribers[3] = [(lambda data: None, True)]
+    before = time.time()
+    self.ola_listener.frame_fanout(3)(array.array('B', [0] * 512))
+    event = self.ola_listener.frame_mailbox.collect()[0]
+    self.assertEqual(event.universe, 3)
+    self.assertTrue(before <= event.stamp <= time.time())
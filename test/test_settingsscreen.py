@@ -0,0 +1,99 @@
+import unittest
+
+try:
+  from kivy.event import EventDispatcher
+  from kivy.properties import StringProperty
+  from kivy.uix.listview import SelectableView
+  from settingsscreen import UniverseListAdapter
+except ImportError:
+  UniverseListAdapter = None
+
+class TestUniverse(object):
+  """Stands in for an ola Universe"""
+
+  def __init__(self, id, name):
+    self.id = id
+    self.name = name
+
+if UniverseListAdapter:
+  class RowView(SelectableView, EventDispatcher):
+    """A list row that needs no window to be built"""
+    text = StringProperty('')
+
+    def __init__(self, **kwargs):
+      self.register_event_type('on_release')
+      self.children = []
+      super(RowView, self).__init__(**kwargs)
+
+    def on_release(self):
+      pass
+
+@unittest.skipIf(UniverseListAdapter is None, 'The adapter needs Kivy')
+class TestUniverseListAdapter(unittest.TestCase):
+  """Tests that universe polls update the list rows in place"""
+
+  def setUp(self):
+    self.adapter = UniverseListAdapter(data=[],
+      args_converter=lambda index, universe: {'text': universe.name},
+      selection_mode='single', allow_empty_selection=False, cls=RowView)
+    self.selected = []
+    self.adapter.bind(on_selection_change=self.selection_changed)
+    self.adapter.apply_universes([TestUniverse(1, 'One'),
+                                  TestUniverse(2, 'Two')])
+    self.views = [self.adapter.get_view(0), self.adapter.get_view(1)]
+
+  def selection_changed(self, adapter):
+    """Records the selected universe the way MainScreen does"""
+    if adapter.selection:
+      self.selected.append(adapter.data[adapter.selection[0].index])
+    else:
+      self.selected.append(None)
+
+  def test_initial_selection(self):
+    """Tests that the first universe is selected once"""
+    self.assertEqual([universe.id for universe in self.selected], [1])
+
+  def test_add(self):
+    """Tests that existing rows are kept when a universe is inserted"""
+    self.adapter.apply_universes([TestUniverse(3, 'Three'),
+                                  TestUniverse(1, 'One'),
+                                  TestUniverse(2, 'Two')])
+    self.assertIs(self.adapter.get_view(1), self.views[0])
+    self.assertIs(self.adapter.get_view(2), self.views[1])
+    self.assertEqual(self.adapter.get_view(0).text, 'Three')
+    self.assertEqual(self.adapter.selection, [self.views[0]])
+    self.assertEqual(len(self.selected), 1)
+
+  def test_remove(self):
+    """Tests that removing the selected universe selects the first row,
+       dispatching once
+    """
+    self.adapter.apply_universes([TestUniverse(2, 'Two')])
+    self.assertIs(self.adapter.get_view(0), self.views[1])
+    self.assertEqual(self.adapter.selection, [self.views[1]])
+    self.assertEqual([universe.id for universe in self.selected], [1, 2])
+
+  def test_rename(self):
+    """Tests that a renamed row keeps its view and does not dispatch"""
+    self.adapter.apply_universes([TestUniverse(1, 'One'),
+                                  TestUniverse(2, 'Renamed')])
+    self.assertIs(self.adapter.get_view(1), self.views[1])
+    self.assertEqual(self.views[1].text, 'Renamed')
+    self.assertEqual(len(self.selected), 1)
+
+  def test_rename_selected(self):
+    """Tests that renaming the selected universe hands out the new Universe
+       object, dispatching once
+    """
+    renamed = TestUniverse(1, 'Renamed')
+    self.adapter.apply_universes([renamed, TestUniverse(2, 'Two')])
+    self.assertIs(self.adapter.get_view(0), self.views[0])
+    self.assertEqual(self.views[0].text, 'Renamed')
+    self.assertEqual(len(self.selected), 2)
+    self.assertIs(self.selected[-1], renamed)
+
+  def test_unchanged(self):
+    """Tests that an unchanged poll does nothing"""
+    self.adapter.apply_universes([TestUniverse(1, 'One'),
+                                  TestUniverse(2, 'Two')])
+    self.assertEqual(len(self.selected), 1)
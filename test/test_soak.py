@@ -0,0 +1,39 @@
+import unittest
+from soak import growth_per_hour, MemorySampler, SoakPipeline, soak
+
+class TestSoak(unittest.TestCase):
+  """Tests the memory growth measurement of the soak harness"""
+
+  def test_growth_per_hour(self):
+    """Tests the least squares slope through the samples"""
+    self.assertEqual(growth_per_hour([]), 0.0)
+    self.assertEqual(growth_per_hour([(0, 100)]), 0.0)
+    samples = [(0, 1000), (60, 1200), (120, 900), (180, 1100),
+               (3600, 2000)]
+    self.assertAlmostEqual(growth_per_hour([(t, 5 * t) for t, v in samples]),
+                           5 * 3600)
+    flat = growth_per_hour([(t, 1000) for t, v in samples])
+    self.assertEqual(flat, 0.0)
+
+  def test_warmup(self):
+    """Tests that samples taken during the warm up do not count"""
+    sampler = MemorySampler(warmup=3600)
+    sampler.sample()
+    self.assertEqual(sampler.samples, [])
+    self.assertEqual(sampler.type_growth(), [])
+    sampler.warmup = 0
+    sampler.sample()
+    retained = [object() for i in xrange(1000)]
+    sampler.sample()
+    self.assertEqual(len(sampler.samples), 2)
+    self.assertIn('list', dict(sampler.type_growth(count=1000)))
+
+  def test_short_soak(self):
+    """Tests a short soak through a FakeOlad"""
+    passed, report = soak(1.5, 0.25, 0, float('inf'),
+                          SoakPipeline(universes=2, rate=44, ui=False))
+    self.assertTrue(passed)
+    self.assertGreater(report['frames'], 0)
+    self.assertGreater(report['replies'], 0)
+    self.assertGreater(len(report['samples']), 2)
+    self.assertEqual(report['olad']['disconnects'], 0)
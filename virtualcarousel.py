@@ -0,0 +1,155 @@
+"""Keeps a Carousel of channel widgets virtualized, so that only the shown
+   slide and its neighbours hold live widgets.
+"""
+
+import kivy
+from kivy.uix.stacklayout import StackLayout
+
+class VirtualCarousel(object):
+  """Splits a number of channels into pages on a Carousel, but only fills
+     the current page and its neighbours with widgets.  Widgets from pages
+     that scroll out of reach are returned to a pool and reused, so the
+     number of widgets depends on how many fit on the screen, not on the
+     number of channels.
+
+     Args:
+       carousel: the Carousel to place the pages on
+       channel_count: the total number of channels to page through
+       create_widget: builds a new widget for the pool, takes no arguments
+       bind_widget: points a widget at a channel, takes the widget and the
+                    0-based channel index
+  """
+
+  def __init__(self, carousel, channel_count, create_widget, bind_widget):
+    self.carousel = carousel
+    self.channel_count = channel_count
+    self.create_widget = create_widget
+    self.bind_widget = bind_widget
+    self.channels_per_page = 0
+    self.pages = []
+    self.live_pages = {}
+    self.widgets = {}
+    self.pool = []
+
+  def layout(self, channels_per_page):
+    """Moves the channels onto pages for a new number of channels per page.
+       Nothing is done if the number is unchanged; otherwise slides are only
+       added or removed at the end, and live widgets whose channel stays on
+       the same slide are left where they are.
+
+       Args:
+         channels_per_page: how many channel widgets fit on one slide
+    """
+    channels_per_page = max(channels_per_page, 1)
+    if channels_per_page == self.channels_per_page:
+      return
+    self.channels_per_page = channels_per_page
+    page_count = (self.channel_count + channels_per_page - 1) / \
+                 channels_per_page
+    kept_pages = {}
+    for page_index, items in self.live_pages.items():
+      kept_pages[page_index] = self.drop_moved(page_index, items)
+    self.live_pages = {}
+    while len(self.pages) > page_count:
+      self.carousel.remove_widget(self.pages.pop())
+    while len(self.pages) < page_count:
+      slide = StackLayout(size_hint_x=1, size_hint_y=1)
+      self.pages.append(slide)
+      self.carousel.add_widget(slide)
+    for page_index, kept in kept_pages.items():
+      if page_index < page_count:
+        self.refill_page(page_index, kept)
+    self.show(self.carousel.index)
+
+  def drop_moved(self, page_index, items):
+    """Returns the widgets of channels that stay on a page to the pool.
+
+       Args:
+         page_index: the index of a live page
+         items: the (channel index, widget) pairs it held
+       Returns:
+         the (channel index, widget) pairs that stay on the page
+    """
+    slide = self.pages[page_index]
+    channels = self.page_channels(page_index)
+    kept = []
+    for channel_index, widget in items:
+      if channels and channels[0] <= channel_index <= channels[-1]:
+        kept.append((channel_index, widget))
+      else:
+        slide.remove_widget(widget)
+        del self.widgets[channel_index]
+        self.pool.append(widget)
+    return kept
+
+  def refill_page(self, page_index, kept):
+    """Fills the channels of a page around the widgets that stayed on it,
+       adding new widgets before and after them so the order is kept.
+    """
+    if not kept:
+      self.fill_page(page_index)
+      return
+    slide = self.pages[page_index]
+    channels = self.page_channels(page_index)
+    before = []
+    for channel_index in reversed(xrange(channels[0], kept[0][0])):
+      widget = self.take_widget(channel_index)
+      slide.add_widget(widget, len(slide.children))
+      before.insert(0, (channel_index, widget))
+    after = []
+    for channel_index in xrange(kept[-1][0] + 1, channels[-1] + 1):
+      widget = self.take_widget(channel_index)
+      slide.add_widget(widget)
+      after.append((channel_index, widget))
+    self.live_pages[page_index] = before + kept + after
+
+  def show(self, page_index):
+    """Fills the pages within reach of page_index with widgets and releases
+       the widgets of every other page.
+
+       Args:
+         page_index: the index of the slide being shown
+    """
+    page_index = page_index or 0
+    wanted = [index for index in (page_index - 1, page_index, page_index + 1)
+              if 0 <= index < len(self.pages)]
+    for index in self.live_pages.keys():
+      if index not in wanted:
+        self.release_page(index)
+    for index in wanted:
+      if index not in self.live_pages:
+        self.fill_page(index)
+
+  def page_channels(self, page_index):
+    """Returns the channel indices shown on a page"""
+    first = page_index * self.channels_per_page
+    return xrange(first, min(first + self.channels_per_page,
+                             self.channel_count))
+
+  def take_widget(self, channel_index):
+    """Takes a widget from the pool, or builds one, and binds it"""
+    widget = self.pool.pop() if self.pool else self.create_widget()
+    self.bind_widget(widget, channel_index)
+    self.widgets[channel_index] = widget
+    return widget
+
+  def fill_page(self, page_index):
+    """Binds pooled widgets to every channel of a page and adds them"""
+    slide = self.pages[page_index]
+    widgets = []
+    for channel_index in self.page_channels(page_index):
+      widget = self.take_widget(channel_index)
+      slide.add_widget(widget)
+      widgets.append((channel_index, widget))
+    self.live_pages[page_index] = widgets
+
+  def release_page(self, page_index):
+    """Removes the widgets of a page and returns them to the pool"""
+    self.pages[page_index].clear_widgets()
+    for channel_index, widget in self.live_pages.pop(page_index):
+      del self.widgets[channel_index]
+      self.pool.append(widget)
+
+  def live_widgets(self):
+    """Returns (channel index, widget) pairs for every live widget"""
+    return self.widgets.items()